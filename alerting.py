@@ -98,6 +98,29 @@ def _attach_image(
     msg.add_attachment(data, maintype=maintype, subtype=subtype, filename=derived_name)
 
 
+def _claim_cooldown(key: str) -> bool:
+    """Take the alert cooldown for ``key``, shared by every app worker on the host."""
+    # Opt-in: by default every flagged frame alerts, as before cooldowns existed
+    cooldown = _float_env("ALERT_COOLDOWN_SECONDS", 0.0)
+    if cooldown <= 0:
+        return True
+    try:
+        from shared_state import get_shared_state
+
+        return get_shared_state().claim(f"alert:{key}", cooldown)
+    except Exception as exc:  # noqa: BLE001
+        # Better a duplicate alert than a missed one
+        print(f"[alerting] cooldown check failed, sending anyway: {exc}")
+        return True
+
+
+def _release_cooldown(key: str) -> None:
+    with suppress(Exception):
+        from shared_state import get_shared_state
+
+        get_shared_state().release(f"alert:{key}")
+
+
 def _build_body(score: float, indicators: Sequence[str], source: str, extra: Optional[Mapping[str, str]]) -> str:
     lines = [
         "A new suicide-risk event was detected.",
@@ -122,8 +145,13 @@ def notify_risk_detection(
     image_bytes: Optional[bytes] = None,
     filename: Optional[str] = None,
     extra: Optional[Mapping[str, str]] = None,
+    cooldown_key: Optional[str] = None,
 ) -> bool:
-    """Send an email alert if thresholds are exceeded. Returns True when an email was attempted."""
+    """Send an email alert if thresholds are exceeded. Returns True when an email was attempted.
+
+    With ``ALERT_COOLDOWN_SECONDS`` set, at most one alert per ``cooldown_key``
+    (default: ``source``) is sent in that window, across all workers.
+    """
 
     if not alerts_enabled():
         return False
@@ -151,6 +179,10 @@ def notify_risk_detection(
     if not (host and username and password):
         return False
 
+    cooldown_key = cooldown_key or source
+    if not _claim_cooldown(cooldown_key):
+        return False
+
     use_ssl = _bool_env("SMTP_USE_SSL", False)
     use_tls = _bool_env("SMTP_USE_TLS", True)
 
@@ -171,6 +203,7 @@ def notify_risk_detection(
         return True
     except Exception as exc:  # noqa: BLE001
         print(f"[alerting] failed to send email: {exc}")
+        _release_cooldown(cooldown_key)
         if server is not None:
             with suppress(Exception):
                 server.quit()
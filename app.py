@@ -1,15 +1,40 @@
+import atexit
+import json
 import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from pathlib import Path
-from flask import Flask, request, redirect, url_for, render_template, send_from_directory, flash, session
+from typing import Optional
+from flask import Flask, Response, request, redirect, url_for, render_template, send_from_directory, flash, session
 from flask_socketio import SocketIO
 import base64
+import secrets
 from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
 
-from alerting import notify_risk_detection
-
+# Before importing local modules: detector reads MODEL_NAME, PRESCREEN, ... at import
 load_dotenv()
 
+import detector  # noqa: E402
+from alerting import notify_risk_detection, risk_exceeds_threshold
+from export import build_export, export_filename, parse_time, select_entries
+from storage import (
+    CLIP_SUFFIXES,
+    IMAGE_SUFFIXES,
+    BlobStore,
+    GalleryIndex,
+    RenderCache,
+    RetentionPolicy,
+    RetentionSweeper,
+    detections_path,
+    read_detections,
+)
+from scheduler import SamplingScheduler
+from timeseries import FLAG_CACHED, FLAG_FAILED, FLAG_FLAGGED, FLAG_SKIPPED, RiskHistory
+from uploads import MAX_FIELD_BYTES, UploadTracker, iter_multipart
+from usage import get_usage_tracker
+
 def create_app():
     app = Flask(__name__)
     app.config['SECRET_KEY'] = 'dev-secret'
@@ -17,12 +42,95 @@ def create_app():
     app.config['UPLOAD_FOLDER'] = str(Path('uploads'))
     app.config['ANNOTATED_FOLDER'] = str(Path('annotated'))
     app.config['GALLERY_FOLDER'] = str(Path('gallery'))
+    app.config['CLIPS_FOLDER'] = os.getenv('CLIPS_FOLDER', str(Path('clips')))
+    app.config['BLOB_FOLDER'] = os.getenv('BLOB_FOLDER', str(Path('blobs')))
+    app.config['GALLERY_INDEX'] = os.getenv('GALLERY_INDEX', str(Path('gallery') / 'index.sqlite3'))
     app.config['ALLOWED_EXTENSIONS'] = {'.jpg', '.jpeg', '.png'}
 
     Path(app.config['UPLOAD_FOLDER']).mkdir(exist_ok=True)
     Path(app.config['ANNOTATED_FOLDER']).mkdir(exist_ok=True)
     Path(app.config['GALLERY_FOLDER']).mkdir(exist_ok=True)
 
+    blobs = BlobStore(app.config['BLOB_FOLDER'])
+    gallery_index = GalleryIndex(app.config['GALLERY_INDEX'])
+    sweeper = RetentionSweeper(
+        folders={
+            'uploads': (app.config['UPLOAD_FOLDER'], RetentionPolicy.from_env('uploads'), IMAGE_SUFFIXES),
+            'annotated': (app.config['ANNOTATED_FOLDER'], RetentionPolicy.from_env('annotated'), IMAGE_SUFFIXES),
+            'gallery': (app.config['GALLERY_FOLDER'], RetentionPolicy.from_env('gallery'), IMAGE_SUFFIXES),
+            'clips': (app.config['CLIPS_FOLDER'], RetentionPolicy.from_env('clips'), CLIP_SUFFIXES),
+        },
+        blobs=blobs,
+        gallery_index=gallery_index,
+        gallery_folder=app.config['GALLERY_FOLDER'],
+        interval=float(os.getenv('RETENTION_SWEEP_SECONDS', '600')),
+    )
+    if sweeper.interval > 0:
+        sweeper.start()
+
+    detection_pool = ThreadPoolExecutor(
+        max_workers=max(1, int(os.getenv('DETECTION_WORKERS', '4'))),
+        thread_name_prefix='detect',
+    )
+    uploads = UploadTracker(emit=lambda event: socketio.emit('upload_progress', event))
+    annotated_cache = RenderCache(
+        app.config['ANNOTATED_FOLDER'],
+        max_bytes=int(float(os.getenv('ANNOTATED_CACHE_MB', '256')) * 1024 * 1024),
+    )
+    scheduler = SamplingScheduler.from_env()
+    retention_days = os.getenv('RISK_HISTORY_DAYS', '30')
+    history = RiskHistory(
+        os.getenv('RISK_HISTORY_FOLDER', str(Path('history'))),
+        flush_interval=float(os.getenv('RISK_HISTORY_FLUSH_SECONDS', '2')),
+        retention_days=float(retention_days) if retention_days else None,
+    )
+    history.start()
+    # Write the last few seconds of buffered rows and the still-open rollup minutes on exit
+    atexit.register(history.stop)
+    usage = get_usage_tracker()
+    usage.start()
+    atexit.register(usage.flush)
+
+    def record_history(source: str, result: dict, latency_ms: float, flagged: bool) -> None:
+        flags = (
+            (FLAG_SKIPPED if result.get('skipped') else 0)
+            | (FLAG_FAILED if result.get('failed') else 0)
+            | (FLAG_CACHED if result.get('cached') else 0)
+            | (FLAG_FLAGGED if flagged else 0)
+        )
+        history.record(source, result.get('score', 0.0), result.get('indicators') or (), latency_ms, flags)
+    if os.getenv('WARMUP_ON_START', 'true').strip().lower() in {'1', 'true', 'yes', 'on'}:
+        # Off the request path: the server accepts connections while this runs
+        threading.Thread(target=detector.warm_up, name='warmup', daemon=True).start()
+
+    def schedule_next(source: str, result: dict, raw: bytes) -> None:
+        score = None if result.get('failed') else result.get('score', 0.0)
+        result['next_check_ms'] = int(scheduler.observe(source, score, raw) * 1000)
+
+    def add_to_gallery(name: str, data: bytes, metadata: dict) -> Path:
+        gallery_path = Path(app.config['GALLERY_FOLDER']) / name
+        blobs.store(data, gallery_path)
+        with open(gallery_path.with_suffix('.json'), 'w') as f:
+            json.dump(metadata, f, indent=2)
+        gallery_index.upsert(name, metadata, time.time(), gallery_path.stat().st_size)
+        return gallery_path
+
+    def frame_name(prefix: str, ext: str = '.jpg') -> str:
+        # Several cameras (or workers) can save within the same millisecond
+        return f"{prefix}_{int(time.time()*1000)}_{secrets.token_hex(3)}{ext}"
+
+    def annotated_name(name: str) -> str:
+        return Path(name).stem + '_annotated' + Path(name).suffix
+
+    def find_original(name: str) -> Optional[Path]:
+        """Locate an uploaded or gallery image by file name."""
+        name = secure_filename(name)
+        for folder in (app.config['UPLOAD_FOLDER'], app.config['GALLERY_FOLDER']):
+            path = Path(folder) / name
+            if name and path.is_file():
+                return path
+        return None
+
     def allowed_file(filename: str) -> bool:
         return Path(filename).suffix.lower() in app.config['ALLOWED_EXTENSIONS']
 
@@ -49,33 +157,76 @@ def create_app():
     @app.route('/gallery')
     @require_auth
     def gallery():
-        risk_images = []
-        gallery_path = Path(app.config['GALLERY_FOLDER'])
-        for img_path in sorted(gallery_path.glob('*'), key=lambda x: x.stat().st_mtime, reverse=True):
-            if img_path.suffix.lower() not in app.config['ALLOWED_EXTENSIONS']:
-                continue
-            metadata_path = img_path.with_suffix('.json')
-            metadata = {}
-            if metadata_path.exists():
-                import json
-                try:
-                    with open(metadata_path, 'r') as f:
-                        metadata = json.load(f)
-                except:
-                    metadata = {}
-            
-            risk_images.append({
-                'filename': img_path.name,
-                'timestamp': metadata.get('timestamp', 'Unknown'),
-                'score': metadata.get('score', 0),
-                'indicators': metadata.get('indicators', [])
-            })
-        
+        if gallery_index.is_empty():
+            # First run (or a deleted index): build it from the folder once
+            gallery_index.reconcile(app.config['GALLERY_FOLDER'])
+        risk_images = gallery_index.entries()
+        clips_folder = Path(app.config['CLIPS_FOLDER'])
+        for image in risk_images:
+            # The clip is named when the frame is saved but written after its post-event
+            # window; link it only once the sender has finished it
+            if image.get('clip') and not (clips_folder / image['clip']).is_file():
+                image['clip'] = None
         return render_template('gallery.html', 
                              risk_images=risk_images, 
                              auth_enabled=auth_enabled(), 
                              logged_in=logged_in())
 
+    def detection_job(batch_id: str, filename: str, save_path: Path, prompt: str) -> None:
+        uploads.update(batch_id, filename, 'detecting')
+        try:
+            result = detector.run_detection(image_path=str(save_path), prompt=prompt, source='upload')
+        except Exception as e:
+            msg = str(e)
+            overloaded = '503' in msg or 'UNAVAILABLE' in msg.upper() or 'overloaded' in msg.lower()
+            uploads.update(batch_id, filename, 'failed', error=msg, overloaded=overloaded)
+            return
+        uploads.update(batch_id, filename, 'done', annotated=annotated_name(filename), boxes=len(result['boxes']))
+
+    def reserve_upload_path(original_name: str) -> Path:
+        """A new, empty file in the upload folder named after ``original_name``.
+
+        Names that ``secure_filename`` maps to an existing file get a ``_1``, ``_2``, ...
+        suffix instead of replacing it; creating the file claims the name.
+        """
+        filename = secure_filename(original_name)
+        suffix = Path(original_name).suffix.lower()
+        stem = Path(filename).stem if Path(filename).suffix.lower() == suffix else ''
+        stem = stem or 'upload'
+        folder = Path(app.config['UPLOAD_FOLDER'])
+        n = 0
+        while True:
+            path = folder / (f'{stem}{suffix}' if n == 0 else f'{stem}_{n}{suffix}')
+            try:
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return path
+            except FileExistsError:
+                n += 1
+
+    def accept_upload(batch_id: str, original_name: Optional[str], fh, run_det: bool, prompt: str, complete: bool = True) -> Optional[Future]:
+        """Store one uploaded file (read from ``fh`` in chunks) and, if requested, queue its detection on the pool."""
+        if not original_name:
+            return None
+        if not allowed_file(original_name):
+            uploads.update(batch_id, original_name, 'skipped', error='unsupported file type')
+            return None
+        if not complete:
+            uploads.update(batch_id, original_name, 'failed', error='upload truncated')
+            return None
+        save_path = reserve_upload_path(original_name)
+        filename = save_path.name
+        try:
+            blobs.store_file(fh, save_path)
+        except OSError as e:
+            save_path.unlink(missing_ok=True)
+            uploads.update(batch_id, filename, 'failed', error=str(e))
+            return None
+        if not run_det:
+            uploads.update(batch_id, filename, 'saved')
+            return None
+        uploads.update(batch_id, filename, 'queued')
+        return detection_pool.submit(detection_job, batch_id, filename, save_path, prompt)
+
     @app.route('/upload', methods=['POST'])
     @require_auth
     def upload():
@@ -85,46 +236,105 @@ def create_app():
         files = request.files.getlist('images')
         run_detection = request.form.get('run_detection') == 'on'
         prompt = request.form.get('prompt') or 'Detect objects.'
-        count = 0
+        batch_id = uploads.new_batch()
+        futures = []
         for file in files:
-            if file.filename == '':
+            future = accept_upload(batch_id, file.filename, file.stream, run_detection, prompt)
+            if future is not None:
+                futures.append(future)
+        uploads.close(batch_id)
+        # Detections run concurrently; the request waits for the slowest, not the sum
+        wait(futures)
+        count = 0
+        for entry in uploads.get(batch_id)['files']:
+            if entry['status'] == 'skipped':
+                flash(f"Skipped unsupported file: {entry['file']}")
                 continue
-            if allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                save_path = Path(app.config['UPLOAD_FOLDER']) / filename
-                file.save(save_path)
-                count += 1
-                if run_detection:
-                    try:
-                        from detector import run_detection as detect  # local import
-                        detect(
-                            image_path=str(save_path),
-                            output_dir=app.config['ANNOTATED_FOLDER'],
-                            prompt=prompt
-                        )
-                    except Exception as e:
-                        msg = str(e)
-                        if '503' in msg or 'UNAVAILABLE' in msg.upper() or 'overloaded' in msg.lower():
-                            flash(f'Model overloaded while processing {filename}; will retry later or try again manually.')
-                        else:
-                            flash(f'Detection failed for {filename}: {e}')
-            else:
-                flash(f'Skipped unsupported file: {file.filename}')
+            count += 1
+            if entry['status'] == 'failed':
+                if entry.get('overloaded'):
+                    flash(f"Model overloaded while processing {entry['file']}; will retry later or try again manually.")
+                else:
+                    flash(f"Detection failed for {entry['file']}: {entry.get('error')}")
         flash(f'Uploaded {count} file(s).')
         return redirect(url_for('index'))
 
+    @app.route('/api/upload', methods=['POST'])
+    @require_auth
+    def api_upload():
+        """Streaming multi-file upload: each file is stored and queued for detection as
+        soon as its part arrives. Returns the batch immediately; progress follows as
+        ``upload_progress`` Socket.IO events and via ``GET /api/upload/<batch>``."""
+        run_det = request.args.get('run_detection', '1').lower() not in ('0', 'false', 'off', 'no')
+        prompt = request.args.get('prompt') or 'Detect objects.'
+        batch_id = uploads.new_batch()
+        try:
+            for name, filename, body, complete in iter_multipart(request.stream, request.content_type):
+                if filename is not None:
+                    if name == 'images':
+                        accept_upload(batch_id, filename, body, run_det, prompt, complete)
+                    continue
+                if not complete:
+                    break
+                # Form fields only apply to files that come after them
+                value = body.read(MAX_FIELD_BYTES).decode('utf-8', 'replace').strip()
+                if name == 'prompt' and value:
+                    prompt = value
+                elif name == 'run_detection':
+                    run_det = value.lower() in ('1', 'true', 'on', 'yes')
+        except ValueError as e:
+            return {'error': str(e), 'batch': batch_id}, 400
+        finally:
+            uploads.close(batch_id)
+        return uploads.get(batch_id), 202
+
+    @app.route('/api/upload/<batch_id>', methods=['GET'])
+    @require_auth
+    def api_upload_status(batch_id):
+        batch = uploads.get(batch_id)
+        if batch is None:
+            return {'error': 'unknown batch'}, 404
+        return batch
+
     @app.route('/uploads/<path:filename>')
     def uploaded_file(filename):
         return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
 
     @app.route('/annotated/<path:filename>')
     def annotated_file(filename):
-        return send_from_directory(app.config['ANNOTATED_FOLDER'], filename)
+        """Annotated copies are drawn from the stored detections on first request and
+        kept in a size-bounded cache."""
+        name = secure_filename(filename)
+        stem = Path(name).stem
+        if annotated_cache.lookup(name) is not None or not stem.endswith('_annotated'):
+            return send_from_directory(app.config['ANNOTATED_FOLDER'], name)
+        source = find_original(stem[:-len('_annotated')] + Path(name).suffix)
+        detections = read_detections(source) if source is not None else None
+        if detections is None:
+            return {'error': 'no detections for this image'}, 404
+        try:
+            annotated_cache.get(name, lambda tmp: detector.render_annotated(str(source), detections['boxes'], str(tmp)))
+        except Exception as e:  # noqa
+            return {'error': f'render failed: {e}'}, 500
+        return send_from_directory(app.config['ANNOTATED_FOLDER'], name)
+
+    @app.route('/api/detections/<path:filename>', methods=['GET'])
+    @require_auth
+    def api_detections(filename):
+        source = find_original(filename)
+        detections = read_detections(source) if source is not None else None
+        if detections is None:
+            return {'error': 'no detections for this image'}, 404
+        return dict(detections, annotated=annotated_name(source.name))
 
     @app.route('/gallery/<path:filename>')
     def gallery_file(filename):
         return send_from_directory(app.config['GALLERY_FOLDER'], filename)
 
+    @app.route('/clips/<path:filename>')
+    def clip_file(filename):
+        return send_from_directory(app.config['CLIPS_FOLDER'], filename)
+
     @app.route('/delete', methods=['POST'])
     @require_auth
     def delete_image():
@@ -133,15 +343,20 @@ def create_app():
             flash('No file specified')
             return redirect(url_for('index'))
         orig = Path(app.config['UPLOAD_FOLDER']) / name
-        ann = Path(app.config['ANNOTATED_FOLDER']) / (Path(name).stem + '_annotated' + Path(name).suffix)
         removed = []
-        for p in (orig, ann):
+        for p in (orig, detections_path(orig)):
             try:
                 if p.exists():
                     p.unlink()
                     removed.append(p.name)
             except Exception as e:
                 flash(f'Error deleting {p.name}: {e}')
+        # Through the cache so its byte total stays right
+        try:
+            if annotated_cache.discard(annotated_name(name)):
+                removed.append(annotated_name(name))
+        except OSError as e:
+            flash(f'Error deleting {annotated_name(name)}: {e}')
         if removed:
             flash('Deleted: ' + ', '.join(removed))
         else:
@@ -165,8 +380,8 @@ def create_app():
                 print('Base64 decode error:', e)
                 return {'error': 'invalid base64'}, 400
             try:
-                from detector import detect_boxes
-                boxes, size = detect_boxes(raw, prompt=prompt)
+                source = str(data.get('camera') or request.remote_addr or 'unknown')
+                boxes, size = detector.detect_boxes(raw, prompt=prompt, source=source)
                 return {'boxes': boxes, 'size': size}
             except Exception as e:
                 print('Detection error:', e)
@@ -191,8 +406,15 @@ def create_app():
                 raw = base64.b64decode(encoded or b64)
             except Exception:
                 return {'error': 'invalid base64'}, 400
-            from detector import assess_risk
-            result = assess_risk(raw)
+            # Pre-screen safety valve is tracked per camera (or per client without one)
+            source = str(data.get('camera') or request.remote_addr or 'unknown')
+            started = time.perf_counter()
+            result = detector.assess_risk(raw, source=source)
+            record_history(
+                source, result, (time.perf_counter() - started) * 1000,
+                risk_exceeds_threshold(result.get('score', 0.0), result.get('indicators')),
+            )
+            schedule_next(source, result, raw)
             notify_risk_detection(
                 score=result.get('score', 0.0),
                 indicators=result.get('indicators'),
@@ -202,7 +424,9 @@ def create_app():
                 extra={
                     'endpoint': '/api/risk_frame',
                     'client_ip': request.remote_addr or 'unknown',
+                    'camera': source,
                 },
+                cooldown_key=f'camera:{source}',
             )
             from datetime import datetime, timezone
             result['timestamp'] = datetime.now(timezone.utc).isoformat()
@@ -210,6 +434,76 @@ def create_app():
         except Exception as e:  # noqa
             return {'error': str(e)}, 500
 
+    @app.route('/api/analyze_frame', methods=['POST'])
+    @require_auth
+    def api_analyze_frame():
+        """Risk + boxes in one model call; optionally saves flagged frames to the gallery and annotates them."""
+        try:
+            data = request.get_json(force=True)
+            if not data:
+                return {'error': 'no json'}, 400
+            b64 = data.get('image')
+            if not b64:
+                return {'error': 'image missing'}, 400
+            header, _, encoded = b64.partition(',')
+            try:
+                raw = base64.b64decode(encoded or b64)
+            except Exception:
+                return {'error': 'invalid base64'}, 400
+            try:
+                threshold = float(data.get('threshold', 0.5))
+            except (TypeError, ValueError):
+                return {'error': 'invalid threshold'}, 400
+            save_to_gallery = bool(data.get('save_to_gallery', False))
+            annotate = bool(data.get('annotate', False))
+
+            fname = frame_name('frame')
+            source = str(data.get('camera') or request.remote_addr or 'unknown')
+            started = time.perf_counter()
+            result = detector.analyze_frame(raw, prompt=data.get('prompt'), source=source)
+            latency_ms = (time.perf_counter() - started) * 1000
+            schedule_next(source, result, raw)
+
+            from datetime import datetime, timezone
+            result['timestamp'] = datetime.now(timezone.utc).isoformat()
+            flagged = result['score'] >= threshold or bool(result['indicators'])
+            record_history(source, result, latency_ms, flagged)
+            result['flagged'] = flagged
+            result['original'] = None
+            if flagged and save_to_gallery:
+                metadata = dict(data.get('metadata') or {})
+                metadata.update({
+                    'timestamp': result['timestamp'],
+                    'score': result['score'],
+                    'indicators': result['indicators'],
+                    'boxes': result['boxes'],
+                })
+                metadata.setdefault('source', 'monitoring')
+                add_to_gallery(fname, raw, metadata)
+                result['original'] = fname
+            # The boxes are in the gallery sidecar; /annotated/ draws them on first view
+            result['annotated'] = None
+            if annotate and result['original'] and result['boxes']:
+                result['annotated'] = annotated_name(fname)
+
+            notify_risk_detection(
+                score=result['score'],
+                indicators=result['indicators'],
+                source='api_analyze_frame',
+                image_bytes=raw,
+                filename=fname,
+                extra={
+                    'endpoint': '/api/analyze_frame',
+                    'client_ip': request.remote_addr or 'unknown',
+                    'saved_to_gallery': str(bool(result['original'])),
+                    'camera': source,
+                },
+                cooldown_key=f'camera:{source}',
+            )
+            return result
+        except Exception as e:  # noqa
+            return {'error': str(e)}, 500
+
     @app.route('/api/capture_and_save', methods=['POST'])
     @require_auth
     def api_capture_and_save():
@@ -231,30 +525,23 @@ def create_app():
             except Exception:
                 return {'error': 'invalid base64'}, 400
 
-            import time
-            fname = f"frame_{int(time.time()*1000)}.jpg"
+            fname = frame_name('frame')
 
             if save_to_gallery:
-                save_path = Path(app.config['GALLERY_FOLDER']) / fname
-                metadata_path = save_path.with_suffix('.json')
-                import json
-                with open(metadata_path, 'w') as f:
-                    json.dump(metadata, f, indent=2)
+                save_path = add_to_gallery(fname, raw, metadata)
             else:
-                save_path = Path(app.config['UPLOAD_FOLDER']) / fname
+                save_path = blobs.store(raw, Path(app.config['UPLOAD_FOLDER']) / fname)
             
-            with open(save_path, 'wb') as f:
-                f.write(raw)
-            
-            annotated_name = None
+            annotated = None
+            boxes = None
             if run_det:
                 try:
-                    from detector import run_detection as do_detect
-                    out_path = do_detect(str(save_path), app.config['ANNOTATED_FOLDER'], prompt=prompt)
-                    annotated_name = Path(out_path).name
+                    source = str(data.get('camera') or request.remote_addr or 'unknown')
+                    boxes = detector.run_detection(str(save_path), prompt=prompt, source=source)['boxes']
+                    annotated = annotated_name(fname)
                 except Exception as e:  
                     print('capture_and_save detection error:', e)
-            return {'original': fname, 'annotated': annotated_name}
+            return {'original': fname, 'annotated': annotated, 'boxes': boxes}
         except Exception as e:
             return {'error': str(e)}, 500
 
@@ -273,28 +560,22 @@ def create_app():
             if not allowed_file(file.filename):
                 return {'error': 'Invalid file type'}, 400
 
-            import time
             filename = secure_filename(file.filename)
             base_name = Path(filename).stem
             ext = Path(filename).suffix
-            timestamped_name = f"{base_name}_{int(time.time()*1000)}{ext}"
+            timestamped_name = frame_name(base_name, ext)
             
             upload_path = Path(app.config['UPLOAD_FOLDER']) / timestamped_name
-            file.save(upload_path)
-            
-            with open(upload_path, 'rb') as f:
-                image_data = f.read()
+            image_data = file.read()
+            blobs.store(image_data, upload_path)
             
-            from detector import assess_risk
-            result = assess_risk(image_data)
+            started = time.perf_counter()
+            # Uploads skip the pre-screen; the source only tags usage
+            result = detector.assess_risk(image_data, source='upload', prescreen=False)
 
             should_save = result.get('score', 0) >= 0.5 or bool(result.get('indicators', []))
+            record_history('upload', result, (time.perf_counter() - started) * 1000, should_save)
             if should_save:
-                gallery_path = Path(app.config['GALLERY_FOLDER']) / timestamped_name
-                import shutil
-                shutil.copy2(upload_path, gallery_path)
-                
-                import json
                 from datetime import datetime, timezone
                 metadata = {
                     'timestamp': datetime.now(timezone.utc).isoformat(),
@@ -302,9 +583,8 @@ def create_app():
                     'indicators': result.get('indicators', []),
                     'source': 'upload'
                 }
-                metadata_path = gallery_path.with_suffix('.json')
-                with open(metadata_path, 'w') as f:
-                    json.dump(metadata, f, indent=2)
+                # Same blob as the upload: a hard link, not a second copy
+                add_to_gallery(timestamped_name, image_data, metadata)
             
             notify_risk_detection(
                 score=result.get('score', 0.0),
@@ -325,6 +605,121 @@ def create_app():
         except Exception as e:
             return {'error': str(e)}, 500
 
+    @app.route('/api/model_stats', methods=['GET'])
+    @require_auth
+    def api_model_stats():
+        return {
+            'parse': detector.parse_stats(),
+            'prescreen': detector.prescreen_stats(),
+            'warmup': detector.warmup_report(),
+            'breaker': detector.breaker_state(),
+            'usage': detector.usage_summary()['total'],
+        }
+
+    @app.route('/api/usage', methods=['GET'])
+    @require_auth
+    def api_usage():
+        """Model usage since start: ``group_by=task`` (default), ``source`` or ``task,source``."""
+        try:
+            return detector.usage_summary(request.args.get('group_by', 'task'))
+        except ValueError as e:
+            return {'error': str(e)}, 400
+
+    @app.route('/api/risk_history', methods=['GET'])
+    @require_auth
+    def api_risk_history():
+        """Recorded risk results: ``mode=rollup`` (default), ``rows`` or ``thresholds``."""
+        now = time.time()
+        try:
+            end = float(request.args.get('to', now))
+            start = float(request.args.get('from', end - 3600))
+        except ValueError:
+            return {'error': 'from/to must be unix timestamps'}, 400
+        if start > end:
+            return {'error': 'from must not be after to'}, 400
+        if end - start > 31 * 86400:
+            return {'error': 'range limited to 31 days'}, 400
+        camera = request.args.get('camera') or None
+        mode = request.args.get('mode', 'rollup')
+        try:
+            if mode == 'rows':
+                limit = min(max(1, int(request.args.get('limit', 1000))), 100000)
+                min_score = float(request.args.get('min_score', 0))
+                rows = history.query(start, end, camera=camera, min_score=min_score, limit=limit)
+                return {'from': start, 'to': end, 'rows': rows}
+            if mode == 'thresholds':
+                raw = request.args.get('thresholds', '0.3,0.4,0.5,0.6,0.7')
+                thresholds = [float(t) for t in raw.split(',') if t.strip()]
+                return {'from': start, 'to': end, **history.threshold_counts(start, end, thresholds, camera=camera)}
+            if mode == 'rollup':
+                bucket = max(60, int(request.args.get('bucket', 60)))
+                return {'from': start, 'to': end, 'bucket': bucket, 'buckets': history.rollup(start, end, camera=camera, bucket=bucket)}
+        except ValueError:
+            return {'error': 'limit/bucket must be integers; min_score/thresholds must be numbers'}, 400
+        return {'error': f'unknown mode {mode!r}'}, 400
+
+    @app.route('/api/export', methods=['GET'])
+    @require_auth
+    def api_export():
+        """Stream gallery frames + metadata as ``format=tar|zip``; tar supports Range requests."""
+        try:
+            end = parse_time(request.args['to']) if request.args.get('to') else time.time() + 1
+            start = parse_time(request.args.get('from', '0'))
+            min_score = float(request.args.get('min_score', 0))
+            fmt = request.args.get('format', 'tar')
+            meta = [m.strip() for m in request.args.get('meta', 'jsonl').split(',') if m.strip()]
+            if gallery_index.is_empty():
+                gallery_index.reconcile(app.config['GALLERY_FOLDER'])
+            entries = select_entries(
+                gallery_index,
+                app.config['GALLERY_FOLDER'],
+                start,
+                end,
+                after=request.args.get('after') or None,
+                min_score=min_score,
+            )
+            export = build_export(fmt, entries, meta)
+        except ValueError as e:
+            return {'error': str(e)}, 400
+        headers = {
+            'Content-Disposition': f'attachment; filename="{export_filename(fmt, start, end)}"',
+            'X-Export-Frames': str(len(entries)),
+        }
+        if fmt == 'zip':
+            return Response(export.iter_bytes(), mimetype=export.content_type, headers=headers)
+        headers.update({'Accept-Ranges': 'bytes', 'ETag': f'"{export.etag}"'})
+        byte_range = request.range
+        if byte_range is not None and request.if_range.etag not in (None, export.etag):
+            byte_range = None  # The export changed since the partial download: send it all
+        if byte_range is None:
+            headers['Content-Length'] = str(export.size)
+            return Response(export.iter_bytes(), mimetype=export.content_type, headers=headers)
+        span = byte_range.range_for_length(export.size)
+        if span is None:
+            headers['Content-Range'] = f'bytes */{export.size}'
+            return Response(status=416, headers=headers)
+        first, stop = span
+        headers.update({'Content-Range': f'bytes {first}-{stop - 1}/{export.size}', 'Content-Length': str(stop - first)})
+        return Response(export.iter_bytes(first, stop), status=206, mimetype=export.content_type, headers=headers)
+
+    @app.route('/api/schedule', methods=['GET'])
+    @require_auth
+    def api_schedule():
+        return scheduler.stats()
+
+    @app.route('/api/storage', methods=['GET'])
+    @require_auth
+    def api_storage():
+        return {'last_sweep': sweeper.last_report, 'annotated_cache': annotated_cache.stats()}
+
+    @app.route('/api/storage/sweep', methods=['POST'])
+    @require_auth
+    def api_storage_sweep():
+        try:
+            return sweeper.run_once()
+        except Exception as e:
+            return {'error': str(e)}, 500
+
     @app.route('/login', methods=['GET','POST'])
     def login():
         if not auth_enabled():
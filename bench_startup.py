@@ -0,0 +1,136 @@
+"""Startup benchmark: process start -> app ready -> first request.
+
+Each run starts a fresh interpreter so import costs are measured cold, e.g.::
+
+    python bench_startup.py --runs 5
+    python bench_startup.py --runs 5 --no-warmup
+    python bench_startup.py --offline   # canned model reply: local overhead only
+
+Without ``--offline`` the first request makes a real model call (needs GOOGLE_API_KEY).
+Each run gets its own temporary shared-state database (and history, usage and gallery index files), and
+the two requests send different frames, so neither is answered from the result cache.
+"""
+from __future__ import annotations
+
+import argparse
+import base64
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from io import BytesIO
+
+METRICS = (
+    'interpreter_ms',
+    'import_app_ms',
+    'create_app_ms',
+    'process_to_ready_ms',
+    'warmup_ms',
+    'first_request_ms',
+    'second_request_ms',
+)
+
+
+def _ms(start: float, end: float) -> float:
+    return round((end - start) * 1000, 1)
+
+
+def _frame_data_url(shade: int) -> str:
+    from PIL import Image
+
+    buf = BytesIO()
+    Image.new('RGB', (640, 480), (shade, 110, 100)).save(buf, format='JPEG', quality=80)
+    return 'data:image/jpeg;base64,' + base64.b64encode(buf.getvalue()).decode('ascii')
+
+
+def child(offline: bool) -> dict:
+    spawned = float(os.environ['BENCH_SPAWNED_AT'])
+    started = time.time()
+    result = {'interpreter_ms': _ms(spawned, started)}
+
+    t = time.time()
+    import app as app_module
+    import detector
+
+    result['import_app_ms'] = _ms(t, time.time())
+    if offline:
+        detector._call_model = lambda parts, *, task: '{"score": 0.0, "indicators": []}'
+
+    t = time.time()
+    app, _ = app_module.create_app()
+    ready = time.time()
+    result['create_app_ms'] = _ms(t, ready)
+    result['process_to_ready_ms'] = _ms(spawned, ready)
+
+    warmup = next((th for th in threading.enumerate() if th.name == 'warmup'), None)
+    if warmup is not None:
+        warmup.join()
+        result['warmup_ms'] = _ms(ready, time.time())
+
+    client = app.test_client()
+    for key, shade in (('first_request_ms', 40), ('second_request_ms', 200)):
+        body = {'image': _frame_data_url(shade), 'camera': 'bench'}
+        t = time.time()
+        response = client.post('/api/risk_frame', json=body)
+        result[key] = _ms(t, time.time())
+        result.setdefault('status', response.status_code)
+        if (response.get_json(silent=True) or {}).get('cached'):
+            result.setdefault('cached', []).append(key)
+    result['supervision_loaded'] = 'supervision' in sys.modules
+    return result
+
+
+def run_once(warmup: bool, offline: bool) -> dict:
+    with tempfile.TemporaryDirectory(prefix='bench_startup_') as tmp:
+        env = dict(os.environ)
+        env['WARMUP_ON_START'] = 'true' if warmup else 'false'
+        env['RETENTION_SWEEP_SECONDS'] = '0'
+        # A persistent cache would answer the bench frames from an earlier run
+        env['SHARED_STATE_DB'] = os.path.join(tmp, 'shared_state.sqlite3')
+        env['RISK_HISTORY_FOLDER'] = os.path.join(tmp, 'history')
+        env['USAGE_LOG'] = os.path.join(tmp, 'usage.jsonl')
+        env['GALLERY_INDEX'] = os.path.join(tmp, 'gallery', 'index.sqlite3')
+        env['BENCH_SPAWNED_AT'] = repr(time.time())
+        cmd = [sys.executable, os.path.abspath(__file__), '--child']
+        if offline:
+            cmd.append('--offline')
+        proc = subprocess.run(cmd, env=env, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    for line in reversed(proc.stdout.splitlines()):
+        if line.startswith('{'):
+            return json.loads(line)
+    raise RuntimeError(f'benchmark child failed:\n{proc.stderr[-2000:]}')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Measure cold start and first-request latency')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--no-warmup', action='store_true', help='Run with WARMUP_ON_START=false')
+    parser.add_argument('--offline', action='store_true', help='Replace the model call with a canned reply')
+    parser.add_argument('--json', action='store_true', help='Print raw per-run results as JSON')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(child(args.offline)))
+        return
+
+    runs = [run_once(not args.no_warmup, args.offline) for _ in range(args.runs)]
+    if args.json:
+        print(json.dumps(runs, indent=2))
+        return
+    print(f"runs={args.runs} warmup={'off' if args.no_warmup else 'on'} offline={args.offline}")
+    cached = sum(len(r.get('cached', ())) for r in runs)
+    if cached:
+        print(f'  warning: {cached} request(s) were answered from the result cache')
+    for metric in METRICS:
+        values = [r[metric] for r in runs if r.get(metric) is not None]
+        if values:
+            print(f'  {metric:<20} median {statistics.median(values):>8.1f}  min {min(values):>8.1f}  max {max(values):>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
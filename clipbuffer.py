@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import os
+import threading
+from array import array
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+CLIP_FORMATS = {
+    'avi': 'MJPG',
+    'mp4': 'mp4v',
+}
+
+
+class FrameRing:
+    """Fixed-size ring of encoded (JPEG) frames.
+
+    Frame bytes live in one preallocated ``bytearray`` and per-frame bookkeeping in
+    typed arrays, so memory use is set at construction and never grows with uptime.
+    Writes wrap around the arena and evict the oldest frames they overlap.
+    """
+
+    def __init__(self, capacity_bytes: int, max_frames: int):
+        if capacity_bytes <= 0 or max_frames <= 0:
+            raise ValueError('capacity_bytes and max_frames must be positive')
+        self.capacity_bytes = capacity_bytes
+        self.max_frames = max_frames
+        self._data = bytearray(capacity_bytes)
+        self._ts = array('d', bytes(8 * max_frames))
+        self._offset = array('q', bytes(8 * max_frames))
+        self._length = array('q', bytes(8 * max_frames))
+        self._head = 0  # next slot to write
+        self._count = 0
+        self._pos = 0  # next byte offset to write
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _oldest(self) -> int:
+        return (self._head - self._count) % self.max_frames
+
+    def append(self, ts: float, frame: bytes) -> bool:
+        size = len(frame)
+        if size == 0 or size > self.capacity_bytes:
+            return False
+        with self._lock:
+            if self._count == self.max_frames:
+                self._count -= 1
+            if self._pos + size > self.capacity_bytes:
+                # Frames left past the write position would be overtaken out of order
+                # after wrapping, so they go now.
+                while self._count and self._offset[self._oldest()] >= self._pos:
+                    self._count -= 1
+                self._pos = 0
+            end = self._pos + size
+            while self._count:
+                oldest = self._oldest()
+                start = self._offset[oldest]
+                if start < end and start + self._length[oldest] > self._pos:
+                    self._count -= 1
+                else:
+                    break
+            self._data[self._pos:end] = frame
+            slot = self._head
+            self._ts[slot] = ts
+            self._offset[slot] = self._pos
+            self._length[slot] = size
+            self._head = (slot + 1) % self.max_frames
+            self._count += 1
+            self._pos = end
+        return True
+
+    def snapshot(self, start_ts: float, end_ts: float) -> List[Tuple[float, bytes]]:
+        """Copy out frames with ``start_ts <= ts <= end_ts``, oldest first."""
+        frames = []
+        with self._lock:
+            slot = self._oldest()
+            for _ in range(self._count):
+                ts = self._ts[slot]
+                if start_ts <= ts <= end_ts:
+                    offset = self._offset[slot]
+                    frames.append((ts, bytes(self._data[offset:offset + self._length[slot]])))
+                slot = (slot + 1) % self.max_frames
+        return frames
+
+    def stats(self) -> dict:
+        with self._lock:
+            if not self._count:
+                return {'frames': 0, 'bytes': 0, 'span_seconds': 0.0}
+            oldest = self._oldest()
+            newest = (self._head - 1) % self.max_frames
+            used = 0
+            slot = oldest
+            for _ in range(self._count):
+                used += self._length[slot]
+                slot = (slot + 1) % self.max_frames
+            return {
+                'frames': self._count,
+                'bytes': used,
+                'span_seconds': self._ts[newest] - self._ts[oldest],
+            }
+
+
+def write_clip(frames: List[Tuple[float, bytes]], path: str, fmt: str = 'avi', fps: Optional[float] = None) -> str:
+    """Decode ``frames`` (ts, JPEG bytes) and write them to a video file with OpenCV.
+
+    The video is written under a hidden temporary name and renamed into place when
+    complete, so ``path`` never exists half-written.
+    """
+    import cv2  # type: ignore
+    import numpy as np
+
+    if not frames:
+        raise ValueError('no frames to write')
+    if fmt not in CLIP_FORMATS:
+        raise ValueError(f'unsupported clip format {fmt!r}')
+    if fps is None:
+        span = frames[-1][0] - frames[0][0]
+        fps = (len(frames) - 1) / span if span > 0 else 10.0
+    out_path = Path(path)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    # Same suffix: OpenCV picks the container from it
+    tmp_path = out_path.with_name(f'.{out_path.stem}.partial{out_path.suffix}')
+    writer = None
+    size = None
+    try:
+        for _, jpeg in frames:
+            image = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if image is None:
+                continue
+            if writer is None:
+                size = (image.shape[1], image.shape[0])
+                fourcc = cv2.VideoWriter_fourcc(*CLIP_FORMATS[fmt])
+                writer = cv2.VideoWriter(str(tmp_path), fourcc, max(1.0, fps), size)
+                if not writer.isOpened():
+                    raise RuntimeError(f'failed to open video writer for {out_path}')
+            elif (image.shape[1], image.shape[0]) != size:
+                image = cv2.resize(image, size)
+            writer.write(image)
+    except BaseException:
+        if writer is not None:
+            writer.release()
+        tmp_path.unlink(missing_ok=True)
+        raise
+    if writer is None:
+        raise ValueError('no decodable frames')
+    writer.release()
+    os.replace(tmp_path, out_path)
+    return str(out_path)
@@ -2,20 +2,21 @@
 from __future__ import annotations
 
 import base64
+import hashlib
 import json
 import os
 import random
+import threading
 import time
+from functools import lru_cache
 from io import BytesIO
 from pathlib import Path
 from typing import Optional, Sequence
 
-import requests
-import supervision as sv
+import numpy as np
 from PIL import Image
-from dotenv import load_dotenv
 
-load_dotenv()
+from usage import get_usage_tracker
 
 DEFAULT_MODEL = os.getenv('MODEL_NAME', 'gemini-2.0-flash')
 TEMPERATURE = 0.4
@@ -39,6 +40,54 @@ RISK_PROMPT = (
     "score expresses confidence that the image contains concerning self-harm related visual patterns or tools. "
     "If no concerning patterns: score=0 and indicators=[]. Do not add explanations or extra keys."
 )
+
+ANALYZE_PROMPT = (
+    "You are a safety pattern screening assistant. Given an image, you will output a JSON object ONLY. "
+    "The JSON must have keys: score (float 0-1), indicators (array of short lowercase strings), "
+    'boxes (array of objects with "box_2d" as [ymin, xmin, ymax, xmax] normalized to 0-1000 and "label"). '
+    "score expresses confidence that the image contains concerning self-harm related visual patterns or tools. "
+    "boxes locate each concerning object, injury or person involved, with descriptive labels. "
+    "If no concerning patterns: score=0, indicators=[] and boxes=[]. Do not add explanations or extra keys."
+)
+# One model input serves both the risk score and the boxes; 768px keeps box
+# placement usable while staying well below the 1024px detection input.
+ANALYZE_WIDTH = 768
+DETECT_WIDTH = 1024
+
+_BOX_SCHEMA = {
+    'type': 'OBJECT',
+    'properties': {
+        'box_2d': {'type': 'ARRAY', 'items': {'type': 'INTEGER'}, 'minItems': 4, 'maxItems': 4},
+        'label': {'type': 'STRING'},
+    },
+    'required': ['box_2d', 'label'],
+}
+_RISK_PROPERTIES = {
+    'score': {'type': 'NUMBER'},
+    'indicators': {'type': 'ARRAY', 'items': {'type': 'STRING'}, 'maxItems': 10},
+}
+RISK_SCHEMA = {
+    'type': 'OBJECT',
+    'properties': _RISK_PROPERTIES,
+    'required': ['score', 'indicators'],
+}
+BOXES_SCHEMA = {'type': 'ARRAY', 'items': _BOX_SCHEMA, 'maxItems': 25}
+ANALYZE_SCHEMA = {
+    'type': 'OBJECT',
+    'properties': dict(_RISK_PROPERTIES, boxes=BOXES_SCHEMA),
+    'required': ['score', 'indicators', 'boxes'],
+}
+
+# Generation settings per task. Output caps are sized to the schema (10 short
+# indicators ~ 150 tokens, 25 boxes ~ 650 tokens) so a runaway reply stops early.
+GENERATION_PROFILES = {
+    'risk': {'temperature': 0.1, 'maxOutputTokens': 192, 'responseSchema': RISK_SCHEMA},
+    'detect': {'temperature': TEMPERATURE, 'maxOutputTokens': 768, 'responseSchema': BOXES_SCHEMA},
+    'analyze': {'temperature': 0.1, 'maxOutputTokens': 1024, 'responseSchema': ANALYZE_SCHEMA},
+}
+
+_PARSE_STATS: dict[str, dict[str, int]] = {}
+_PARSE_LOCK = threading.Lock()
 API_URL_TEMPLATE = "https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent"
 
 
@@ -56,6 +105,114 @@ def _model_url() -> str:
     return API_URL_TEMPLATE.format(model=DEFAULT_MODEL)
 
 
+RISK_CACHE_SECONDS = float(os.getenv('RISK_CACHE_SECONDS', '60'))
+MODEL_RPM_LIMIT = float(os.getenv('MODEL_RPM_LIMIT', '0') or 0)
+MODEL_BUDGET_MAX_WAIT = float(os.getenv('MODEL_BUDGET_MAX_WAIT', '2'))
+BREAKER_FAILURES = int(os.getenv('BREAKER_FAILURES', '5'))
+BREAKER_COOLDOWN_SECONDS = float(os.getenv('BREAKER_COOLDOWN_SECONDS', '30'))
+
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+_SHARED = None
+_SHARED_FAILED = False
+_WARMUP: Optional[dict] = None
+# usageMetadata of the last model reply on this thread, read back by _generate_with_retry
+_CALL_INFO = threading.local()
+
+
+def _session():
+    """Shared ``requests.Session`` so model calls reuse pooled keep-alive connections
+    instead of paying DNS and TLS setup on every request."""
+    global _SESSION
+    if _SESSION is None:
+        with _SESSION_LOCK:
+            if _SESSION is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                session = requests.Session()
+                pool_size = int(os.getenv('MODEL_POOL_SIZE', '8'))
+                session.mount('https://', HTTPAdapter(pool_connections=2, pool_maxsize=pool_size))
+                _SESSION = session
+    return _SESSION
+
+
+def _shared():
+    """Cross-worker state (cache, budget, breaker), or None if it can't be opened."""
+    global _SHARED, _SHARED_FAILED
+    if _SHARED is None and not _SHARED_FAILED:
+        try:
+            from shared_state import get_shared_state
+
+            _SHARED = get_shared_state()
+        except Exception as e:  # noqa
+            print('[shared_state] unavailable, using per-process behaviour:', e)
+            _SHARED_FAILED = True
+    return _SHARED
+
+
+class ModelCallRejected(RuntimeError):
+    """Raised without calling the model: circuit breaker open or budget exhausted."""
+
+
+class ModelHTTPError(RuntimeError):
+    """The model API answered with an HTTP error status."""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def _is_outage(err: Exception) -> bool:
+    """Whether ``err`` says the model service is struggling, as opposed to this request
+    being bad or blocked. Only outages count toward the shared circuit breaker."""
+    if isinstance(err, ModelHTTPError):
+        return err.status == 429 or err.status >= 500
+    # requests' connection errors and timeouts are OSErrors
+    return isinstance(err, OSError)
+
+
+def _cache_key(task: str, prompt: str, image_bytes: bytes) -> str:
+    digest = hashlib.sha256(image_bytes)
+    digest.update(f'\0{task}\0{DEFAULT_MODEL}\0{prompt}'.encode('utf-8'))
+    return f'{task}:{digest.hexdigest()}'
+
+
+def _cache_get(key: str) -> Optional[dict]:
+    state = _shared()
+    if state is None or RISK_CACHE_SECONDS <= 0:
+        return None
+    try:
+        return state.cache_get(key)
+    except Exception as e:  # noqa
+        print('[shared_state] cache read failed:', e)
+        return None
+
+
+def _cache_set(key: str, value: dict) -> None:
+    state = _shared()
+    if state is None or RISK_CACHE_SECONDS <= 0:
+        return
+    try:
+        state.cache_set(key, value, RISK_CACHE_SECONDS)
+    except Exception as e:  # noqa
+        print('[shared_state] cache write failed:', e)
+
+
+def _take_budget(state) -> None:
+    """Wait (up to MODEL_BUDGET_MAX_WAIT) for a token from the shared per-minute budget."""
+    if state is None or MODEL_RPM_LIMIT <= 0:
+        return
+    deadline = time.time() + MODEL_BUDGET_MAX_WAIT
+    while True:
+        wait = state.acquire('model', MODEL_RPM_LIMIT)
+        if wait <= 0:
+            return
+        if time.time() + wait > deadline:
+            raise ModelCallRejected(f'model budget exhausted ({MODEL_RPM_LIMIT:g}/min)')
+        time.sleep(wait)
+
+
 def _image_to_b64(image: Image.Image) -> str:
     buf = BytesIO()
     image.convert('RGB').save(buf, format='JPEG', quality=90)
@@ -74,22 +231,73 @@ def _extract_text(data: dict) -> str:
     raise RuntimeError('Model response missing text output')
 
 
-def _parse_json_payload(text: str) -> dict:
+def _parse_json_payload(text: str):
     cleaned = (text or '').strip()
     if not cleaned:
         raise ValueError('Empty response text')
     try:
         return json.loads(cleaned)
     except json.JSONDecodeError:
-        start = cleaned.find('{')
-        end = cleaned.rfind('}')
-        if start != -1 and end != -1 and end > start:
-            snippet = cleaned[start:end + 1]
-            return json.loads(snippet)
+        starts = [i for i in (cleaned.find('{'), cleaned.find('[')) if i != -1]
+        if starts:
+            start = min(starts)
+            end = cleaned.rfind('}' if cleaned[start] == '{' else ']')
+            if end > start:
+                snippet = cleaned[start:end + 1]
+                return json.loads(snippet)
         raise
 
 
-def _call_model(parts: Sequence[dict], *, temperature: float, max_output_tokens: int = 2048) -> str:
+def _record_parse(task: str, outcome: str) -> None:
+    with _PARSE_LOCK:
+        counts = _PARSE_STATS.setdefault(task, {'strict': 0, 'recovered': 0, 'failed': 0, 'truncated': 0})
+        counts[outcome] += 1
+
+
+def _parse_task_payload(task: str, text: str):
+    """Parse a model reply and count whether it was clean JSON, needed the brace-scan
+    fallback, or could not be parsed at all."""
+    try:
+        data = json.loads((text or '').strip())
+    except json.JSONDecodeError:
+        try:
+            data = _parse_json_payload(text)
+        except ValueError:
+            _record_parse(task, 'failed')
+            raise
+        _record_parse(task, 'recovered')
+        return data
+    _record_parse(task, 'strict')
+    return data
+
+
+def parse_stats() -> dict:
+    """Per-task counts of model replies by parse outcome."""
+    with _PARSE_LOCK:
+        stats = {task: dict(counts) for task, counts in _PARSE_STATS.items()}
+    for counts in stats.values():
+        total = counts['strict'] + counts['recovered'] + counts['failed']
+        counts['failure_rate'] = round(counts['failed'] / total, 4) if total else 0.0
+    return stats
+
+
+def _generation_config(task: str) -> dict:
+    profile = GENERATION_PROFILES[task]
+    config = {
+        'temperature': profile['temperature'],
+        'topP': 0.95,
+        'topK': 32,
+        'maxOutputTokens': profile['maxOutputTokens'],
+        'responseMimeType': 'application/json',
+        'responseSchema': profile['responseSchema'],
+    }
+    if '2.5-flash' in DEFAULT_MODEL:
+        # Thinking tokens count against maxOutputTokens; these tasks don't need them
+        config['thinkingConfig'] = {'thinkingBudget': 0}
+    return config
+
+
+def _call_model(parts: Sequence[dict], *, task: str) -> str:
     payload = {
         'contents': [
             {
@@ -98,15 +306,10 @@ def _call_model(parts: Sequence[dict], *, temperature: float, max_output_tokens:
             }
         ],
         'safetySettings': SAFETY_SETTINGS,
-        'generationConfig': {
-            'temperature': temperature,
-            'topP': 0.95,
-            'topK': 32,
-            'maxOutputTokens': max_output_tokens,
-        },
+        'generationConfig': _generation_config(task),
     }
     url = f"{_model_url()}?key={_api_key()}"
-    response = requests.post(url, headers={'Content-Type': 'application/json'}, json=payload, timeout=90)
+    response = _session().post(url, headers={'Content-Type': 'application/json'}, json=payload, timeout=90)
     if response.status_code >= 400:
         try:
             error = response.json().get('error', {})
@@ -114,22 +317,73 @@ def _call_model(parts: Sequence[dict], *, temperature: float, max_output_tokens:
             error = {}
         message = error.get('message') or response.text
         code = error.get('code', response.status_code)
-        raise RuntimeError(f"{code} {message}")
+        raise ModelHTTPError(response.status_code, f"{code} {message}")
     try:
         data = response.json()
     except ValueError as exc:
         raise RuntimeError('Invalid JSON response from model') from exc
+    _CALL_INFO.usage = data.get('usageMetadata') or {}
+    candidates = data.get('candidates') or [{}]
+    if candidates[0].get('finishReason') == 'MAX_TOKENS':
+        _record_parse(task, 'truncated')
     return _extract_text(data)
 
 
 RETRY_STATUS = {503, 500}
 
 
-def _generate_with_retry(parts: Sequence[dict], *, temperature: float, max_retries: int = 4) -> str:
+def _image_bytes(parts: Sequence[dict]) -> int:
+    """Decoded size of the inline images in a request."""
+    return sum(len(part['inline_data']['data']) * 3 // 4 for part in parts if 'inline_data' in part)
+
+
+def _add_usage(usage: dict, meta: dict) -> None:
+    usage['prompt_tokens'] += int(meta.get('promptTokenCount') or 0)
+    # Thinking tokens are billed as output
+    usage['output_tokens'] += int(meta.get('candidatesTokenCount') or 0) + int(meta.get('thoughtsTokenCount') or 0)
+    usage['total_tokens'] += int(meta.get('totalTokenCount') or 0)
+
+
+def _generate_with_retry(parts: Sequence[dict], *, task: str, source: Optional[str] = None, max_retries: int = 4) -> str:
+    """Call the model with retries on transient errors; the call is recorded in the
+    usage tracker under ``(task, source)``."""
+    started = time.perf_counter()
+    usage = {'attempts': 0, 'image_bytes': 0, 'prompt_tokens': 0, 'output_tokens': 0, 'total_tokens': 0}
+    outcome = 'failed'
+    try:
+        text = _retry_loop(parts, task, max_retries, usage)
+        outcome = 'ok'
+        return text
+    except ModelCallRejected:
+        if not usage['attempts']:
+            outcome = 'rejected'
+        raise
+    finally:
+        latency_ms = (time.perf_counter() - started) * 1000 if outcome != 'rejected' else 0.0
+        get_usage_tracker().record(task, source, outcome, latency_ms=latency_ms, **usage)
+
+
+def _retry_loop(parts: Sequence[dict], task: str, max_retries: int, usage: dict) -> str:
+    state = _shared()
+    if state is not None and not state.breaker_allow('model', BREAKER_COOLDOWN_SECONDS):
+        raise ModelCallRejected('circuit open: model calls paused after repeated failures')
+    image_bytes = _image_bytes(parts)
     last_err: Exception | None = None
     for attempt in range(max_retries + 1):
         try:
-            return _call_model(parts, temperature=temperature)
+            _take_budget(state)
+            usage['attempts'] += 1
+            usage['image_bytes'] += image_bytes
+            _CALL_INFO.usage = None
+            try:
+                text = _call_model(parts, task=task)
+            finally:
+                _add_usage(usage, getattr(_CALL_INFO, 'usage', None) or {})
+            if state is not None:
+                state.breaker_record('model', True, BREAKER_FAILURES)
+            return text
+        except ModelCallRejected:
+            raise
         except Exception as err:
             msg = str(err)
             retry_flag = False
@@ -141,12 +395,95 @@ def _generate_with_retry(parts: Sequence[dict], *, temperature: float, max_retri
                 last_err = err
                 break
             sleep_for = (2 ** attempt) * (0.8 + random.random() * 0.4)
-            print(f"[retry] attempt {attempt + 1} failed: {msg} -> sleeping {sleep_for:.2f}s")
+            print(f"[retry] {task} attempt {attempt + 1} failed: {msg} -> sleeping {sleep_for:.2f}s")
             time.sleep(sleep_for)
             last_err = err
+    # A blocked, rejected (4xx) or malformed reply fails this request only; one camera's
+    # odd frames must not pause every camera and worker
+    if state is not None and _is_outage(last_err):
+        if state.breaker_record('model', False, BREAKER_FAILURES) == 'open':
+            print(f'[breaker] model calls paused for {BREAKER_COOLDOWN_SECONDS:g}s')
     raise last_err  # type: ignore[misc]
 
 
+def _resize_to_width(image: Image.Image, width: int) -> Image.Image:
+    target_height = int(width * image.height / image.width)
+    return image.resize((width, target_height), Image.Resampling.LANCZOS)
+
+
+def _normalize_risk(data: dict) -> tuple[float, list[str]]:
+    score = float(data.get('score', 0))
+    indicators = data.get('indicators', []) or []
+    if not isinstance(indicators, list):
+        indicators = []
+    indicators = [str(x)[:40].lower() for x in indicators][:10]
+    return max(0.0, min(1.0, score)), indicators
+
+
+def _boxes_from_payload(items, resolution_wh: tuple[int, int]) -> list[dict]:
+    """Convert Gemini ``box_2d`` entries ([ymin, xmin, ymax, xmax] on a 0-1000 grid) to pixel xyxy."""
+    width, height = resolution_wh
+    out = []
+    for item in items if isinstance(items, list) else []:
+        if not isinstance(item, dict):
+            continue
+        box = item.get('box_2d')
+        if not isinstance(box, (list, tuple)) or len(box) != 4:
+            continue
+        try:
+            y1, x1, y2, x2 = (max(0.0, min(1000.0, float(v))) for v in box)
+        except (TypeError, ValueError):
+            continue
+        if x2 <= x1 or y2 <= y1:
+            continue
+        out.append({
+            'box_2d': [x1 * width / 1000, y1 * height / 1000, x2 * width / 1000, y2 * height / 1000],
+            'label': str(item.get('label', ''))[:60],
+        })
+    return out
+
+
+@lru_cache(maxsize=16)
+def _annotators(thickness: int, text_scale: float):
+    """Box and label annotators for one line thickness / text scale, built once and reused."""
+    import supervision as sv  # heavy; only annotation needs it
+
+    box_annotator = sv.BoxAnnotator(thickness=thickness)
+    label_annotator = sv.LabelAnnotator(
+        smart_position=True,
+        text_color=sv.Color.BLACK,
+        text_scale=text_scale,
+        text_position=sv.Position.CENTER,
+    )
+    return sv, box_annotator, label_annotator
+
+
+def annotate_boxes(image: Image.Image, boxes: Sequence[dict], out_path: str) -> str:
+    """Draw pixel-space ``boxes`` (as returned by detect_boxes/analyze_frame) onto ``image``."""
+    import supervision as sv
+
+    resolution_wh = image.size
+    # Scale is snapped so similar resolutions share one cached annotator pair
+    _, box_annotator, label_annotator = _annotators(
+        sv.calculate_optimal_line_thickness(resolution_wh=resolution_wh),
+        round(sv.calculate_optimal_text_scale(resolution_wh=resolution_wh), 1),
+    )
+    labels = [box.get('label', '') for box in boxes]
+    class_ids = {label: i for i, label in enumerate(dict.fromkeys(labels))}
+    detections = sv.Detections(
+        xyxy=np.array([box['box_2d'] for box in boxes], dtype=float).reshape(-1, 4),
+        class_id=np.array([class_ids[label] for label in labels], dtype=int),
+        data={'class_name': np.array(labels)},
+    )
+    annotated = image
+    for annotator in (box_annotator, label_annotator):
+        annotated = annotator.annotate(scene=annotated, detections=detections)
+    path = Path(out_path)
+    path.parent.mkdir(exist_ok=True, parents=True)
+    annotated.save(path)
+    return str(path)
+
+
 def _parts_for_image(prompt: str, image: Image.Image) -> list[dict]:
     return [
         {'text': prompt},
@@ -159,108 +496,414 @@ def _parts_for_image(prompt: str, image: Image.Image) -> list[dict]:
     ]
 
 
-def run_detection(image_path: str, output_dir: str, prompt: Optional[str] = None) -> str:
+def run_detection(image_path: str, prompt: Optional[str] = None, source: Optional[str] = None) -> dict:
+    """Detect boxes in the image at ``image_path`` and store them next to it as
+    ``<stem>.detections.json``. Annotated copies are rendered on demand from that file."""
+    from storage import write_detections
+
     prompt_text = (prompt or 'Detect objects.') + PROMPT_SUFFIX
 
     image = Image.open(image_path)
-    width, height = image.size
-    target_height = int(1024 * height / width)
-    resized_image = image.resize((1024, target_height), Image.Resampling.LANCZOS)
+    resized_image = _resize_to_width(image, DETECT_WIDTH)
 
     result_text = _generate_with_retry(
         _parts_for_image(prompt_text, resized_image),
-        temperature=TEMPERATURE,
-    )
-
-    resolution_wh = image.size
-    detections = sv.Detections.from_vlm(
-        vlm=sv.VLM.GOOGLE_GEMINI_2_5,
-        result=result_text,
-        resolution_wh=resolution_wh,
-    )
-
-    thickness = sv.calculate_optimal_line_thickness(resolution_wh=resolution_wh)
-    text_scale = sv.calculate_optimal_text_scale(resolution_wh=resolution_wh)
-
-    box_annotator = sv.BoxAnnotator(thickness=thickness)
-    label_annotator = sv.LabelAnnotator(
-        smart_position=True,
-        text_color=sv.Color.BLACK,
-        text_scale=text_scale,
-        text_position=sv.Position.CENTER,
+        task='detect',
+        source=source,
     )
+    boxes = _boxes_from_payload(_parse_task_payload('detect', result_text), image.size)
+    path = write_detections(Path(image_path), boxes, image.size, prompt=prompt or 'Detect objects.', model=DEFAULT_MODEL)
+    return {'boxes': boxes, 'size': image.size, 'path': str(path)}
 
-    annotated = image
-    for annotator in (box_annotator, label_annotator):
-        annotated = annotator.annotate(scene=annotated, detections=detections)
 
-    out_dir = Path(output_dir)
-    out_dir.mkdir(exist_ok=True, parents=True)
-    out_path = out_dir / (Path(image_path).stem + '_annotated' + Path(image_path).suffix)
-    annotated.save(out_path)
-    return str(out_path)
+def render_annotated(image_path: str, boxes: Sequence[dict], out_path: str) -> str:
+    """Annotate the image at ``image_path`` with stored ``boxes`` and save it to ``out_path``."""
+    with Image.open(image_path) as image:
+        return annotate_boxes(image.convert('RGB'), boxes, out_path)
 
 
-def detect_boxes(image_bytes: bytes, prompt: Optional[str] = None):
+def detect_boxes(image_bytes: bytes, prompt: Optional[str] = None, source: Optional[str] = None):
     image = Image.open(BytesIO(image_bytes)).convert('RGB')
     print(f"[detect_boxes] image size: {image.size}, prompt: {prompt}")
-    width, height = image.size
-    target_height = int(1024 * height / width)
-    resized_image = image.resize((1024, target_height), Image.Resampling.LANCZOS)
+    resized_image = _resize_to_width(image, DETECT_WIDTH)
     p = (prompt or 'Detect objects.') + PROMPT_SUFFIX
     result_text = _generate_with_retry(
         _parts_for_image(p, resized_image),
-        temperature=TEMPERATURE,
+        task='detect',
+        source=source,
     )
     print('[detect_boxes] model response received')
-    detections = sv.Detections.from_vlm(
-        vlm=sv.VLM.GOOGLE_GEMINI_2_5,
-        result=result_text,
-        resolution_wh=image.size,
-    )
-    out = []
-    for i in range(len(detections)):
-        x1, y1, x2, y2 = map(float, detections.xyxy[i])
-        label = detections.data.get('class_name', [''])[i] if 'class_name' in detections.data else ''
-        out.append({"box_2d": [x1, y1, x2, y2], "label": label})
+    out = _boxes_from_payload(_parse_task_payload('detect', result_text), image.size)
     print(f"[detect_boxes] parsed boxes: {len(out)}")
     return out, image.size
 
 
-def assess_risk(image_bytes: bytes) -> dict:
+# ---------------------------- Local pre-screen ----------------------------
+
+PRESCREEN_MODE = os.getenv('PRESCREEN', 'off').strip().lower()  # off | hog | onnx
+PRESCREEN_MAX_SKIP_SECONDS = float(os.getenv('PRESCREEN_MAX_SKIP_SECONDS', '30'))
+
+
+class Prescreener:
+    """Cheap CPU stage that scores how likely a frame is worth sending to the model."""
+
+    name = 'base'
+
+    def confidence(self, image: Image.Image) -> float:
+        raise NotImplementedError
+
+
+class HogPersonPrescreener(Prescreener):
+    """OpenCV's built-in HOG + linear SVM people detector; no model file needed."""
+
+    name = 'hog'
+
+    def __init__(self, width: int = 320):
+        import cv2  # type: ignore
+
+        if not hasattr(cv2, 'HOGDescriptor'):
+            # OpenCV 5 moved HOG out of the main package
+            raise RuntimeError('this OpenCV build has no HOGDescriptor; use opencv 4.x or PRESCREEN=onnx')
+        self.width = width
+        self._hog = cv2.HOGDescriptor()
+        self._hog.setSVMDetector(cv2.HOGDescriptor_getDefaultPeopleDetector())
+        self._lock = threading.Lock()
+
+    def confidence(self, image: Image.Image) -> float:
+        gray = np.asarray(_resize_to_width(image, self.width).convert('L'))
+        with self._lock:
+            _, weights = self._hog.detectMultiScale(gray, winStride=(8, 8), padding=(8, 8), scale=1.05)
+        if len(weights) == 0:
+            return 0.0
+        # SVM margins: around 0 at the decision boundary, rarely above 2 for clear people
+        return float(min(1.0, max(0.0, float(np.max(weights)) / 2.0)))
+
+
+class OnnxPrescreener(Prescreener):
+    """Small ONNX classifier run through ``cv2.dnn``.
+
+    The confidence is the summed softmax probability of ``positive_classes`` (or the
+    sigmoid of a single-logit output).
+    """
+
+    name = 'onnx'
+
+    def __init__(self, model_path: str, input_size: int = 224, positive_classes: Sequence[int] = (1,)):
+        import cv2  # type: ignore
+
+        if not model_path or not Path(model_path).is_file():
+            raise ValueError(f'PRESCREEN_MODEL not found: {model_path!r}')
+        self._cv2 = cv2
+        self._net = cv2.dnn.readNetFromONNX(model_path)
+        self.input_size = input_size
+        self.positive_classes = tuple(positive_classes)
+        self._lock = threading.Lock()
+
+    def confidence(self, image: Image.Image) -> float:
+        rgb = np.asarray(image.convert('RGB'))
+        blob = self._cv2.dnn.blobFromImage(rgb, scalefactor=1 / 255.0, size=(self.input_size, self.input_size))
+        with self._lock:
+            self._net.setInput(blob)
+            out = np.asarray(self._net.forward(), dtype=np.float64).ravel()
+        if out.size == 1:
+            return float(1.0 / (1.0 + np.exp(-out[0])))
+        probs = np.exp(out - out.max())
+        probs /= probs.sum()
+        return float(sum(probs[i] for i in self.positive_classes if i < probs.size))
+
+
+class PrescreenCascade:
+    """Decides per frame whether to escalate to the remote model.
+
+    A frame escalates when the local confidence reaches ``threshold``, when the local
+    stage errors (fail open), or when ``max_skip_seconds`` have passed since the last
+    escalation for that source, so a missed person can't suppress checks indefinitely.
+    """
+
+    def __init__(self, prescreener: Prescreener, threshold: float, max_skip_seconds: float):
+        self.prescreener = prescreener
+        self.threshold = threshold
+        self.max_skip_seconds = max_skip_seconds
+        self._last_escalation: dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._counts = {'frames': 0, 'escalated': 0, 'forced': 0, 'errors': 0}
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+
+    def check(self, image: Image.Image, source: str) -> dict:
+        started = time.perf_counter()
+        error = None
+        try:
+            confidence = self.prescreener.confidence(image)
+        except Exception as e:  # noqa
+            confidence = None
+            error = str(e)
+        latency_ms = (time.perf_counter() - started) * 1000
+        now = time.time()
+        with self._lock:
+            last = self._last_escalation.get(source)
+            if error is not None:
+                reason = 'error'
+            elif confidence >= self.threshold:
+                reason = 'local'
+            elif last is None or now - last >= self.max_skip_seconds:
+                reason = 'safety_valve'
+            else:
+                reason = None
+            escalate = reason is not None
+            if escalate:
+                self._last_escalation[source] = now
+            self._counts['frames'] += 1
+            self._counts['escalated'] += int(escalate)
+            self._counts['forced'] += int(reason == 'safety_valve')
+            self._counts['errors'] += int(error is not None)
+            self._latency_total += latency_ms
+            self._latency_max = max(self._latency_max, latency_ms)
+        if error is not None:
+            print(f'[prescreen] {self.prescreener.name} failed, escalating: {error}')
+        return {
+            'stage': self.prescreener.name,
+            'escalate': escalate,
+            'reason': reason or 'below_threshold',
+            'confidence': None if confidence is None else round(confidence, 4),
+            'latency_ms': round(latency_ms, 2),
+        }
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self._counts)
+            frames = counts['frames']
+            return {
+                'stage': self.prescreener.name,
+                'threshold': self.threshold,
+                'max_skip_seconds': self.max_skip_seconds,
+                **counts,
+                'skipped': frames - counts['escalated'],
+                'escalation_rate': round(counts['escalated'] / frames, 4) if frames else 0.0,
+                'latency_ms_avg': round(self._latency_total / frames, 2) if frames else 0.0,
+                'latency_ms_max': round(self._latency_max, 2),
+            }
+
+
+_CASCADE: Optional[PrescreenCascade] = None
+_CASCADE_LOCK = threading.Lock()
+
+
+def _build_cascade() -> Optional[PrescreenCascade]:
+    if PRESCREEN_MODE in ('', 'off', 'none', '0'):
+        return None
+    if PRESCREEN_MODE == 'hog':
+        prescreener = HogPersonPrescreener(width=int(os.getenv('PRESCREEN_WIDTH', '320')))
+        default_threshold = '0.25'
+    elif PRESCREEN_MODE == 'onnx':
+        classes = [int(c) for c in os.getenv('PRESCREEN_POSITIVE_CLASSES', '1').split(',') if c.strip()]
+        prescreener = OnnxPrescreener(
+            os.getenv('PRESCREEN_MODEL', ''),
+            input_size=int(os.getenv('PRESCREEN_INPUT_SIZE', '224')),
+            positive_classes=classes,
+        )
+        default_threshold = '0.5'
+    else:
+        raise ValueError(f'unknown PRESCREEN mode {PRESCREEN_MODE!r} (expected off, hog or onnx)')
+    threshold = float(os.getenv('PRESCREEN_THRESHOLD', default_threshold))
+    print(f'[prescreen] {prescreener.name} enabled (threshold={threshold}, max_skip={PRESCREEN_MAX_SKIP_SECONDS}s)')
+    return PrescreenCascade(prescreener, threshold, PRESCREEN_MAX_SKIP_SECONDS)
+
+
+def get_prescreen() -> Optional[PrescreenCascade]:
+    """The configured cascade, built on first use; None when ``PRESCREEN`` is off."""
+    global _CASCADE, PRESCREEN_MODE
+    if _CASCADE is None and PRESCREEN_MODE not in ('', 'off', 'none', '0'):
+        with _CASCADE_LOCK:
+            if _CASCADE is None:
+                try:
+                    _CASCADE = _build_cascade()
+                except Exception as e:  # noqa
+                    print('[prescreen] disabled:', e)
+                    PRESCREEN_MODE = 'off'
+    return _CASCADE
+
+
+def prescreen_stats() -> Optional[dict]:
+    cascade = get_prescreen()
+    return cascade.stats() if cascade is not None else None
+
+
+def _prescreen(image: Image.Image, source: Optional[str]) -> Optional[dict]:
+    if source is None:
+        return None
+    cascade = get_prescreen()
+    if cascade is None:
+        return None
+    return cascade.check(image, source)
+
+
+def assess_risk(image_bytes: bytes, source: Optional[str] = None, prescreen: bool = True) -> dict:
+    """Score a frame for risk. With a ``source`` and ``PRESCREEN`` enabled, frames the
+    local stage doesn't escalate return ``skipped: True`` without a model call.
+    ``source`` also tags the call in the usage tracker."""
     image = Image.open(BytesIO(image_bytes)).convert('RGB')
-    width, height = image.size
-    target_height = int(512 * height / width)
-    resized_image = image.resize((512, target_height), Image.Resampling.LANCZOS)
+    screen = _prescreen(image, source) if prescreen else None
+    if screen is not None and not screen['escalate']:
+        get_usage_tracker().record('risk', source, 'skipped')
+        return {'score': 0.0, 'indicators': [], 'raw': None, 'skipped': True, 'prescreen': screen}
+    # Identical frames (several viewers of one camera, several workers) share one call
+    cache_key = _cache_key('risk', RISK_PROMPT, image_bytes)
+    cached = _cache_get(cache_key)
+    if cached is not None:
+        get_usage_tracker().record('risk', source, 'cached')
+        return dict(cached, cached=True, **({'prescreen': screen} if screen is not None else {}))
+    resized_image = _resize_to_width(image, 512)
     try:
         result_text = _generate_with_retry(
             _parts_for_image(RISK_PROMPT, resized_image),
-            temperature=0.1,
+            task='risk',
+            source=source,
         )
-        data = _parse_json_payload(result_text)
-        score = float(data.get('score', 0))
-        indicators = data.get('indicators', []) or []
-        if not isinstance(indicators, list):
-            indicators = []
-        indicators = [str(x)[:40].lower() for x in indicators][:10]
-        score = max(0.0, min(1.0, score))
-        return {'score': score, 'indicators': indicators, 'raw': result_text}
+        data = _parse_task_payload('risk', result_text)
+        score, indicators = _normalize_risk(data)
+        result = {'score': score, 'indicators': indicators, 'raw': result_text}
+        _cache_set(cache_key, result)
     except Exception as e:  # noqa
         print('[assess_risk] failed:', e)
         if 'result_text' in locals():
             preview = (result_text or '')[:240]
             print('[assess_risk] raw response preview:', preview)
-        return {'score': 0.0, 'indicators': [], 'raw': None}
+        # 'failed' lets callers tell a broken reply from a genuine all-clear
+        result = {'score': 0.0, 'indicators': [], 'raw': None, 'failed': True}
+    if screen is not None:
+        result['prescreen'] = screen
+    return result
+
+
+def analyze_frame(
+    image_bytes: bytes,
+    prompt: Optional[str] = None,
+    source: Optional[str] = None,
+) -> dict:
+    """Risk score, indicators and boxes from a single model request.
+
+    The frame is decoded and resized once. Boxes are returned rather than drawn; the app
+    renders annotated copies on demand. ``source`` enables the local pre-screen and tags
+    usage as in ``assess_risk``.
+    """
+    image = Image.open(BytesIO(image_bytes)).convert('RGB')
+    screen = _prescreen(image, source)
+    if screen is not None and not screen['escalate']:
+        get_usage_tracker().record('analyze', source, 'skipped')
+        return {
+            'score': 0.0, 'indicators': [], 'boxes': [], 'size': image.size,
+            'raw': None, 'skipped': True, 'prescreen': screen,
+        }
+    prompt_text = ANALYZE_PROMPT
+    if prompt:
+        prompt_text += ' Focus: ' + prompt
+    cache_key = _cache_key('analyze', prompt_text, image_bytes)
+    cached = _cache_get(cache_key)
+    try:
+        if cached is not None:
+            get_usage_tracker().record('analyze', source, 'cached')
+            result_text = cached['raw']
+            score, indicators, boxes = cached['score'], cached['indicators'], cached['boxes']
+        else:
+            result_text = _generate_with_retry(
+                _parts_for_image(prompt_text, _resize_to_width(image, ANALYZE_WIDTH)),
+                task='analyze',
+                source=source,
+            )
+            data = _parse_task_payload('analyze', result_text)
+            score, indicators = _normalize_risk(data)
+            boxes = _boxes_from_payload(data.get('boxes'), image.size)
+            _cache_set(cache_key, {'score': score, 'indicators': indicators, 'boxes': boxes, 'raw': result_text})
+    except Exception as e:  # noqa
+        print('[analyze_frame] failed:', e)
+        if 'result_text' in locals():
+            print('[analyze_frame] raw response preview:', (result_text or '')[:240])
+        failed = {'score': 0.0, 'indicators': [], 'boxes': [], 'size': image.size, 'raw': None, 'failed': True}
+        if screen is not None:
+            failed['prescreen'] = screen
+        return failed
+    return {
+        'score': score,
+        'indicators': indicators,
+        'boxes': boxes,
+        'size': image.size,
+        'raw': result_text,
+        **({'cached': True} if cached is not None else {}),
+        **({'prescreen': screen} if screen is not None else {}),
+    }
+
+
+def warm_up(annotation: bool = True) -> dict:
+    """Pay one-off startup costs before the first real request.
+
+    Opens a pooled connection to the model host, runs the decode/resize/encode pipeline
+    on a small image (loading Pillow's JPEG plugin), builds the pre-screen stage and,
+    with ``annotation``, imports supervision. No model call is made, so no quota is used.
+    Step timings (ms) are returned and kept for ``warmup_report``.
+    """
+    global _WARMUP
+    report: dict = {'started_at': time.time()}
+
+    def step(name, fn):
+        started = time.perf_counter()
+        try:
+            fn()
+            report[name] = round((time.perf_counter() - started) * 1000, 1)
+        except Exception as e:  # noqa
+            report[name] = None
+            report.setdefault('errors', {})[name] = str(e)
+
+    def connect():
+        from urllib.parse import urlsplit
+
+        parts = urlsplit(_model_url())
+        _session().head(f'{parts.scheme}://{parts.netloc}/', timeout=10)
+
+    def pipeline():
+        buf = BytesIO()
+        Image.new('RGB', (640, 480), (90, 90, 90)).save(buf, format='JPEG', quality=80)
+        image = Image.open(BytesIO(buf.getvalue())).convert('RGB')
+        _image_to_b64(_resize_to_width(image, ANALYZE_WIDTH))
+
+    step('connect_ms', connect)
+    step('pipeline_ms', pipeline)
+    step('prescreen_ms', get_prescreen)
+    if annotation:
+        step('annotation_ms', lambda: __import__('supervision'))
+    report['total_ms'] = round((time.time() - report['started_at']) * 1000, 1)
+    _WARMUP = report
+    print(f"[warmup] ready in {report['total_ms']}ms {({k: v for k, v in report.items() if k.endswith('_ms')})}")
+    return report
+
+
+def warmup_report() -> Optional[dict]:
+    return _WARMUP
+
+
+def usage_summary(group_by: str = 'task') -> dict:
+    return get_usage_tracker().summary(group_by)
+
+
+def breaker_state() -> Optional[dict]:
+    state = _shared()
+    return state.breaker_state('model') if state is not None else None
 
 
 if __name__ == '__main__':
     import argparse
 
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
     parser = argparse.ArgumentParser()
     parser.add_argument('image', help='Path to image file')
     parser.add_argument('-o', '--output-dir', default='annotated')
     parser.add_argument('-p', '--prompt', default='Detect objects.')
     args = parser.parse_args()
 
-    path = run_detection(args.image, args.output_dir, args.prompt)
-    print('Annotated saved to', path)
+    result = run_detection(args.image, args.prompt)
+    print('Detections saved to', result['path'])
+    out_path = Path(args.output_dir) / (Path(args.image).stem + '_annotated' + Path(args.image).suffix)
+    print('Annotated saved to', render_annotated(args.image, result['boxes'], str(out_path)))
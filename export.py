@@ -0,0 +1,348 @@
+"""Streaming bulk export of gallery frames plus their metadata, as tar or zip.
+
+Archives are produced chunk by chunk straight from the gallery files, so memory use
+does not grow with the export size and nothing is staged on disk:
+
+* ``tar`` (ustar) has a size known before the first byte, so it is served with a
+  ``Content-Length`` and can be resumed with HTTP ``Range`` requests.
+* ``zip`` entries are stored (JPEGs don't compress) and streamed with data
+  descriptors. Zips cannot be byte-ranged; resume them with the ``after`` cursor.
+
+The archive starts with ``metadata.jsonl`` and/or ``metadata.csv``, one row per frame.
+Frames follow under ``frames/`` in (mtime, name) order. Each metadata row carries a
+``cursor``: pass the cursor of the last frame received as ``after`` to continue.
+"""
+from __future__ import annotations
+
+import csv
+import hashlib
+import io
+import json
+import os
+import tarfile
+import time
+import zipfile
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+from storage import GalleryIndex, read_sidecar
+
+CHUNK_SIZE = 1024 * 1024
+FRAMES_DIR = 'frames'
+EXPORT_FORMATS = ('tar', 'zip')
+META_FORMATS = ('jsonl', 'csv')
+CSV_COLUMNS = ('cursor', 'filename', 'timestamp', 'score', 'indicators', 'source', 'clip', 'mtime', 'size')
+BLOCK = tarfile.BLOCKSIZE
+
+
+@dataclass
+class ExportEntry:
+    name: str
+    path: Path
+    mtime: float
+    size: int
+
+    @property
+    def cursor(self) -> str:
+        # repr() round-trips the float exactly; fixed decimals could land before the
+        # entry's real mtime and resend it
+        return f'{self.mtime!r}:{self.name}'
+
+
+def parse_cursor(raw: str) -> Tuple[float, str]:
+    mtime, sep, name = raw.partition(':')
+    if not sep or not name:
+        raise ValueError(f'invalid cursor {raw!r}')
+    return float(mtime), name
+
+
+def parse_time(raw: str) -> float:
+    """Unix timestamp or ISO date/datetime (local time)."""
+    try:
+        return float(raw)
+    except ValueError:
+        return datetime.fromisoformat(raw).timestamp()
+
+
+def select_entries(
+    index: GalleryIndex,
+    folder: str,
+    start: float,
+    end: float,
+    after: Optional[str] = None,
+    min_score: float = 0.0,
+    limit: Optional[int] = None,
+) -> List[ExportEntry]:
+    entries = []
+    cursor = parse_cursor(after) if after else None
+    for name, mtime in index.between(start, end, after=cursor, min_score=min_score, limit=limit):
+        path = Path(folder) / name
+        try:
+            size = path.stat().st_size
+        except FileNotFoundError:
+            continue
+        entries.append(ExportEntry(name, path, mtime, size))
+    return entries
+
+
+def metadata_row(entry: ExportEntry) -> dict:
+    row = read_sidecar(entry.path)
+    row.update(
+        filename=entry.name,
+        file=f'{FRAMES_DIR}/{entry.name}',
+        mtime=entry.mtime,
+        size=entry.size,
+        cursor=entry.cursor,
+    )
+    return row
+
+
+def _jsonl_line(entry: ExportEntry) -> bytes:
+    return (json.dumps(metadata_row(entry), sort_keys=True, separators=(',', ':')) + '\n').encode('utf-8')
+
+
+def _csv_line(row: Iterable) -> bytes:
+    buf = io.StringIO()
+    csv.writer(buf, lineterminator='\n').writerow(row)
+    return buf.getvalue().encode('utf-8')
+
+
+def _csv_entry_line(entry: ExportEntry) -> bytes:
+    row = metadata_row(entry)
+    indicators = row.get('indicators') or []
+    row['indicators'] = ';'.join(indicators) if isinstance(indicators, list) else indicators
+    return _csv_line(row.get(column, '') for column in CSV_COLUMNS)
+
+
+def _metadata_lines(entries: List[ExportEntry], fmt: str) -> Iterator[bytes]:
+    if fmt == 'csv':
+        yield _csv_line(CSV_COLUMNS)
+        for entry in entries:
+            yield _csv_entry_line(entry)
+    else:
+        for entry in entries:
+            yield _jsonl_line(entry)
+
+
+def _read_file(path: Path, offset: int = 0) -> Iterator[bytes]:
+    try:
+        with open(path, 'rb') as fh:
+            fh.seek(offset)
+            while True:
+                chunk = fh.read(CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+    except FileNotFoundError:
+        return
+
+
+def _exact(chunks: Iterator[bytes], length: int, pad: bytes = b'\0') -> Iterator[bytes]:
+    """Exactly ``length`` bytes of ``chunks``: cut off or padded if the source changed
+    since its size was taken (the archive layout is already fixed by then)."""
+    remaining = length
+    for chunk in chunks:
+        if remaining <= 0:
+            break
+        chunk = chunk[:remaining]
+        remaining -= len(chunk)
+        yield chunk
+    while remaining > 0:
+        n = min(remaining, CHUNK_SIZE)
+        yield pad * n
+        remaining -= n
+
+
+def _skip(chunks: Iterator[bytes], skip: int) -> Iterator[bytes]:
+    for chunk in chunks:
+        if skip >= len(chunk):
+            skip -= len(chunk)
+            continue
+        yield chunk[skip:] if skip else chunk
+        skip = 0
+
+
+# A piece of the archive: its length, and a producer of its bytes from an offset
+_Piece = Tuple[int, Callable[[int], Iterator[bytes]]]
+
+
+class TarExport:
+    """ustar archive whose total size and ETag are known before streaming starts."""
+
+    content_type = 'application/x-tar'
+
+    def __init__(self, entries: List[ExportEntry], meta_formats: Iterable[str] = ('jsonl',)):
+        self.entries = entries
+        self.meta_formats = [fmt for fmt in META_FORMATS if fmt in set(meta_formats)]
+        # Fixed (not the wall clock) so every request for the same export gives identical bytes
+        self.created = max((entry.mtime for entry in entries), default=0.0)
+        # One pass over the sidecars to size the metadata members; they are
+        # regenerated (not kept) while streaming
+        self._meta_sizes = {
+            fmt: sum(len(line) for line in _metadata_lines(entries, fmt)) for fmt in self.meta_formats
+        }
+        digest = hashlib.sha1()
+        for fmt, size in self._meta_sizes.items():
+            digest.update(f'{fmt}:{size}\n'.encode())
+        for entry in entries:
+            digest.update(f'{entry.cursor}:{entry.size}\n'.encode())
+        self.etag = digest.hexdigest()
+        self.size = sum(length for length, _ in self._pieces())
+
+    @staticmethod
+    def _header(name: str, size: int, mtime: float) -> bytes:
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = int(mtime)
+        info.mode = 0o644
+        return info.tobuf(tarfile.USTAR_FORMAT, 'utf-8', 'surrogateescape')
+
+    def _member(self, name: str, size: int, mtime: float, produce: Callable[[int], Iterator[bytes]]) -> Iterator[_Piece]:
+        header = self._header(name, size, mtime)
+        yield len(header), lambda skip: iter([header[skip:]])
+        yield size, produce
+        padding = -size % BLOCK
+        if padding:
+            yield padding, lambda skip: iter([b'\0' * (padding - skip)])
+
+    def _pieces(self) -> Iterator[_Piece]:
+        for fmt in self.meta_formats:
+            size = self._meta_sizes[fmt]
+
+            def produce(skip: int, fmt=fmt, size=size) -> Iterator[bytes]:
+                return _skip(_exact(_metadata_lines(self.entries, fmt), size, b' '), skip)
+
+            yield from self._member(f'metadata.{fmt}', size, self.created, produce)
+        for entry in self.entries:
+            def produce(skip: int, entry=entry) -> Iterator[bytes]:
+                return _exact(_read_file(entry.path, skip), entry.size - skip)
+
+            yield from self._member(f'{FRAMES_DIR}/{entry.name}', entry.size, entry.mtime, produce)
+        yield 2 * BLOCK, lambda skip: iter([b'\0' * (2 * BLOCK - skip)])
+
+    def iter_bytes(self, start: int = 0, stop: Optional[int] = None) -> Iterator[bytes]:
+        """Bytes ``[start, stop)`` of the archive; members before ``start`` are skipped unread."""
+        stop = self.size if stop is None else min(stop, self.size)
+        pos = 0
+        for length, produce in self._pieces():
+            if pos >= stop:
+                break
+            if pos + length <= start:
+                pos += length
+                continue
+            skip = max(0, start - pos)
+            remaining = min(length, stop - pos) - skip
+            for chunk in produce(skip):
+                chunk = chunk[:remaining]
+                remaining -= len(chunk)
+                if chunk:
+                    yield chunk
+                if remaining <= 0:
+                    break
+            pos += length
+
+
+class _Sink:
+    """Write-only, non-seekable file object: zipfile then streams with data descriptors."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> Iterator[bytes]:
+        chunks, self._chunks = self._chunks, []
+        return iter(chunks)
+
+
+class ZipExport:
+    content_type = 'application/zip'
+
+    def __init__(self, entries: List[ExportEntry], meta_formats: Iterable[str] = ('jsonl',)):
+        self.entries = entries
+        self.meta_formats = [fmt for fmt in META_FORMATS if fmt in set(meta_formats)]
+
+    @staticmethod
+    def _info(name: str, mtime: float, compress_type: int) -> zipfile.ZipInfo:
+        stamp = time.localtime(max(mtime, 315532800))  # zip dates start in 1980
+        info = zipfile.ZipInfo(name, date_time=stamp[:6])
+        info.compress_type = compress_type
+        info.external_attr = 0o644 << 16
+        return info
+
+    def iter_bytes(self) -> Iterator[bytes]:
+        sink = _Sink()
+        with zipfile.ZipFile(sink, 'w', allowZip64=True) as zf:
+            for fmt in self.meta_formats:
+                with zf.open(self._info(f'metadata.{fmt}', time.time(), zipfile.ZIP_DEFLATED), 'w') as dst:
+                    for line in _metadata_lines(self.entries, fmt):
+                        dst.write(line)
+                        yield from sink.drain()
+            for entry in self.entries:
+                # Declaring the size up front lets zipfile decide on zip64 before writing
+                info = self._info(f'{FRAMES_DIR}/{entry.name}', entry.mtime, zipfile.ZIP_STORED)
+                info.file_size = entry.size
+                with zf.open(info, 'w') as dst:
+                    for chunk in _exact(_read_file(entry.path), entry.size):
+                        dst.write(chunk)
+                        yield from sink.drain()
+                yield from sink.drain()
+        yield from sink.drain()
+
+
+def build_export(fmt: str, entries: List[ExportEntry], meta_formats: Iterable[str] = ('jsonl',)):
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f'unknown export format {fmt!r} (expected one of {", ".join(EXPORT_FORMATS)})')
+    unknown = set(meta_formats) - set(META_FORMATS)
+    if unknown:
+        raise ValueError(f'unknown metadata format(s) {", ".join(sorted(unknown))}')
+    return (TarExport if fmt == 'tar' else ZipExport)(entries, meta_formats)
+
+
+def export_filename(fmt: str, start: float, end: float) -> str:
+    day = lambda ts: time.strftime('%Y%m%d', time.localtime(ts))  # noqa: E731
+    return f'gallery_{day(start)}-{day(end)}.{fmt}'
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description='Export gallery frames and metadata as a tar or zip stream')
+    parser.add_argument('--from', dest='start', default='0', help='Start (unix time or ISO date; default: everything)')
+    parser.add_argument('--to', dest='end', default=None, help='End, exclusive (unix time or ISO date; default: now)')
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='tar')
+    parser.add_argument('--meta', default='jsonl', help='Metadata files: jsonl, csv or jsonl,csv')
+    parser.add_argument('--after', default=None, help='Resume after this metadata cursor')
+    parser.add_argument('--min-score', type=float, default=0.0)
+    parser.add_argument('--folder', default=str(Path('gallery')))
+    parser.add_argument('--index', default=os.getenv('GALLERY_INDEX', str(Path('gallery') / 'index.sqlite3')))
+    parser.add_argument('-o', '--output', default='-', help='Output file (default: stdout)')
+    args = parser.parse_args()
+
+    index = GalleryIndex(args.index)
+    if index.is_empty():
+        index.reconcile(args.folder)
+    start = parse_time(args.start)
+    end = parse_time(args.end) if args.end else time.time() + 1
+    selected = select_entries(index, args.folder, start, end, after=args.after, min_score=args.min_score)
+    export = build_export(args.format, selected, [m.strip() for m in args.meta.split(',') if m.strip()])
+    out = sys.stdout.buffer if args.output == '-' else open(args.output, 'wb')
+    written = 0
+    started = time.perf_counter()
+    with out:
+        for chunk in export.iter_bytes():
+            out.write(chunk)
+            written += len(chunk)
+    print(
+        f'[export] {len(selected)} frames, {written / 1e6:.1f} MB in {time.perf_counter() - started:.2f}s'
+        + (f' -> {args.output}' if args.output != '-' else ''),
+        file=sys.stderr,
+    )
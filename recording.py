@@ -0,0 +1,424 @@
+"""Indexed recordings of a camera's JPEG frame stream (``.frec``) and their replay.
+
+Layout::
+
+    header   magic 'FREC', version, meta length, JSON meta (camera, fps, size, ...)
+    frames   per frame: ts (f8), length (u4), JPEG bytes
+    index    ts[] (f8), offset[] (u8), length[] (u4), columnar
+    footer   index offset (u8), frame count (u4), magic 'FRIX'
+
+Frames can be read by number through the index. If the file was cut short (crash,
+kill -9), the per-frame headers let the reader rebuild the index by walking it.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+from pathlib import Path
+from typing import Iterator, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+MAGIC = b'FREC'
+INDEX_MAGIC = b'FRIX'
+VERSION = 1
+HEADER = struct.Struct('<4sHI')
+FRAME_HEADER = struct.Struct('<dI')
+FOOTER = struct.Struct('<QI4s')
+REPLAY_PREFIX = 'replay:'
+# The index is kept in memory until close (20 bytes per frame); callers rotate to a new
+# file once a recorder is ``full``
+SEGMENT_MAX_FRAMES = 100_000
+
+
+class FrameRecorder:
+    """Append JPEG frames with timestamps to a ``.frec`` file.
+
+    ``full`` turns true after ``max_frames`` frames or ``max_bytes`` bytes, so a long
+    recording can be split into segments with a bounded index.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        meta: Optional[dict] = None,
+        max_frames: int = SEGMENT_MAX_FRAMES,
+        max_bytes: Optional[int] = None,
+    ):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, 'wb', buffering=1024 * 1024)
+        meta_bytes = json.dumps(dict(meta or {}, created=time.time()), separators=(',', ':')).encode('utf-8')
+        self._file.write(HEADER.pack(MAGIC, VERSION, len(meta_bytes)) + meta_bytes)
+        self._pos = HEADER.size + len(meta_bytes)
+        self._ts = array('d')
+        self._offset = array('Q')
+        self._length = array('I')
+        self._lock = threading.Lock()
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.bytes_written = self._pos
+
+    def __len__(self) -> int:
+        return len(self._ts)
+
+    @property
+    def full(self) -> bool:
+        return len(self._ts) >= self.max_frames or (self.max_bytes is not None and self.bytes_written >= self.max_bytes)
+
+    def write(self, ts: float, jpeg: bytes) -> None:
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(FRAME_HEADER.pack(ts, len(jpeg)))
+            self._file.write(jpeg)
+            self._ts.append(ts)
+            self._offset.append(self._pos + FRAME_HEADER.size)
+            self._length.append(len(jpeg))
+            self._pos += FRAME_HEADER.size + len(jpeg)
+            self.bytes_written = self._pos
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file.closed:
+                return
+            index_offset = self._pos
+            self._file.write(self._ts.tobytes())
+            self._file.write(self._offset.tobytes())
+            self._file.write(self._length.tobytes())
+            self._file.write(FOOTER.pack(index_offset, len(self._ts), INDEX_MAGIC))
+            self._file.close()
+
+    def __enter__(self) -> 'FrameRecorder':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class FrameRecording:
+    """Read-only, memory-mapped view of a ``.frec`` file."""
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self._fh = open(self.path, 'rb')
+        size = os.fstat(self._fh.fileno()).st_size
+        if size < HEADER.size:
+            raise ValueError(f'{path}: not a frame recording')
+        self._map = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, meta_len = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{path}: not a frame recording (or unsupported version)')
+        self.meta = json.loads(self._map[HEADER.size:HEADER.size + meta_len])
+        self._data_start = HEADER.size + meta_len
+        self.recovered = False
+        if not self._load_index(size):
+            self._rebuild_index(size)
+            self.recovered = True
+
+    def _load_index(self, size: int) -> bool:
+        if size < self._data_start + FOOTER.size:
+            return False
+        index_offset, count, magic = FOOTER.unpack_from(self._map, size - FOOTER.size)
+        if magic != INDEX_MAGIC or index_offset + count * 20 + FOOTER.size != size:
+            return False
+        self.ts = array('d', self._map[index_offset:index_offset + 8 * count])
+        self.offsets = array('Q', self._map[index_offset + 8 * count:index_offset + 16 * count])
+        self.lengths = array('I', self._map[index_offset + 16 * count:index_offset + 20 * count])
+        return True
+
+    def _rebuild_index(self, size: int) -> None:
+        self.ts, self.offsets, self.lengths = array('d'), array('Q'), array('I')
+        pos = self._data_start
+        while pos + FRAME_HEADER.size <= size:
+            ts, length = FRAME_HEADER.unpack_from(self._map, pos)
+            start = pos + FRAME_HEADER.size
+            # A torn final frame, or the index of a file whose footer was lost
+            if length == 0 or start + length > size or self._map[start:start + 2] != b'\xff\xd8':
+                break
+            self.ts.append(ts)
+            self.offsets.append(start)
+            self.lengths.append(length)
+            pos = start + length
+
+    def __len__(self) -> int:
+        return len(self.ts)
+
+    def frame(self, i: int) -> bytes:
+        offset = self.offsets[i]
+        return self._map[offset:offset + self.lengths[i]]
+
+    def __iter__(self) -> Iterator[Tuple[float, bytes]]:
+        for i in range(len(self)):
+            yield self.ts[i], self.frame(i)
+
+    @property
+    def duration(self) -> float:
+        return self.ts[-1] - self.ts[0] if len(self) > 1 else 0.0
+
+    def info(self) -> dict:
+        count = len(self)
+        total = sum(self.lengths)
+        return {
+            'path': str(self.path),
+            'meta': self.meta,
+            'frames': count,
+            'duration_s': round(self.duration, 3),
+            'fps': round((count - 1) / self.duration, 2) if self.duration > 0 else None,
+            'frame_bytes_avg': round(total / count) if count else 0,
+            'file_bytes': self.path.stat().st_size,
+            'recovered_index': self.recovered,
+        }
+
+    def close(self) -> None:
+        self._map.close()
+        self._fh.close()
+
+
+def is_replay_source(source) -> bool:
+    return isinstance(source, str) and source.startswith(REPLAY_PREFIX)
+
+
+def parse_replay_source(source: str) -> Tuple[str, float, bool]:
+    """``replay:<path>[?speed=S][&loop=0|1]`` -> (path, speed, loop). ``speed=0`` means as fast as possible."""
+    parts = urlsplit(source[len(REPLAY_PREFIX):])
+    query = parse_qs(parts.query)
+    speed = float(query.get('speed', ['1'])[0])
+    loop = query.get('loop', ['1'])[0].lower() not in ('0', 'false', 'no', 'off')
+    return parts.path, max(0.0, speed), loop
+
+
+class ReplayCapture:
+    """``cv2.VideoCapture`` stand-in that plays a recording back with its original timing.
+
+    ``speed`` scales playback (2.0 = twice as fast, 0 = no pacing). With ``loop`` the
+    recording restarts at the end, and the timeline is re-anchored so pacing stays smooth.
+    """
+
+    def __init__(self, path: str, speed: float = 1.0, loop: bool = True):
+        self.recording = FrameRecording(path)
+        if not len(self.recording):
+            raise ValueError(f'{path}: recording has no frames')
+        self.speed = speed
+        self.loop = loop
+        self.position = 0
+        self.loops = 0
+        self._anchor: Optional[Tuple[float, float]] = None  # (wall clock, recording ts)
+        self._opened = True
+
+    def isOpened(self) -> bool:  # noqa: N802 - mirrors cv2.VideoCapture
+        return self._opened
+
+    def read_jpeg(self) -> Optional[bytes]:
+        if not self._opened:
+            return None
+        if self.position >= len(self.recording):
+            if not self.loop:
+                return None
+            self.position = 0
+            self.loops += 1
+            self._anchor = None
+        ts = self.recording.ts[self.position]
+        if self.speed > 0:
+            now = time.perf_counter()
+            if self._anchor is None:
+                self._anchor = (now, ts)
+            due = self._anchor[0] + (ts - self._anchor[1]) / self.speed
+            if due > now:
+                time.sleep(due - now)
+        data = self.recording.frame(self.position)
+        self.position += 1
+        return data
+
+    def read(self):
+        import cv2  # type: ignore
+        import numpy as np
+
+        data = self.read_jpeg()
+        if data is None:
+            return False, None
+        frame = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        return frame is not None, frame
+
+    def set(self, prop: int, value: float) -> bool:
+        import cv2  # type: ignore
+
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            self.position = max(0, min(int(value), len(self.recording)))
+            self._anchor = None
+            return True
+        return False
+
+    def get(self, prop: int) -> float:
+        import cv2  # type: ignore
+
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return float(self.position)
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return float(len(self.recording))
+        if prop == cv2.CAP_PROP_FPS:
+            info = self.recording.info()
+            return float(info['fps'] or 0.0)
+        return 0.0
+
+    def release(self) -> None:
+        if self._opened:
+            self._opened = False
+            self.recording.close()
+
+
+def open_replay(source: str) -> ReplayCapture:
+    path, speed, loop = parse_replay_source(source)
+    return ReplayCapture(path, speed=speed, loop=loop)
+
+
+# ---------------------------- Benchmarks ----------------------------
+
+def _percentiles(values) -> dict:
+    if not values:
+        return {}
+    ordered = sorted(values)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]  # noqa: E731
+    return {'p50': round(pick(0.5), 2), 'p95': round(pick(0.95), 2), 'max': round(ordered[-1], 2)}
+
+
+def bench_read(path: str, decode: bool = True) -> dict:
+    """Raw read and JPEG decode throughput of a recording on this machine."""
+    import cv2  # type: ignore
+    import numpy as np
+
+    recording = FrameRecording(path)
+    started = time.perf_counter()
+    total = 0
+    for _, data in recording:
+        total += len(data)
+    read_s = time.perf_counter() - started
+    result = {'frames': len(recording), 'read_fps': round(len(recording) / max(read_s, 1e-9)), 'read_mb_s': round(total / 1e6 / max(read_s, 1e-9), 1)}
+    if decode:
+        started = time.perf_counter()
+        for _, data in recording:
+            cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        result['decode_fps'] = round(len(recording) / max(time.perf_counter() - started, 1e-9), 1)
+    recording.close()
+    return result
+
+
+async def _bench_client(url: str, seconds: float, decode: bool) -> dict:
+    import base64
+
+    import websockets
+
+    frames = 0
+    decode_ms = []
+    gaps = []
+    async with websockets.connect(url, max_size=None) as ws:
+        deadline = time.perf_counter() + seconds
+        last = None
+        while time.perf_counter() < deadline:
+            try:
+                message = await asyncio.wait_for(ws.recv(), timeout=max(0.01, deadline - time.perf_counter()))
+            except asyncio.TimeoutError:
+                break
+            if isinstance(message, str) and message.startswith('{'):
+                continue
+            now = time.perf_counter()
+            if last is not None:
+                gaps.append((now - last) * 1000)
+            last = now
+            frames += 1
+            if decode:
+                import cv2  # type: ignore
+                import numpy as np
+
+                started = time.perf_counter()
+                cv2.imdecode(np.frombuffer(base64.b64decode(message), dtype=np.uint8), cv2.IMREAD_COLOR)
+                decode_ms.append((time.perf_counter() - started) * 1000)
+    return {'frames': frames, 'fps': round(frames / seconds, 2), 'gap_ms': _percentiles(gaps), 'decode_ms': _percentiles(decode_ms)}
+
+
+async def bench_clients(url: str, clients: int, seconds: float, decode: bool) -> dict:
+    """Connect ``clients`` WebSocket viewers to a running sender and measure what they receive."""
+    results = await asyncio.gather(*(_bench_client(url, seconds, decode) for _ in range(clients)))
+    return {
+        'clients': clients,
+        'fps_per_client': [r['fps'] for r in results],
+        'total_fps': round(sum(r['fps'] for r in results), 2),
+        'gap_ms': results[0]['gap_ms'] if results else {},
+        'decode_ms': results[0]['decode_ms'] if results else {},
+    }
+
+
+def bench_risk(path: str, url: str, concurrency: int, frames: int, camera: str = 'bench') -> dict:
+    """Post recorded frames to a risk endpoint (e.g. /api/analyze_frame) and report throughput."""
+    import base64
+    from concurrent.futures import ThreadPoolExecutor
+
+    import requests
+
+    recording = FrameRecording(path)
+    count = min(frames, len(recording)) if frames else len(recording)
+    payloads = [
+        'data:image/jpeg;base64,' + base64.b64encode(recording.frame(i)).decode('ascii')
+        for i in range(count)
+    ]
+    recording.close()
+    session = requests.Session()
+    latencies = []
+    statuses: dict = {}
+
+    def post(image: str) -> None:
+        started = time.perf_counter()
+        response = session.post(url, json={'image': image, 'camera': camera}, timeout=120)
+        latencies.append((time.perf_counter() - started) * 1000)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(post, payloads))
+    elapsed = time.perf_counter() - started
+    return {
+        'requests': count,
+        'concurrency': concurrency,
+        'req_per_s': round(count / max(elapsed, 1e-9), 2),
+        'latency_ms': _percentiles(latencies),
+        'status': statuses,
+    }
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Inspect and benchmark .frec frame recordings')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_info = sub.add_parser('info', help='Show recording metadata and stats')
+    p_info.add_argument('path')
+    p_read = sub.add_parser('bench-read', help='Local read + JPEG decode throughput')
+    p_read.add_argument('path')
+    p_read.add_argument('--no-decode', action='store_true')
+    p_clients = sub.add_parser('bench-clients', help='Fan-out: N WebSocket viewers of a running sender')
+    p_clients.add_argument('--url', default='ws://localhost:8765')
+    p_clients.add_argument('--clients', type=int, default=4)
+    p_clients.add_argument('--seconds', type=float, default=10.0)
+    p_clients.add_argument('--no-decode', action='store_true')
+    p_risk = sub.add_parser('bench-risk', help='Post recorded frames to a risk endpoint')
+    p_risk.add_argument('path')
+    p_risk.add_argument('--url', default='http://localhost:5000/api/analyze_frame')
+    p_risk.add_argument('--concurrency', type=int, default=4)
+    p_risk.add_argument('--frames', type=int, default=100, help='Frames to post (0 = all)')
+    args = parser.parse_args()
+
+    if args.command == 'info':
+        recording = FrameRecording(args.path)
+        print(json.dumps(recording.info(), indent=2))
+        recording.close()
+    elif args.command == 'bench-read':
+        print(json.dumps(bench_read(args.path, decode=not args.no_decode), indent=2))
+    elif args.command == 'bench-clients':
+        print(json.dumps(asyncio.run(bench_clients(args.url, args.clients, args.seconds, not args.no_decode)), indent=2))
+    elif args.command == 'bench-risk':
+        print(json.dumps(bench_risk(args.path, args.url, args.concurrency, args.frames), indent=2))
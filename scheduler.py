@@ -0,0 +1,215 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from io import BytesIO
+from typing import Dict, Optional
+
+import numpy as np
+from PIL import Image
+
+THUMB_SIZE = (32, 24)
+
+
+def _float_env(name: str, default: Optional[float]) -> Optional[float]:
+    raw = os.getenv(name)
+    if raw is None or raw.strip() == '':
+        return default
+    try:
+        return float(raw)
+    except ValueError:
+        return default
+
+
+def frame_thumbnail(image_bytes: bytes) -> Optional[np.ndarray]:
+    """Tiny grayscale thumbnail used for scene-change checks.
+
+    ``draft`` lets the JPEG decoder scale down while decoding, so this costs far less
+    than a full decode.
+    """
+    try:
+        image = Image.open(BytesIO(image_bytes))
+        image.draft('L', (THUMB_SIZE[0] * 4, THUMB_SIZE[1] * 4))
+        return np.asarray(image.convert('L').resize(THUMB_SIZE), dtype=np.float32)
+    except Exception:  # noqa
+        return None
+
+
+@dataclass
+class _Camera:
+    ewma: float = 0.0
+    last_score: Optional[float] = None
+    calm_checks: int = 0
+    thumb: Optional[np.ndarray] = None
+    interval: float = 0.0
+    next_at: float = 0.0
+    last_seen: float = 0.0
+    checks: int = 0
+    reasons: Dict[str, int] = field(default_factory=dict)
+
+
+class SamplingScheduler:
+    """Chooses when each camera should be checked next.
+
+    The interval starts at ``base_interval``. It drops to ``min_interval`` when a
+    camera's score is rising or its smoothed score is elevated, and resets to base when
+    the scene changes. It grows by ``backoff`` per consecutive calm check, up to
+    ``max_interval``. With ``calls_per_minute`` set, calm cameras are stretched so the
+    total stays within budget. Checks are also placed at least one budget slot apart,
+    so cameras don't fire together. This only plans against the budget; the shared
+    token bucket in ``detector`` is what enforces it.
+    """
+
+    def __init__(
+        self,
+        min_interval: float = 1.0,
+        base_interval: float = 3.0,
+        max_interval: float = 20.0,
+        calls_per_minute: Optional[float] = None,
+        elevated: float = 0.3,
+        rise: float = 0.15,
+        alpha: float = 0.4,
+        backoff: float = 1.3,
+        change_threshold: float = 0.08,
+        stagger: float = 0.25,
+    ):
+        self.min_interval = min_interval
+        self.base_interval = max(min_interval, base_interval)
+        self.max_interval = max(self.base_interval, max_interval)
+        self.calls_per_minute = calls_per_minute if calls_per_minute and calls_per_minute > 0 else None
+        self.elevated = elevated
+        self.rise = rise
+        self.alpha = alpha
+        self.backoff = backoff
+        self.change_threshold = change_threshold
+        self.stagger = stagger
+        self._cameras: Dict[str, _Camera] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> 'SamplingScheduler':
+        return cls(
+            min_interval=_float_env('SCHEDULE_MIN_SECONDS', 1.0),
+            base_interval=_float_env('SCHEDULE_BASE_SECONDS', 3.0),
+            max_interval=_float_env('SCHEDULE_MAX_SECONDS', 20.0),
+            # Same budget the detector's shared token bucket enforces
+            calls_per_minute=_float_env('MODEL_RPM_LIMIT', None),
+        )
+
+    @property
+    def spacing(self) -> float:
+        """Minimum gap between any two scheduled checks."""
+        if self.calls_per_minute:
+            return max(self.stagger, 60.0 / self.calls_per_minute)
+        return self.stagger
+
+    def _target_interval(self, cam: _Camera, score: Optional[float], changed: bool) -> tuple[float, str]:
+        if score is None:
+            return self.base_interval, 'failed'
+        rising = cam.last_score is not None and score - cam.last_score >= self.rise
+        if rising or score >= self.elevated:
+            cam.calm_checks = 0
+            return self.min_interval, 'rising' if rising else 'elevated'
+        if changed:
+            cam.calm_checks = 0
+            return self.base_interval, 'scene_change'
+        cam.calm_checks += 1
+        calm = min(self.max_interval, self.base_interval * self.backoff ** (cam.calm_checks - 1))
+        # Partially elevated smoothed scores pull the interval back toward the minimum
+        weight = min(1.0, cam.ewma / self.elevated) if self.elevated > 0 else 0.0
+        return calm * (1 - weight) + self.min_interval * weight, 'calm' if weight < 0.5 else 'warm'
+
+    def _apply_budget(self, camera: str, interval: float, urgent: bool) -> float:
+        """Stretch calm cameras so total demand fits ``calls_per_minute``; urgent ones keep priority."""
+        if not self.calls_per_minute:
+            return interval
+        urgent_rate = 0.0
+        calm_rate = 0.0
+        for name, cam in self._cameras.items():
+            current = interval if name == camera else cam.interval
+            if current <= 0:
+                continue
+            if name == camera:
+                is_urgent = urgent
+            else:
+                is_urgent = current <= self.min_interval
+            if is_urgent:
+                urgent_rate += 60.0 / current
+            else:
+                calm_rate += 60.0 / current
+        if urgent_rate + calm_rate <= self.calls_per_minute:
+            return interval
+        if urgent:
+            scale = urgent_rate / self.calls_per_minute if urgent_rate > self.calls_per_minute else 1.0
+        else:
+            remaining = max(self.calls_per_minute - urgent_rate, self.calls_per_minute * 0.1)
+            scale = calm_rate / remaining
+        return interval * max(1.0, scale)
+
+    def _reserve_slot(self, camera: str, desired: float) -> float:
+        others = sorted(c.next_at for name, c in self._cameras.items() if name != camera and c.next_at > 0)
+        slot = desired
+        for other in others:
+            if abs(slot - other) < self.spacing:
+                slot = other + self.spacing
+        return slot
+
+    def observe(self, camera: str, score: Optional[float], image_bytes: Optional[bytes] = None, now: Optional[float] = None) -> float:
+        """Record a check result for ``camera`` and return seconds until its next check.
+
+        ``score`` is None when the model call failed. ``image_bytes`` (the checked
+        frame) enables scene-change detection.
+        """
+        now = time.time() if now is None else now
+        thumb = frame_thumbnail(image_bytes) if image_bytes else None
+        with self._lock:
+            self._expire(now)
+            cam = self._cameras.setdefault(camera, _Camera())
+            changed = False
+            if thumb is not None:
+                if cam.thumb is not None and cam.thumb.shape == thumb.shape:
+                    changed = float(np.abs(thumb - cam.thumb).mean()) / 255.0 >= self.change_threshold
+                cam.thumb = thumb
+            if score is not None:
+                cam.ewma = score if cam.checks == 0 else self.alpha * score + (1 - self.alpha) * cam.ewma
+            interval, reason = self._target_interval(cam, score, changed)
+            if score is not None:
+                cam.last_score = score
+            interval = self._apply_budget(camera, interval, reason in ('rising', 'elevated'))
+            cam.interval = interval
+            cam.next_at = self._reserve_slot(camera, now + interval)
+            cam.last_seen = now
+            cam.checks += 1
+            cam.reasons[reason] = cam.reasons.get(reason, 0) + 1
+            return max(0.0, cam.next_at - now)
+
+    def _expire(self, now: float) -> None:
+        stale = [name for name, cam in self._cameras.items() if now - cam.last_seen > self.max_interval * 4]
+        for name in stale:
+            del self._cameras[name]
+
+    def stats(self) -> dict:
+        now = time.time()
+        with self._lock:
+            cameras = {
+                name: {
+                    'ewma': round(cam.ewma, 4),
+                    'last_score': cam.last_score,
+                    'interval': round(cam.interval, 2),
+                    'next_in': round(max(0.0, cam.next_at - now), 2),
+                    'checks': cam.checks,
+                    'reasons': dict(cam.reasons),
+                }
+                for name, cam in self._cameras.items()
+            }
+        rate = sum(60.0 / c['interval'] for c in cameras.values() if c['interval'] > 0)
+        return {
+            'min_interval': self.min_interval,
+            'base_interval': self.base_interval,
+            'max_interval': self.max_interval,
+            'calls_per_minute': self.calls_per_minute,
+            'scheduled_calls_per_minute': round(rate, 2),
+            'cameras': cameras,
+        }
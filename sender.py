@@ -4,17 +4,23 @@ from __future__ import annotations
 import asyncio
 import base64
 import contextlib
+import json
 import os
+import re
 import signal
 import sys
 import time
-from dataclasses import dataclass
-from typing import Set
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple, Union
+from urllib.parse import parse_qs, urlsplit
 
 import cv2  # type: ignore
 import websockets
 from websockets.server import WebSocketServerProtocol
 
+from clipbuffer import CLIP_FORMATS, FrameRing, write_clip
+from recording import FrameRecorder, ReplayCapture, is_replay_source, open_replay, parse_replay_source
+
 
 # ---------------------------- Config & CLI ----------------------------
 
@@ -29,6 +35,28 @@ DEFAULT_HOST = os.getenv("SENDER_HOST", "localhost")
 DEFAULT_PORT = _int_env("SENDER_PORT", 8765)
 DEFAULT_FPS = _int_env("SENDER_FPS", 10)
 DEFAULT_CAMERA = _int_env("CAMERA_INDEX", 0)
+DEFAULT_QUALITY = _int_env("SENDER_JPEG_QUALITY", 80)
+# Consecutive failed reads before a live stream (RTSP/HTTP) is reopened
+REOPEN_AFTER_FAILURES = 25
+# Backoff between attempts to open a camera that was unreachable at startup
+RETRY_OPEN_MIN_SECONDS = 2.0
+RETRY_OPEN_MAX_SECONDS = 60.0
+# Width of the "analysis" profile; matches the 512px input assess_risk resizes to
+ANALYSIS_WIDTH = _int_env("SENDER_ANALYSIS_WIDTH", 512)
+# Bytes queued in a client's transport before it is treated as congested
+CLIENT_HIGH_WATER = _int_env("SENDER_CLIENT_HIGH_WATER", 256 * 1024)
+# Seconds of healthy sends before an adaptive client is moved up a profile
+UPGRADE_AFTER_SECONDS = 3.0
+DEFAULT_CLIP_DIR = os.getenv("SENDER_CLIP_DIR", "clips")
+DEFAULT_CLIP_FORMAT = os.getenv("SENDER_CLIP_FORMAT", "avi")
+DEFAULT_RING_SECONDS = _int_env("SENDER_RING_SECONDS", 20)
+DEFAULT_RING_MB = _int_env("SENDER_RING_MB", 32)
+DEFAULT_RECORD_DIR = os.getenv("SENDER_RECORD_DIR") or None
+DEFAULT_RECORD_SEGMENT_MB = _int_env("SENDER_RECORD_SEGMENT_MB", 1024)
+MAX_CLIP_POST_SECONDS = 30.0
+CLIP_NAME_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+CameraSource = Union[int, str]
 
 
 def parse_args():
@@ -39,10 +67,79 @@ def parse_args():
 	parser.add_argument("--port", "-p", type=int, default=DEFAULT_PORT, help="WebSocket port (default: 8765)")
 	parser.add_argument("--camera", "-c", type=int, default=DEFAULT_CAMERA, help="Camera index (default: 0)")
 	parser.add_argument("--fps", "-f", type=int, default=DEFAULT_FPS, help="Frames per second (default: 10)")
+	parser.add_argument(
+		"--source",
+		"-s",
+		action="append",
+		default=None,
+		metavar="SPEC",
+		help="Camera source as id=source[,fps=N][,width=W][,height=H][,quality=Q]; repeat for several cameras. "
+		"source is a device index, a video file, an RTSP/HTTP URL or replay:FILE.frec[?speed=S][&loop=0] (overrides --camera)",
+	)
+	parser.add_argument("--sources-file", type=str, default=os.getenv("SENDER_SOURCES_FILE"), help="JSON list of camera sources")
+	parser.add_argument("--clip-dir", type=str, default=DEFAULT_CLIP_DIR, help="Where event clips are written (default: clips)")
+	parser.add_argument("--clip-format", choices=sorted(CLIP_FORMATS), default=DEFAULT_CLIP_FORMAT, help="Clip container (default: avi)")
+	parser.add_argument("--ring-seconds", type=int, default=DEFAULT_RING_SECONDS, help="Seconds of frames kept per camera for clips (0 disables; default: 20)")
+	parser.add_argument("--ring-mb", type=int, default=DEFAULT_RING_MB, help="Frame ring memory per camera in MB (default: 32)")
+	parser.add_argument("--record", type=str, default=DEFAULT_RECORD_DIR, metavar="DIR", help="Record each camera's frame stream to DIR/<id>_<time>.frec")
+	parser.add_argument("--record-segment-mb", type=int, default=DEFAULT_RECORD_SEGMENT_MB, help="Start a new recording file after this many MB (default: 1024)")
 	parser.add_argument("--list-cameras", action="store_true", help="List available cameras and exit")
 	return parser.parse_args()
 
 
+@dataclass
+class CameraConfig:
+	id: str
+	source: CameraSource
+	fps: int = DEFAULT_FPS
+	width: Optional[int] = None
+	height: Optional[int] = None
+	quality: int = DEFAULT_QUALITY
+
+
+def _coerce_source(raw: CameraSource) -> CameraSource:
+	if isinstance(raw, str) and raw.strip().isdigit():
+		return int(raw.strip())
+	return raw
+
+
+_SPEC_OPTIONS = {"fps", "width", "height", "quality"}
+
+
+def parse_source_spec(spec: str, default_fps: int = DEFAULT_FPS) -> CameraConfig:
+	"""Parse ``id=source[,fps=N][,width=W][,height=H][,quality=Q]`` into a CameraConfig."""
+	head, *options = spec.split(",")
+	cam_id, sep, source = head.partition("=")
+	if is_replay_source(head.strip()):
+		# replay:FILE?speed=S has its own '=': the recording's name is the id
+		source, cam_id = head, os.path.splitext(os.path.basename(parse_replay_source(head.strip())[0]))[0]
+	elif not sep:
+		# Bare source: use it as its own id
+		source, cam_id = cam_id, cam_id
+	cam_id, source = cam_id.strip(), source.strip()
+	if not cam_id or not source:
+		raise ValueError(f"Invalid source spec: {spec!r}")
+	config = CameraConfig(id=cam_id, source=_coerce_source(source), fps=default_fps)
+	for option in options:
+		key, _, value = option.partition("=")
+		key = key.strip().lower()
+		if key not in _SPEC_OPTIONS:
+			raise ValueError(f"Unknown option {key!r} in source spec {spec!r}")
+		setattr(config, key, int(value))
+	return config
+
+
+def load_sources_file(path: str, default_fps: int = DEFAULT_FPS) -> List[CameraConfig]:
+	with open(path, "r", encoding="utf-8") as fh:
+		entries = json.load(fh)
+	configs = []
+	for entry in entries:
+		options = {k: int(entry[k]) for k in _SPEC_OPTIONS if entry.get(k) is not None}
+		options.setdefault("fps", default_fps)
+		configs.append(CameraConfig(id=str(entry["id"]), source=_coerce_source(entry["source"]), **options))
+	return configs
+
+
 # ---------------------------- Camera helpers ----------------------------
 
 def list_cameras(max_index: int = 10) -> list[int]:
@@ -58,95 +155,566 @@ def list_cameras(max_index: int = 10) -> list[int]:
 	return available
 
 
-def open_camera(index: int) -> cv2.VideoCapture:
-	cap = cv2.VideoCapture(index, cv2.CAP_DSHOW)
-	if not cap or not cap.isOpened():
-		cap = cv2.VideoCapture(index)
+def is_live_stream(source: CameraSource) -> bool:
+	return isinstance(source, str) and source.lower().startswith(("rtsp://", "rtsps://", "http://", "https://"))
+
+
+def open_camera(source: CameraSource, width: Optional[int] = None, height: Optional[int] = None) -> cv2.VideoCapture:
+	if is_replay_source(source):
+		# Recorded frame stream; it paces and loops itself
+		try:
+			return open_replay(source)
+		except (OSError, ValueError) as e:
+			raise RuntimeError(f"Failed to open camera source {source!r}: {e}") from e
+	if isinstance(source, int):
+		cap = cv2.VideoCapture(source, cv2.CAP_DSHOW)
+		if not cap or not cap.isOpened():
+			cap = cv2.VideoCapture(source)
+	else:
+		# Video files and network streams go through the FFMPEG backend
+		cap = cv2.VideoCapture(source)
 	if not cap or not cap.isOpened():
-		raise RuntimeError(f"Failed to open camera index {index}")
+		raise RuntimeError(f"Failed to open camera source {source!r}")
 	# A few sensible defaults
 	cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
-	cap.set(cv2.CAP_PROP_FPS, 30)
+	if isinstance(source, int):
+		cap.set(cv2.CAP_PROP_FPS, 30)
+		if width:
+			cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+		if height:
+			cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
 	return cap
 
 
-def read_jpeg_base64(cap: cv2.VideoCapture) -> str | None:
+def read_frame(cap: cv2.VideoCapture, source: CameraSource):
 	ok, frame = cap.read()
+	if (not ok or frame is None) and isinstance(source, str) and not is_live_stream(source) and not is_replay_source(source):
+		# Video file reached the end: loop back to the first frame
+		cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+		ok, frame = cap.read()
 	if not ok or frame is None:
 		return None
-	# Encode to JPEG (quality ~80 for size/quality balance)
-	ok, buf = cv2.imencode(".jpg", frame, [int(cv2.IMWRITE_JPEG_QUALITY), 80])
+	return frame
+
+
+def resize_frame(frame, width: Optional[int], height: Optional[int]):
+	if not width and not height:
+		return frame
+	src_h, src_w = frame.shape[:2]
+	if width and not height:
+		height = max(1, round(src_h * width / src_w))
+	elif height and not width:
+		width = max(1, round(src_w * height / src_h))
+	if (src_w, src_h) == (width, height):
+		return frame
+	interpolation = cv2.INTER_AREA if width < src_w else cv2.INTER_LINEAR
+	return cv2.resize(frame, (width, height), interpolation=interpolation)
+
+
+def encode_jpeg(frame, quality: int = DEFAULT_QUALITY) -> bytes | None:
+	ok, buf = cv2.imencode(".jpg", frame, [int(cv2.IMWRITE_JPEG_QUALITY), int(quality)])
 	if not ok:
 		return None
-	b64 = base64.b64encode(buf).decode("ascii")
-	return b64
+	return buf.tobytes()
+
+
+def encode_jpeg_base64(frame, quality: int = DEFAULT_QUALITY) -> str | None:
+	jpeg = encode_jpeg(frame, quality)
+	if jpeg is None:
+		return None
+	return base64.b64encode(jpeg).decode("ascii")
+
+
+@dataclass(frozen=True)
+class EncodingProfile:
+	name: str
+	max_width: Optional[int]
+	quality: int
+
+
+def build_profiles(config: CameraConfig) -> List[EncodingProfile]:
+	"""Profile ladder for a camera, best quality first; adaptive clients move along it."""
+	return [
+		EncodingProfile("full", None, config.quality),
+		EncodingProfile("medium", 960, min(config.quality, 70)),
+		EncodingProfile("analysis", ANALYSIS_WIDTH, min(config.quality, 75)),
+	]
+
+
+def encode_profile(frame, profile: EncodingProfile) -> str | None:
+	if profile.max_width and frame.shape[1] > profile.max_width:
+		frame = resize_frame(frame, profile.max_width, None)
+	return encode_jpeg_base64(frame, profile.quality)
 
 
 # ---------------------------- Sender core ----------------------------
 
 @dataclass
-class SenderState:
+class ClientState:
+	ws: WebSocketServerProtocol
+	level: int = 0
+	pinned: bool = False
+	send_latency: float = 0.0
+	healthy_sends: int = 0
+	dropped: int = 0
+	stalled: bool = False
+	task: Optional[asyncio.Task] = None
+
+	@property
+	def busy(self) -> bool:
+		return self.task is not None and not self.task.done()
+
+
+@dataclass
+class CameraState:
+	config: CameraConfig
 	cap: cv2.VideoCapture
-	fps: int
-	clients: Set[WebSocketServerProtocol]
-	last_ts: float = 0.0
+	profiles: List[EncodingProfile] = field(default_factory=list)
+	clients: Dict[WebSocketServerProtocol, ClientState] = field(default_factory=dict)
+	ring: Optional[FrameRing] = None
+	recorder: Optional[FrameRecorder] = None
 	sent_frames: int = 0
+	encodes: int = 0
+	failed_reads: int = 0
+	reopens: int = 0
+
+	def __post_init__(self):
+		if not self.profiles:
+			self.profiles = build_profiles(self.config)
+
+
+@dataclass
+class ClipSettings:
+	directory: str = DEFAULT_CLIP_DIR
+	fmt: str = DEFAULT_CLIP_FORMAT
+	ring_seconds: int = DEFAULT_RING_SECONDS
+	ring_mb: int = DEFAULT_RING_MB
+
+
+@dataclass
+class SenderState:
+	cameras: Dict[str, CameraState]
+	default_id: str
+	clips: ClipSettings = field(default_factory=ClipSettings)
+	clip_tasks: Set[asyncio.Task] = field(default_factory=set)
+	# Configured cameras that haven't opened yet (retried in the background)
+	offline: Set[str] = field(default_factory=set)
+
+	@property
+	def total_clients(self) -> int:
+		return sum(len(cam.clients) for cam in self.cameras.values())
+
+
+def _request_path(ws: WebSocketServerProtocol) -> str:
+	path = getattr(ws, "path", None)
+	if path is None:
+		# websockets>=14 exposes the handshake request instead of ws.path
+		request = getattr(ws, "request", None)
+		path = getattr(request, "path", None)
+	return path or "/"
+
+
+def route_camera_id(state: SenderState, path: str) -> str | None:
+	route = path.split("?", 1)[0].rstrip("/")
+	if not route:
+		# Plain ws://host:port keeps serving the first configured camera
+		return state.default_id
+	if route.startswith("/cam/"):
+		return route[len("/cam/"):]
+	return None
+
+
+def resolve_camera(state: SenderState, path: str) -> CameraState | None:
+	cam_id = route_camera_id(state, path)
+	return state.cameras.get(cam_id) if cam_id is not None else None
+
+
+def new_client(ws: WebSocketServerProtocol, cam: CameraState, path: str) -> ClientState | None:
+	"""Build client state from ``?profile=<name>|auto``; a named profile pins the client to it."""
+	requested = parse_qs(urlsplit(path).query).get("profile", ["auto"])[0].lower()
+	if requested == "auto":
+		return ClientState(ws=ws)
+	for level, profile in enumerate(cam.profiles):
+		if profile.name == requested:
+			return ClientState(ws=ws, level=level, pinned=True)
+	return None
 
 
 async def client_handler(ws: WebSocketServerProtocol, state: SenderState):
-	# Register client
-	state.clients.add(ws)
 	peer = getattr(ws, "remote_address", None)
-	path = getattr(ws, "path", "/")
-	print(f"[client] connected: {peer} {path} | total={len(state.clients)}")
+	path = _request_path(ws)
+	cam = resolve_camera(state, path)
+	if cam is None and route_camera_id(state, path) in state.offline:
+		print(f"[client] rejected: {peer} {path} (camera offline)")
+		await ws.close(code=4503, reason="camera offline")
+		return
+	if cam is None:
+		print(f"[client] rejected: {peer} {path} (unknown camera)")
+		await ws.close(code=4404, reason="unknown camera")
+		return
+	client = new_client(ws, cam, path)
+	if client is None:
+		print(f"[client] rejected: {peer} {path} (unknown profile)")
+		await ws.close(code=4400, reason="unknown profile")
+		return
+	# Register client
+	cam.clients[ws] = client
+	mode = "pinned" if client.pinned else "auto"
+	profile = cam.profiles[client.level].name
+	print(f"[client] connected: {peer} {path} -> cam={cam.config.id} profile={profile} ({mode}) | total={state.total_clients}")
+	# Tell the client how clips will be named so it can reference one before requesting it
+	clip_format = state.clips.fmt if cam.ring is not None else None
+	await _reply(ws, {"type": "hello", "camera": cam.config.id, "profile": profile, "clip_format": clip_format})
 	try:
-		# Consume incoming messages (if any) to keep connection alive. We don't expect any.
-		async for _ in ws:
-			pass
+		# Only control messages (clip requests) are expected from clients
+		async for message in ws:
+			if isinstance(message, str):
+				await handle_control(ws, cam, state, message)
 	except Exception:
 		# Normal on disconnect
 		pass
 	finally:
 		# Unregister
-		state.clients.discard(ws)
-		print(f"[client] disconnected: {peer} | total={len(state.clients)}")
+		cam.clients.pop(ws, None)
+		print(f"[client] disconnected: {peer} cam={cam.config.id} | total={state.total_clients}")
+
+
+async def _reply(ws: WebSocketServerProtocol, payload: dict) -> None:
+	with contextlib.suppress(Exception):
+		await ws.send(json.dumps(payload))
+
+
+async def handle_control(ws: WebSocketServerProtocol, cam: CameraState, state: SenderState, message: str) -> None:
+	"""Handle ``{"type": "clip", "name", "pre", "post", "ago"}`` sent by a client.
 
+	``ago`` is how many milliseconds before now the triggering frame was received by the
+	client, so the clip is centred on that frame rather than on the request.
+	Frames go out as bare base64 strings, so JSON replies (starting with ``{``) stay distinguishable.
+	"""
+	try:
+		request = json.loads(message)
+	except ValueError:
+		return
+	if not isinstance(request, dict) or request.get("type") != "clip":
+		return
+	name = str(request.get("name", ""))
+	if not CLIP_NAME_RE.match(name):
+		await _reply(ws, {"type": "clip", "name": name, "status": "failed", "error": "invalid name"})
+		return
+	if cam.ring is None:
+		await _reply(ws, {"type": "clip", "name": name, "status": "failed", "error": "clips disabled"})
+		return
+	try:
+		pre = min(max(0.0, float(request.get("pre", 5))), float(state.clips.ring_seconds))
+		post = min(max(0.0, float(request.get("post", 5))), MAX_CLIP_POST_SECONDS)
+		ago = max(0.0, float(request.get("ago", 0)) / 1000.0)
+	except (TypeError, ValueError):
+		await _reply(ws, {"type": "clip", "name": name, "status": "failed", "error": "invalid window"})
+		return
+	event_ts = time.time() - ago
+	filename = f"{name}.{state.clips.fmt}"
+	await _reply(ws, {"type": "clip", "name": name, "file": filename, "status": "recording"})
+	task = asyncio.create_task(capture_clip(ws, cam, state.clips, name, filename, event_ts, pre, post))
+	state.clip_tasks.add(task)
+	task.add_done_callback(state.clip_tasks.discard)
+
+
+async def capture_clip(
+	ws: WebSocketServerProtocol,
+	cam: CameraState,
+	clips: ClipSettings,
+	name: str,
+	filename: str,
+	event_ts: float,
+	pre: float,
+	post: float,
+):
+	# Let the post-event window fill before snapshotting the ring
+	await asyncio.sleep(max(0.0, event_ts + post - time.time()))
+	frames = cam.ring.snapshot(event_ts - pre, event_ts + post)
+	path = os.path.join(clips.directory, filename)
+	try:
+		await asyncio.to_thread(write_clip, frames, path, clips.fmt)
+	except (RuntimeError, ValueError) as e:
+		print(f"[clip] cam={cam.config.id} {filename} failed: {e}")
+		await _reply(ws, {"type": "clip", "name": name, "file": filename, "status": "failed", "error": str(e)})
+		return
+	print(f"[clip] cam={cam.config.id} saved {path} ({len(frames)} frames)")
+	await _reply(ws, {"type": "clip", "name": name, "file": filename, "status": "saved", "frames": len(frames)})
+
+
+async def _reopen(cam: CameraState) -> None:
+	config = cam.config
+	print(f"[loop] cam={config.id} reopening source after {cam.failed_reads} failed reads")
+	with contextlib.suppress(Exception):
+		cam.cap.release()
+	try:
+		cam.cap = await asyncio.to_thread(open_camera, config.source, config.width, config.height)
+		cam.reopens += 1
+	except RuntimeError as e:
+		print(f"[loop] cam={config.id} reopen failed: {e}")
+	cam.failed_reads = 0
 
-async def capture_loop(state: SenderState, stop_event: asyncio.Event):
+
+async def capture_loop(cam: CameraState, stop_event: asyncio.Event):
+	config = cam.config
 	# Target interval based on FPS (avoid div by zero)
-	interval = 1.0 / max(1, state.fps)
-	print(f"[loop] starting capture loop @ {state.fps} FPS (interval ~{interval:.3f}s)")
+	interval = 1.0 / max(1, config.fps)
+	# A replay with speed > 0 sleeps to its recorded timestamps; pacing again would cap it at fps
+	self_paced = isinstance(cam.cap, ReplayCapture) and cam.cap.speed > 0
+	if self_paced:
+		recorded_fps = cam.cap.recording.info()["fps"]
+		if recorded_fps:
+			interval = 1.0 / (recorded_fps * cam.cap.speed)
+		print(f"[loop] cam={config.id} starting replay loop @ recorded timing x{cam.cap.speed:g} (interval ~{interval:.3f}s)")
+	else:
+		print(f"[loop] cam={config.id} starting capture loop @ {config.fps} FPS (interval ~{interval:.3f}s)")
 	while not stop_event.is_set():
 		start = time.perf_counter()
-		b64 = read_jpeg_base64(state.cap)
-		if b64 is not None and state.clients:
-			# Broadcast concurrently; slow clients won't block capture
-			await asyncio.gather(
-				*[safe_send(c, b64) for c in list(state.clients)], return_exceptions=True
-			)
-			state.sent_frames += 1
+		# Blocking OpenCV reads run in a worker thread so cameras don't stall each other
+		frame = await asyncio.to_thread(read_frame, cam.cap, config.source)
+		if frame is None:
+			cam.failed_reads += 1
+			if is_live_stream(config.source) and cam.failed_reads >= REOPEN_AFTER_FAILURES:
+				await _reopen(cam)
+		else:
+			cam.failed_reads = 0
+			now = time.time()
+			# Recordings keep every frame; the clip ring only while a client could ask for a clip
+			keep = cam.recorder is not None or (cam.ring is not None and bool(cam.clients))
+			targets = select_targets(cam)
+			if keep or targets:
+				# Resizing and JPEG encoding hold the GIL for milliseconds: keep them off the loop
+				full_jpeg, encoded, encodes = await asyncio.to_thread(
+					encode_frame, cam, frame, [cam.profiles[client.level] for client in targets], keep
+				)
+				cam.encodes += encodes
+				if full_jpeg is not None and cam.ring is not None:
+					cam.ring.append(now, full_jpeg)
+				if targets and broadcast(cam, targets, encoded, interval):
+					cam.sent_frames += 1
+				if cam.recorder is not None and full_jpeg is not None:
+					await record_frame(cam, now, full_jpeg)
 		# Sleep to maintain FPS
 		elapsed = time.perf_counter() - start
-		to_sleep = max(0.0, interval - elapsed)
+		to_sleep = 0.0 if self_paced else max(0.0, interval - elapsed)
 		try:
 			await asyncio.wait_for(stop_event.wait(), timeout=to_sleep)
 		except asyncio.TimeoutError:
 			pass
-	print("[loop] stopping capture loop")
-
-
-async def safe_send(ws: WebSocketServerProtocol, data: str):
+	print(f"[loop] cam={config.id} stopping capture loop")
+
+
+def select_targets(cam: CameraState) -> List[ClientState]:
+	"""Clients that get the next frame; a client whose previous frame is still in flight skips it."""
+	targets = []
+	for client in list(cam.clients.values()):
+		if client.busy:
+			client.dropped += 1
+			if not client.stalled:
+				# Step down once per stalled send, not once per skipped frame
+				client.stalled = True
+				adapt_profile(cam, client, congested=True)
+			continue
+		targets.append(client)
+	return targets
+
+
+def encode_frame(
+	cam: CameraState, frame, profiles: List[EncodingProfile], keep: bool
+) -> Tuple[bytes | None, Dict[str, Optional[str]], int]:
+	"""Resize ``frame`` and encode it once per profile in use (runs in a worker thread).
+
+	With ``keep`` the full-quality JPEG is returned as well, for the ring and recorder;
+	the ``full`` profile reuses it. Returns (full JPEG, base64 per profile, encodes).
+	"""
+	config = cam.config
+	frame = resize_frame(frame, config.width, config.height)
+	full_jpeg = encode_jpeg(frame, config.quality) if keep else None
+	encodes = 1 if keep else 0
+	encoded: Dict[str, Optional[str]] = {}
+	if full_jpeg is not None:
+		encoded[cam.profiles[0].name] = base64.b64encode(full_jpeg).decode("ascii")
+	for profile in profiles:
+		if profile.name not in encoded:
+			encoded[profile.name] = encode_profile(frame, profile)
+			encodes += 1
+	return full_jpeg, encoded, encodes
+
+
+def broadcast(cam: CameraState, targets: List[ClientState], encoded: Dict[str, Optional[str]], interval: float) -> bool:
+	"""Queue the encoded frame for each of ``targets`` at its profile.
+
+	Sends run as independent tasks so a slow client never delays capture or the others.
+	"""
+	queued = False
+	for client in targets:
+		if client.ws not in cam.clients:
+			# Disconnected while the frame was being encoded
+			continue
+		data = encoded.get(cam.profiles[client.level].name)
+		if data is None:
+			continue
+		client.task = asyncio.create_task(send_to_client(cam, client, data, interval))
+		queued = True
+	return queued
+
+
+async def send_to_client(cam: CameraState, client: ClientState, data: str, interval: float):
+	start = time.perf_counter()
 	try:
-		await ws.send(data)
+		await client.ws.send(data)
 	except Exception:
 		# Let the client_handler cleanup on disconnect
-		pass
+		return
+	elapsed = time.perf_counter() - start
+	client.stalled = False
+	client.send_latency = elapsed if not client.send_latency else 0.8 * client.send_latency + 0.2 * elapsed
+	transport = getattr(client.ws, "transport", None)
+	queued_bytes = transport.get_write_buffer_size() if transport is not None else 0
+	congested = client.send_latency > 0.8 * interval or queued_bytes > CLIENT_HIGH_WATER
+	adapt_profile(cam, client, congested=congested, interval=interval)
+
+
+def adapt_profile(cam: CameraState, client: ClientState, *, congested: bool, interval: float = 0.0) -> None:
+	if client.pinned:
+		return
+	if congested:
+		client.healthy_sends = 0
+		if client.level < len(cam.profiles) - 1:
+			client.level += 1
+			print(f"[adapt] cam={cam.config.id} {client.ws.remote_address} -> {cam.profiles[client.level].name} (congested)")
+		return
+	if client.send_latency > 0.25 * interval:
+		client.healthy_sends = 0
+		return
+	client.healthy_sends += 1
+	if client.level > 0 and client.healthy_sends * interval >= UPGRADE_AFTER_SECONDS:
+		client.healthy_sends = 0
+		client.level -= 1
+		print(f"[adapt] cam={cam.config.id} {client.ws.remote_address} -> {cam.profiles[client.level].name} (recovered)")
+
+
+def open_recorder(directory: str, config: CameraConfig, segment_mb: int = DEFAULT_RECORD_SEGMENT_MB) -> FrameRecorder:
+	stem = f"{config.id}_{time.strftime('%Y%m%d-%H%M%S')}"
+	path = os.path.join(directory, f"{stem}.frec")
+	n = 1
+	while os.path.exists(path):
+		path = os.path.join(directory, f"{stem}-{n}.frec")
+		n += 1
+	meta = {"camera": config.id, "source": str(config.source), "fps": config.fps, "quality": config.quality}
+	return FrameRecorder(path, meta, max_bytes=segment_mb * 1024 * 1024 if segment_mb > 0 else None)
+
+
+async def record_frame(cam: CameraState, ts: float, jpeg: bytes) -> None:
+	"""Append a frame to the camera's recording, starting a new segment once it is full.
+
+	File writes (and the index written on close) run in a worker thread.
+	"""
+	recorder = cam.recorder
+	try:
+		await asyncio.to_thread(recorder.write, ts, jpeg)
+		if recorder.full:
+			segment_mb = recorder.max_bytes // (1024 * 1024) if recorder.max_bytes else 0
+			cam.recorder = await asyncio.to_thread(open_recorder, str(recorder.path.parent), cam.config, segment_mb)
+			await asyncio.to_thread(recorder.close)
+			print(f"[rec] cam={cam.config.id} {len(recorder)} frames -> {recorder.path}; continuing in {cam.recorder.path}")
+	except OSError as e:
+		print(f"[rec] cam={cam.config.id} recording stopped: {e}")
+		cam.recorder = None
+		try:
+			await asyncio.to_thread(recorder.close)
+		except OSError:
+			pass
 
 
-async def run_server(host: str, port: int, camera: int, fps: int):
-	# Prepare camera
-	cap = open_camera(camera)
-	state = SenderState(cap=cap, fps=fps, clients=set())
+def build_camera(
+	config: CameraConfig,
+	cap: cv2.VideoCapture,
+	clips: ClipSettings,
+	record_dir: str | None,
+	record_segment_mb: int,
+) -> CameraState:
+	ring = None
+	if clips.ring_seconds > 0 and clips.ring_mb > 0:
+		ring = FrameRing(clips.ring_mb * 1024 * 1024, max(1, clips.ring_seconds * config.fps))
+	cam = CameraState(config=config, cap=cap, ring=ring)
+	if record_dir:
+		cam.recorder = open_recorder(record_dir, config, record_segment_mb)
+	return cam
+
+
+async def retry_camera(
+	state: SenderState,
+	config: CameraConfig,
+	stop_event: asyncio.Event,
+	record_dir: str | None,
+	record_segment_mb: int,
+):
+	"""Keep trying to open a camera that was unreachable at startup, backing off
+	between attempts; once it opens, register it and run its capture loop."""
+	delay = RETRY_OPEN_MIN_SECONDS
+	attempts = 0
+	while not stop_event.is_set():
+		try:
+			await asyncio.wait_for(stop_event.wait(), timeout=delay)
+			return
+		except asyncio.TimeoutError:
+			pass
+		attempts += 1
+		try:
+			cap = await asyncio.to_thread(open_camera, config.source, config.width, config.height)
+			cam = build_camera(config, cap, state.clips, record_dir, record_segment_mb)
+		except (RuntimeError, OSError) as e:
+			delay = min(RETRY_OPEN_MAX_SECONDS, delay * 2)
+			print(f"[cam] {config.id}: retry {attempts} failed: {e}; next in {delay:g}s")
+			continue
+		state.cameras[config.id] = cam
+		state.offline.discard(config.id)
+		print(f"[cam] {config.id}: opened after {attempts} retries; /cam/{config.id} is live")
+		await capture_loop(cam, stop_event)
+		return
+
+
+async def run_server(
+	host: str,
+	port: int,
+	configs: List[CameraConfig],
+	clips: ClipSettings | None = None,
+	record_dir: str | None = None,
+	record_segment_mb: int = DEFAULT_RECORD_SEGMENT_MB,
+):
+	clips = clips or ClipSettings()
+	# Prepare cameras
+	cameras: Dict[str, CameraState] = {}
+	pending: List[CameraConfig] = []
+	seen: Set[str] = set()
+	try:
+		for config in configs:
+			if config.id in seen:
+				raise RuntimeError(f"Duplicate camera id {config.id!r}")
+			seen.add(config.id)
+			try:
+				cap = open_camera(config.source, config.width, config.height)
+			except RuntimeError as e:
+				# One unreachable camera shouldn't keep the others offline; it is retried in the background
+				print(f"[cam] {config.id}: {e}; retrying in the background")
+				pending.append(config)
+				continue
+			try:
+				cameras[config.id] = build_camera(config, cap, clips, record_dir, record_segment_mb)
+			except OSError:
+				cap.release()
+				raise
+	except (RuntimeError, OSError):
+		for cam in cameras.values():
+			cam.cap.release()
+			if cam.recorder is not None:
+				cam.recorder.close()
+		raise
+	if not cameras:
+		raise RuntimeError("No camera source could be opened")
+	state = SenderState(cameras=cameras, default_id=next(iter(cameras)), clips=clips, offline={c.id for c in pending})
 	stop_event = asyncio.Event()
 
 	# Graceful shutdown via signals
@@ -164,40 +732,82 @@ async def run_server(host: str, port: int, camera: int, fps: int):
 
 	# websockets>=11 expects a single-argument handler; path is available via ws.path
 	async with websockets.serve(lambda ws: client_handler(ws, state), host, port, max_size=None):
-		print(f"[ws] listening on ws://{host}:{port} | camera={camera} fps={fps}")
-		# Launch capture loop
-		loop_task = asyncio.create_task(capture_loop(state, stop_event))
+		print(f"[ws] listening on ws://{host}:{port} | cameras={len(cameras)} default={state.default_id}")
+		for cam in cameras.values():
+			c = cam.config
+			print(f"[ws]   /cam/{c.id} <- {c.source!r} fps={c.fps} size={c.width or 'native'}x{c.height or 'native'} q={c.quality}")
+		for c in pending:
+			print(f"[ws]   /cam/{c.id} <- {c.source!r} (offline, retrying)")
+		# Launch one capture loop per camera, and a retry loop per camera that didn't open
+		tasks = [asyncio.create_task(capture_loop(cam, stop_event)) for cam in cameras.values()]
+		tasks += [asyncio.create_task(retry_camera(state, c, stop_event, record_dir, record_segment_mb)) for c in pending]
 		# Periodic stats
-		stats_task = asyncio.create_task(stats_logger(state, stop_event))
+		tasks.append(asyncio.create_task(stats_logger(state, stop_event)))
 
 		# Wait for stop_event
 		await stop_event.wait()
 		# Cancel tasks
-		loop_task.cancel()
-		stats_task.cancel()
-		with contextlib.suppress(asyncio.CancelledError):
-			await loop_task
-			await stats_task
-
-	# Cleanup camera
-	cap.release()
-	print("[ws] server stopped; camera released")
+		for task in tasks:
+			task.cancel()
+		for task in tasks:
+			with contextlib.suppress(asyncio.CancelledError):
+				await task
+		for cam in cameras.values():
+			for client in cam.clients.values():
+				if client.task is not None:
+					client.task.cancel()
+
+	# Cleanup cameras
+	for cam in cameras.values():
+		cam.cap.release()
+		if cam.recorder is not None:
+			cam.recorder.close()
+			print(f"[rec] cam={cam.config.id} {len(cam.recorder)} frames -> {cam.recorder.path}")
+	print("[ws] server stopped; cameras released")
 
 
 async def stats_logger(state: SenderState, stop_event: asyncio.Event):
-	last_frames = 0
+	last_frames = {cam_id: 0 for cam_id in state.cameras}
 	last_time = time.time()
 	while not stop_event.is_set():
 		await asyncio.sleep(5.0)
 		now = time.time()
-		delta_f = state.sent_frames - last_frames
 		delta_t = max(1e-6, now - last_time)
-		eff_fps = delta_f / delta_t
-		print(f"[stats] clients={len(state.clients)} sent_total={state.sent_frames} eff_fps={eff_fps:.2f}")
-		last_frames = state.sent_frames
+		for cam_id, cam in state.cameras.items():
+			# Cameras that opened late start from zero
+			delta_f = cam.sent_frames - last_frames.get(cam_id, 0)
+			eff_fps = delta_f / delta_t
+			per_profile: Dict[str, int] = {}
+			for client in cam.clients.values():
+				name = cam.profiles[client.level].name
+				per_profile[name] = per_profile.get(name, 0) + 1
+			profiles = ",".join(f"{name}:{count}" for name, count in per_profile.items()) or "-"
+			dropped = sum(client.dropped for client in cam.clients.values())
+			ring = ""
+			if cam.ring is not None:
+				ring_stats = cam.ring.stats()
+				ring = f" ring={ring_stats['frames']}f/{ring_stats['bytes'] / 1e6:.1f}MB/{ring_stats['span_seconds']:.1f}s"
+			if cam.recorder is not None:
+				ring += f" rec={len(cam.recorder)}f/{cam.recorder.bytes_written / 1e6:.1f}MB"
+			print(
+				f"[stats] cam={cam_id} clients={len(cam.clients)} sent_total={cam.sent_frames} "
+				f"eff_fps={eff_fps:.2f} encodes={cam.encodes} profiles={profiles} dropped={dropped} "
+				f"failed_reads={cam.failed_reads} reopens={cam.reopens}{ring}"
+			)
+			last_frames[cam_id] = cam.sent_frames
 		last_time = now
 
 
+def build_configs(args) -> List[CameraConfig]:
+	fps = max(1, int(args.fps))
+	if args.source:
+		return [parse_source_spec(spec, fps) for spec in args.source]
+	if args.sources_file:
+		return load_sources_file(args.sources_file, fps)
+	camera = int(args.camera)
+	return [CameraConfig(id=str(camera), source=camera, fps=fps)]
+
+
 def main():
 	args = parse_args()
 
@@ -214,13 +824,26 @@ def main():
 	# CLI overrides env/defaults
 	host: str = args.host
 	port: int = int(args.port)
-	camera: int = int(args.camera)
-	fps: int = max(1, int(args.fps))
+	try:
+		configs = build_configs(args)
+	except (OSError, ValueError, KeyError) as e:
+		print(f"Error: invalid camera sources: {e}")
+		return 2
+	if not configs:
+		print("Error: no camera sources configured")
+		return 2
+
+	clips = ClipSettings(
+		directory=args.clip_dir,
+		fmt=args.clip_format,
+		ring_seconds=max(0, int(args.ring_seconds)),
+		ring_mb=max(0, int(args.ring_mb)),
+	)
 
 	try:
-		asyncio.run(run_server(host, port, camera, fps))
+		asyncio.run(run_server(host, port, configs, clips, args.record, args.record_segment_mb))
 		return 0
-	except RuntimeError as e:
+	except (RuntimeError, OSError) as e:
 		print(f"Error: {e}")
 		return 2
 	except KeyboardInterrupt:
@@ -229,4 +852,3 @@ def main():
 
 if __name__ == "__main__":
 	sys.exit(main())
-
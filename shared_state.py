@@ -0,0 +1,232 @@
+from __future__ import annotations
+
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS breakers ('
+    ' name TEXT PRIMARY KEY, state TEXT NOT NULL, failures INTEGER NOT NULL, opened_at REAL NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, expires REAL NOT NULL)',
+)
+
+
+class SharedState:
+    """Cross-process state for several app workers on one host, backed by SQLite (WAL).
+
+    Covers a TTL cache, token-bucket budgets, circuit breakers and cooldown leases.
+    Read-modify-write operations run in a single statement or a ``BEGIN IMMEDIATE``
+    transaction, so they are atomic across processes. Each thread keeps its own
+    connection.
+    """
+
+    def __init__(self, path: str):
+        self.path = str(path)
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        conn = self._conn()
+        for statement in SCHEMA:
+            conn.execute(statement)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Autocommit; multi-statement updates open their own IMMEDIATE transaction
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    # ---------------------------- Cache ----------------------------
+
+    def cache_get(self, key: str) -> Optional[Any]:
+        row = self._conn().execute(
+            'SELECT value FROM cache WHERE key = ? AND expires > ?', (key, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def cache_set(self, key: str, value: Any, ttl: float) -> None:
+        conn = self._conn()
+        now = time.time()
+        conn.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?)', (key, json.dumps(value), now + ttl))
+        if random.random() < 1 / 256:
+            conn.execute('DELETE FROM cache WHERE expires <= ?', (now,))
+
+    # ---------------------------- Budgets ----------------------------
+
+    def acquire(self, name: str, rate_per_minute: float, burst: Optional[float] = None) -> float:
+        """Take one token from bucket ``name``; 0.0 on success, else seconds until one is free.
+
+        The bucket refills at ``rate_per_minute`` up to ``burst`` (default: one minute's worth).
+        """
+        capacity = burst if burst is not None else rate_per_minute
+        per_second = rate_per_minute / 60.0
+        conn = self._conn()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT tokens, updated FROM buckets WHERE name = ?', (name,)).fetchone()
+            tokens = capacity if row is None else min(capacity, row[0] + (now - row[1]) * per_second)
+            if tokens >= 1.0:
+                tokens -= 1.0
+                wait = 0.0
+            else:
+                wait = (1.0 - tokens) / per_second if per_second > 0 else float('inf')
+            conn.execute('INSERT OR REPLACE INTO buckets VALUES (?, ?, ?)', (name, tokens, now))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return wait
+
+    # ---------------------------- Circuit breakers ----------------------------
+
+    def breaker_allow(self, name: str, cooldown: float) -> bool:
+        """Whether a call may go ahead. An open breaker lets a single probe through
+        (half-open) once ``cooldown`` has passed; other callers wait for its result."""
+        conn = self._conn()
+        row = conn.execute('SELECT state, opened_at FROM breakers WHERE name = ?', (name,)).fetchone()
+        if row is None or row[0] == 'closed':
+            return True
+        now = time.time()
+        if now - row[1] < cooldown:
+            return False
+        # Claim the probe: only one caller moves the breaker to half-open (and restarts
+        # the clock, so a probe that never reports back is retried after another cooldown)
+        cur = conn.execute(
+            "UPDATE breakers SET state = 'half_open', opened_at = ? WHERE name = ? AND opened_at = ?",
+            (now, name, row[1]),
+        )
+        return cur.rowcount == 1
+
+    def breaker_record(self, name: str, success: bool, threshold: int) -> str:
+        """Record a call outcome; returns the resulting state."""
+        conn = self._conn()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT state, failures, opened_at FROM breakers WHERE name = ?', (name,)
+            ).fetchone()
+            state, failures, opened_at = row if row else ('closed', 0, 0.0)
+            if success:
+                state, failures = 'closed', 0
+            else:
+                failures += 1
+                if state == 'half_open' or failures >= threshold:
+                    if state != 'open':
+                        opened_at = now
+                    state = 'open'
+            conn.execute('INSERT OR REPLACE INTO breakers VALUES (?, ?, ?, ?)', (name, state, failures, opened_at))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return state
+
+    def breaker_state(self, name: str) -> dict:
+        row = self._conn().execute(
+            'SELECT state, failures, opened_at FROM breakers WHERE name = ?', (name,)
+        ).fetchone()
+        if row is None:
+            return {'state': 'closed', 'failures': 0, 'opened_at': None}
+        return {'state': row[0], 'failures': row[1], 'opened_at': row[2] or None}
+
+    # ---------------------------- Cooldown leases ----------------------------
+
+    def claim(self, key: str, ttl: float) -> bool:
+        """Atomically take ``key`` for ``ttl`` seconds; False while someone else holds it."""
+        now = time.time()
+        cur = self._conn().execute(
+            'INSERT INTO leases VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET expires = excluded.expires'
+            ' WHERE leases.expires <= ?',
+            (key, now + ttl, now),
+        )
+        return cur.rowcount == 1
+
+    def release(self, key: str) -> None:
+        self._conn().execute('DELETE FROM leases WHERE key = ?', (key,))
+
+
+_STATE: Optional[SharedState] = None
+_STATE_LOCK = threading.Lock()
+
+
+def get_shared_state() -> SharedState:
+    """Process-wide instance at ``SHARED_STATE_DB`` (every worker points at the same file)."""
+    global _STATE
+    if _STATE is None:
+        with _STATE_LOCK:
+            if _STATE is None:
+                _STATE = SharedState(os.getenv('SHARED_STATE_DB', str(Path('state') / 'shared_state.sqlite3')))
+    return _STATE
+
+
+def _bench_ops(path: str, ops: int) -> dict:
+    state = SharedState(path)
+    state.cache_set('bench:hit', {'score': 0.1, 'indicators': []}, 3600)
+    cases = {
+        'cache_get': lambda i: state.cache_get('bench:hit'),
+        'cache_set': lambda i: state.cache_set(f'bench:{i % 512}', {'score': 0.1}, 60),
+        'acquire': lambda i: state.acquire('bench', 1e9),
+        'breaker_allow': lambda i: state.breaker_allow('bench', 30),
+        'claim': lambda i: state.claim(f'bench:{i % 64}', 0.0),
+    }
+    results = {}
+    for name, fn in cases.items():
+        started = time.perf_counter()
+        for i in range(ops):
+            fn(i)
+        results[name] = round((time.perf_counter() - started) / ops * 1e6, 1)
+    return results
+
+
+def _contention_worker(path: str, attempts: int, burst: float, out) -> None:
+    state = SharedState(path)
+    # A negligible refill rate: the workers can only share out the initial burst
+    out.put(sum(1 for _ in range(attempts) if state.acquire('contention', 1e-6, burst=burst) == 0.0))
+
+
+if __name__ == '__main__':
+    import argparse
+    import multiprocessing
+    import tempfile
+
+    parser = argparse.ArgumentParser(description='Benchmark shared-state operations')
+    parser.add_argument('--ops', type=int, default=5000, help='Operations per case')
+    parser.add_argument('--workers', type=int, default=4, help='Processes in the contention check')
+    parser.add_argument('--db', help='Database file (default: a temporary file)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.db or os.path.join(tmp, 'bench.sqlite3')
+        for name, us in _bench_ops(path, args.ops).items():
+            print(f'{name:<14} {us:>8.1f} us/op')
+
+        # Every worker races for the same bucket; together they must get exactly its burst
+        limit = 200
+        queue = multiprocessing.Queue()
+        procs = [
+            multiprocessing.Process(target=_contention_worker, args=(path, limit, limit, queue))
+            for _ in range(args.workers)
+        ]
+        started = time.perf_counter()
+        for proc in procs:
+            proc.start()
+        granted = sum(queue.get() for _ in procs)
+        for proc in procs:
+            proc.join()
+        elapsed = time.perf_counter() - started
+        attempts = limit * args.workers
+        print(
+            f'contention     {args.workers} workers, {attempts} acquires in {elapsed:.2f}s: '
+            f'granted {granted}/{limit} ({"ok" if granted == limit else "MISMATCH"})'
+        )
@@ -10,10 +10,17 @@ const lastCheckEl = document.getElementById('lastCheck');
 let running = false;
 let ws = null;
 let frameCount = 0;
-let intervalHandle = null;
+let checkTimer = null;
 let lastRawFrame = null;
+let lastFrameAt = 0;
 let lastAnalyzedFrame = null;
 let isAnalyzing = false;
+const cameraId = new URLSearchParams(window.location.search).get('cam');
+const CLIP_PRE_SECONDS = 8;
+const CLIP_POST_SECONDS = 5;
+const DEFAULT_CHECK_MS = 3000;
+const RETRY_CHECK_MS = 1000;
+let clipFormat = null;
 const INTERNAL_PROMPT = "Analyze this image for signs of self-harm, suicide attempt, or suicidal ideation. Look for dangerous objects like knives, ropes, pills, self-inflicted injuries, distressed facial expressions indicating suicidal thoughts, or suicide notes/messages.";
 
 function updateStatus(message, type = 'info') {
@@ -55,7 +62,7 @@ async function connectWebSocket() {
   try {
     updateAutoStatus('🔌 Connecting to camera stream...');
     updateStatus('Connecting to WebSocket...');
-    const url = 'ws://localhost:8765';
+    const url = cameraId ? `ws://localhost:8765/cam/${encodeURIComponent(cameraId)}` : 'ws://localhost:8765';
     ws = new WebSocket(url);
     
     ws.onopen = () => {
@@ -64,7 +71,12 @@ async function connectWebSocket() {
     };
     
     ws.onmessage = (ev) => {
+      if (ev.data.charAt(0) === '{') {
+        handleControlMessage(ev.data);
+        return;
+      }
       lastRawFrame = ev.data;
+      lastFrameAt = Date.now();
       if (imgEl) {
         imgEl.src = 'data:image/jpeg;base64,' + lastRawFrame;
       }
@@ -88,54 +100,115 @@ async function connectWebSocket() {
   }
 }
 
+function handleControlMessage(raw) {
+  let msg;
+  try {
+    msg = JSON.parse(raw);
+  } catch (e) {
+    return;
+  }
+  if (msg.type === 'hello') {
+    clipFormat = msg.clip_format || null;
+  } else if (msg.type === 'clip' && msg.status === 'saved') {
+    console.log('Event clip saved:', msg.file);
+  } else if (msg.type === 'clip' && msg.status === 'failed') {
+    console.warn('Event clip failed:', msg.error);
+  }
+}
+
+function requestClip(clipFile, frameAt) {
+  if (!ws || ws.readyState !== WebSocket.OPEN) return;
+  ws.send(JSON.stringify({
+    type: 'clip',
+    name: clipFile.replace(/\.[^.]+$/, ''),
+    ago: Math.max(0, Date.now() - frameAt),
+    pre: CLIP_PRE_SECONDS,
+    post: CLIP_POST_SECONDS
+  }));
+}
+
 function captureFrameDataURL() {
   if (!lastRawFrame) return null;
   return lastRawFrame.startsWith('data:') ? lastRawFrame : 'data:image/jpeg;base64,' + lastRawFrame;
 }
 
+// The server picks each camera's next check time (next_check_ms) from its recent
+// scores, scene changes and the global model budget.
+function scheduleNextCheck(ms) {
+  if (!running) return;
+  clearTimeout(checkTimer);
+  checkTimer = setTimeout(captureAndAnalyze, Math.max(250, ms));
+}
+
 async function captureAndAnalyze() {
   if (!running || isAnalyzing) return;
   
   const dataUrl = captureFrameDataURL();
   if (!dataUrl) {
     updateStatus('No frame available');
+    scheduleNextCheck(RETRY_CHECK_MS);
     return;
   }
   
   if (dataUrl === lastAnalyzedFrame) {
     updateStatus('Frame unchanged, skipping analysis');
+    scheduleNextCheck(RETRY_CHECK_MS);
     return;
   }
+  let nextCheckMs = DEFAULT_CHECK_MS;
   isAnalyzing = true;
   lastAnalyzedFrame = dataUrl;
+  const frameAt = lastFrameAt;
   frameCount++;
   updateFrameCount();
   updateStatus('Analyzing frame...');
   
+  // Named up front so the gallery entry saved with the analysis can link to it
+  const clipFile = clipFormat ? `clip_${Date.now()}_${Math.random().toString(36).slice(2, 8)}.${clipFormat}` : null;
+  const metadata = { source: 'monitoring' };
+  if (clipFile) {
+    metadata.clip = clipFile;
+  }
+  
   try {
-    const res = await fetch('/api/risk_frame', {
+    // One call scores the frame, saves it to the gallery if flagged and annotates it
+    const res = await fetch('/api/analyze_frame', {
       method: 'POST',
       headers: { 'Content-Type': 'application/json' },
       body: JSON.stringify({ 
         image: dataUrl,
-        prompt: INTERNAL_PROMPT 
+        prompt: INTERNAL_PROMPT,
+        threshold: Number(thresholdInput.value || 0.5),
+        save_to_gallery: true,
+        annotate: true,
+        camera: cameraId || 'default',
+        metadata: metadata
       })
     });
     
     const json = await res.json();
+    if (json && json.next_check_ms != null) {
+      nextCheckMs = Number(json.next_check_ms);
+    }
     
-    if (json && !json.error) {
+    if (json && json.skipped) {
+      updateLastCheck();
+      updateStatus('✅ No person detected (local pre-screen)');
+    } else if (json && json.failed) {
+      updateStatus('❌ Analysis failed (model reply unusable)');
+    } else if (json && !json.error) {
       const score = Number(json.score || 0);
-      const indicators = json.indicators || [];
-      const threshold = Number(thresholdInput.value || 0.5);
       
       updateLastCheck();
       
-      if (score >= threshold || (indicators && indicators.length > 0)) {
+      if (json.flagged) {
         beep();
         updateAutoStatus(`🚨 RISK DETECTED - Score: ${score.toFixed(3)}`, true);
         updateStatus('⚠️ Risk detected!');
-        await saveRiskFrame(dataUrl, json);
+        if (clipFile) {
+          requestClip(clipFile, frameAt);
+        }
+        console.log('Risk frame saved to gallery:', json.original);
         const videoWrapper = imgEl.closest('.video-wrapper');
         if (videoWrapper) {
           videoWrapper.classList.add('risk-detected');
@@ -156,6 +229,7 @@ async function captureAndAnalyze() {
     updateStatus('❌ Network error');
   } finally {
     isAnalyzing = false;
+    scheduleNextCheck(nextCheckMs);
   }
 }
 
@@ -217,8 +291,7 @@ async function startContinuousDetection() {
     
     updateStatus('Starting monitoring...');
     updateFrameCount();
-    setTimeout(captureAndAnalyze, 1000);
-    intervalHandle = setInterval(captureAndAnalyze, 3000);
+    scheduleNextCheck(RETRY_CHECK_MS);
     
   } catch (e) {
     updateStatus('Failed to start');
@@ -232,8 +305,8 @@ function stopDetection() {
   if (!running) return;
   
   running = false;
-  clearInterval(intervalHandle);
-  intervalHandle = null;
+  clearTimeout(checkTimer);
+  checkTimer = null;
   
   startBtn.disabled = false;
   stopBtn.disabled = true;
@@ -253,39 +326,6 @@ function stopDetection() {
 startBtn.addEventListener('click', startContinuousDetection);
 stopBtn.addEventListener('click', stopDetection);
 
-async function saveRiskFrame(imageDataUrl, analysisResult) {
-  try {
-    const metadata = {
-      timestamp: analysisResult.timestamp || new Date().toISOString(),
-      score: analysisResult.score || 0,
-      indicators: analysisResult.indicators || [],
-      source: 'monitoring'
-    };
-    
-    const response = await fetch('/api/capture_and_save', {
-      method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ 
-        image: imageDataUrl,
-        run_detection: false,
-        save_to_gallery: true,
-        metadata: metadata
-      })
-    });
-    
-    const result = await response.json();
-    if (result.error) {
-      console.warn('Failed to save risk frame:', result.error);
-      return;
-    }
-    
-    console.log('Risk frame saved to gallery:', result.original);
-    
-  } catch (e) {
-    console.warn('Error saving risk frame:', e);
-  }
-}
-
 window.addEventListener('load', () => {
   updateStatus('Initializing...');
   startBtn.disabled = false;
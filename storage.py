@@ -0,0 +1,579 @@
+from __future__ import annotations
+
+import errno
+import hashlib
+import itertools
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, Iterable, List, Optional, Tuple
+
+IMAGE_SUFFIXES = {'.jpg', '.jpeg', '.png'}
+CLIP_SUFFIXES = {'.avi', '.mp4'}
+SIDECAR_SUFFIX = '.json'
+DETECTIONS_SUFFIX = '.detections.json'
+COPY_CHUNK = 1024 * 1024
+# os.link errors that mean hard links can't be used here, so a copy is made instead
+NO_HARDLINK_ERRNOS = {errno.EXDEV, errno.EPERM, errno.ENOTSUP, errno.EOPNOTSUPP, errno.EMLINK}
+
+
+def _float_env(name: str) -> Optional[float]:
+    raw = os.getenv(name)
+    if raw is None or raw.strip() == '':
+        return None
+    try:
+        return float(raw)
+    except ValueError:
+        return None
+
+
+# ---------------------------- Content-addressed blobs ----------------------------
+
+class BlobStore:
+    """Content-addressed image store.
+
+    Every distinct image is written once under ``<root>/<aa>/<bb>/<sha256><ext>``; the
+    folders the app serves from (uploads, gallery, ...) hold hard links to those blobs.
+    A blob's link count is its refcount: once only the store's own link remains it is
+    garbage and ``collect_garbage`` removes it. Use ``store`` rather than ``put_bytes``
+    followed by ``link``: it holds the store lock across both, so a collection running
+    in between can't remove the blob before it is linked.
+    """
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def path_for(self, digest: str, suffix: str) -> Path:
+        return self.root / digest[:2] / digest[2:4] / (digest + suffix.lower())
+
+    def put_bytes(self, data: bytes, suffix: str) -> Path:
+        blob = self.path_for(hashlib.sha256(data).hexdigest(), suffix)
+        if not blob.exists():
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            tmp = blob.with_name(f'.{blob.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+            tmp.write_bytes(data)
+            os.replace(tmp, blob)
+        return blob
+
+    def _spool(self, fh: BinaryIO) -> Tuple[Path, str]:
+        """Copy ``fh`` to a temporary file in the store, hashing it on the way."""
+        digest = hashlib.sha256()
+        tmp = self.root / f'.incoming.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp, 'wb') as out:
+            for chunk in iter(lambda: fh.read(COPY_CHUNK), b''):
+                digest.update(chunk)
+                out.write(chunk)
+        return tmp, digest.hexdigest()
+
+    def link(self, blob: Path, dest: Path) -> Path:
+        """Point ``dest`` at ``blob``, replacing whatever ``dest`` was (e.g. a reserved placeholder).
+
+        The link is made under a temporary name and renamed onto ``dest``, so ``dest``
+        never goes missing in between and can't be claimed by someone else meanwhile.
+        """
+        dest = Path(dest)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        if dest.exists() and dest.samefile(blob):
+            return dest
+        tmp = dest.with_name(f'.{dest.name}.{os.getpid()}.{threading.get_ident()}.link')
+        tmp.unlink(missing_ok=True)
+        try:
+            if os.stat(blob).st_nlink == 1:
+                # Links share the blob's inode. Refresh its mtime only while no other
+                # link exists, so age-based retention of existing aliases is untouched
+                os.utime(blob)
+            os.link(blob, tmp)
+        except OSError as e:
+            if e.errno not in NO_HARDLINK_ERRNOS:
+                raise
+            # Filesystems without hard links (or a store on another device) fall back to a copy
+            shutil.copyfile(blob, tmp)
+        try:
+            os.replace(tmp, dest)
+        except OSError:
+            tmp.unlink(missing_ok=True)
+            raise
+        return dest
+
+    def store(self, data: bytes, dest: Path) -> Path:
+        """Write ``data`` to ``dest`` through the store so identical images share one inode."""
+        suffix = Path(dest).suffix
+        with self._lock:
+            try:
+                return self.link(self.put_bytes(data, suffix), dest)
+            except FileNotFoundError:
+                # Collected by another process between put and link: write it again
+                return self.link(self.put_bytes(data, suffix), dest)
+
+    def store_file(self, fh: BinaryIO, dest: Path) -> Path:
+        """Like ``store`` for a file object, copied in chunks rather than read into memory."""
+        suffix = Path(dest).suffix
+        tmp, digest = self._spool(fh)
+        try:
+            with self._lock:
+                for attempt in range(2):
+                    blob = self.path_for(digest, suffix)
+                    if not blob.exists():
+                        blob.parent.mkdir(parents=True, exist_ok=True)
+                        # The temp file is kept until the link below succeeds, so a
+                        # blob collected in between can be put back from it
+                        try:
+                            os.link(tmp, blob)
+                        except FileExistsError:
+                            pass
+                        except OSError as e:
+                            if e.errno not in NO_HARDLINK_ERRNOS:
+                                raise
+                            shutil.copyfile(tmp, blob)
+                    try:
+                        return self.link(blob, dest)
+                    except FileNotFoundError:
+                        if attempt:
+                            raise
+        finally:
+            tmp.unlink(missing_ok=True)
+
+    def collect_garbage(self) -> Tuple[int, int]:
+        removed = 0
+        reclaimed = 0
+        for blob in itertools.chain(self.root.glob('*/*/*'), self.root.glob('.*.tmp')):
+            try:
+                st = blob.stat()
+                if blob.name.startswith('.') and blob.name.endswith('.tmp'):
+                    # Leftover from an interrupted write
+                    if time.time() - st.st_mtime < 3600:
+                        continue
+                elif st.st_nlink > 1:
+                    continue
+                with self._lock:
+                    # Re-check under the lock: ``store`` may have linked it since
+                    if blob.stat().st_nlink > 1:
+                        continue
+                    blob.unlink()
+                removed += 1
+                reclaimed += st.st_size
+            except FileNotFoundError:
+                continue
+        return removed, reclaimed
+
+
+# ---------------------------- Gallery index ----------------------------
+
+class GalleryIndex:
+    """SQLite index of gallery entries so listing doesn't stat and parse every sidecar."""
+
+    def __init__(self, path: str):
+        self.path = str(path)
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS gallery ('
+                ' name TEXT PRIMARY KEY, timestamp TEXT, score REAL, indicators TEXT,'
+                ' source TEXT, clip TEXT, mtime REAL, size INTEGER)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS gallery_mtime ON gallery (mtime)')
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def upsert(self, name: str, metadata: dict, mtime: float, size: int) -> None:
+        with self._conn() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO gallery VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (
+                    name,
+                    metadata.get('timestamp'),
+                    float(metadata.get('score', 0) or 0),
+                    json.dumps(metadata.get('indicators', []) or []),
+                    metadata.get('source'),
+                    metadata.get('clip'),
+                    mtime,
+                    size,
+                ),
+            )
+
+    def remove(self, names: Iterable[str]) -> None:
+        with self._conn() as conn:
+            conn.executemany('DELETE FROM gallery WHERE name = ?', [(n,) for n in names])
+
+    def is_empty(self) -> bool:
+        return self._conn().execute('SELECT 1 FROM gallery LIMIT 1').fetchone() is None
+
+    def names(self) -> set:
+        return {row[0] for row in self._conn().execute('SELECT name FROM gallery')}
+
+    def entries(self, limit: Optional[int] = None, offset: int = 0) -> List[dict]:
+        rows = self._conn().execute(
+            'SELECT name, timestamp, score, indicators, source, clip, mtime, size FROM gallery'
+            ' ORDER BY mtime DESC LIMIT ? OFFSET ?',
+            (-1 if limit is None else limit, offset),
+        )
+        return [
+            {
+                'filename': name,
+                'timestamp': timestamp or 'Unknown',
+                'score': score or 0,
+                'indicators': json.loads(indicators or '[]'),
+                'source': source,
+                'clip': clip,
+                'mtime': mtime,
+                'size': size,
+            }
+            for name, timestamp, score, indicators, source, clip, mtime, size in rows
+        ]
+
+    def between(
+        self,
+        start: float,
+        end: float,
+        after: Optional[Tuple[float, str]] = None,
+        min_score: float = 0.0,
+        limit: Optional[int] = None,
+    ) -> List[Tuple[str, float]]:
+        """``(name, mtime)`` with ``start <= mtime < end`` in stable (mtime, name) order,
+        optionally resuming after an ``(mtime, name)`` cursor."""
+        sql = 'SELECT name, mtime FROM gallery WHERE mtime >= ? AND mtime < ? AND score >= ?'
+        params: list = [start, end, min_score]
+        if after is not None:
+            sql += ' AND (mtime > ? OR (mtime = ? AND name > ?))'
+            params += [after[0], after[0], after[1]]
+        sql += ' ORDER BY mtime, name LIMIT ?'
+        params.append(-1 if limit is None else limit)
+        return [(name, mtime) for name, mtime in self._conn().execute(sql, params)]
+
+    def add_file(self, image_path: Path) -> None:
+        metadata = read_sidecar(image_path)
+        st = image_path.stat()
+        self.upsert(image_path.name, metadata, st.st_mtime, st.st_size)
+
+    def reconcile(self, folder: str) -> Tuple[int, int]:
+        """Bring the index in line with the folder; returns (added, removed)."""
+        on_disk = {p.name: p for p in Path(folder).iterdir() if p.suffix.lower() in IMAGE_SUFFIXES}
+        indexed = self.names()
+        stale = indexed - on_disk.keys()
+        missing = on_disk.keys() - indexed
+        if stale:
+            self.remove(stale)
+        for name in missing:
+            try:
+                self.add_file(on_disk[name])
+            except FileNotFoundError:
+                continue
+        return len(missing), len(stale)
+
+
+def read_sidecar(image_path: Path) -> dict:
+    sidecar = Path(image_path).with_suffix(SIDECAR_SUFFIX)
+    if not sidecar.exists():
+        return {}
+    try:
+        with open(sidecar, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+# ---------------------------- Detections ----------------------------
+
+def detections_path(image_path: Path) -> Path:
+    image_path = Path(image_path)
+    return image_path.with_name(image_path.stem + DETECTIONS_SUFFIX)
+
+
+def write_detections(image_path: Path, boxes: List[dict], size: Tuple[int, int], **extra) -> Path:
+    """Store boxes for ``image_path`` as compact JSON next to it (pixel ``xyxy``, rounded)."""
+    record = {
+        'size': list(size),
+        'boxes': [
+            {'box_2d': [int(round(v)) for v in box['box_2d']], 'label': box.get('label', '')}
+            for box in boxes
+        ],
+        **extra,
+    }
+    path = detections_path(image_path)
+    tmp = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+    tmp.write_text(json.dumps(record, separators=(',', ':')))
+    os.replace(tmp, path)
+    return path
+
+
+def read_detections(image_path: Path) -> Optional[dict]:
+    """Stored detections for an image, falling back to ``boxes`` in its gallery sidecar."""
+    path = detections_path(image_path)
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError):
+        return None
+    metadata = read_sidecar(image_path)
+    if 'boxes' in metadata:
+        return {'boxes': metadata.get('boxes') or []}
+    return None
+
+
+class RenderCache:
+    """Directory of derived images rendered on first request, kept under ``max_bytes``.
+
+    Hits refresh the file's mtime, so eviction drops the least recently used first.
+    """
+
+    def __init__(self, folder: str, max_bytes: int):
+        self.folder = Path(folder)
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._rendering: Dict[str, threading.Lock] = {}
+        self._total = sum(p.stat().st_size for p in self.folder.iterdir() if p.is_file())
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, name: str) -> Optional[Path]:
+        """Path of cached ``name`` (marking it recently used), or None."""
+        path = self.folder / name
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        self.hits += 1
+        return path
+
+    def get(self, name: str, render: Callable[[Path], None]) -> Path:
+        """Path of cached ``name``, calling ``render(tmp_path)`` to create it on a miss."""
+        cached = self.lookup(name)
+        if cached is not None:
+            return cached
+        path = self.folder / name
+        with self._lock:
+            name_lock = self._rendering.setdefault(name, threading.Lock())
+        with name_lock:
+            # Another request may have rendered it while we waited
+            if not path.exists():
+                self.misses += 1
+                tmp = path.with_name(f'.{path.stem}.{os.getpid()}.{threading.get_ident()}.tmp{path.suffix}')
+                try:
+                    render(tmp)
+                    os.replace(tmp, path)
+                finally:
+                    if tmp.exists():
+                        tmp.unlink()
+                with self._lock:
+                    self._total += path.stat().st_size
+        with self._lock:
+            self._rendering.pop(name, None)
+            if self._total > self.max_bytes:
+                self._evict(keep=path)
+        return path
+
+    def _evict(self, keep: Path) -> None:
+        files = []
+        for p in self.folder.iterdir():
+            if p.is_file() and not p.name.startswith('.'):
+                try:
+                    st = p.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((st.st_mtime, st.st_size, p))
+        # Rescan rather than trust the running total: other workers share the folder
+        self._total = sum(size for _, size, _ in files)
+        for _, size, p in sorted(files):
+            if self._total <= self.max_bytes:
+                break
+            if p == keep:
+                continue
+            try:
+                p.unlink()
+            except FileNotFoundError:
+                pass
+            self._total -= size
+
+    def discard(self, name: str) -> bool:
+        """Remove cached ``name``; returns whether it was there."""
+        path = self.folder / name
+        try:
+            size = path.stat().st_size
+            path.unlink()
+        except FileNotFoundError:
+            return False
+        with self._lock:
+            self._total -= size
+        return True
+
+    def stats(self) -> dict:
+        return {'bytes': self._total, 'max_bytes': self.max_bytes, 'hits': self.hits, 'misses': self.misses}
+
+
+# ---------------------------- Retention ----------------------------
+
+@dataclass
+class RetentionPolicy:
+    max_age_days: Optional[float] = None
+    max_bytes: Optional[int] = None
+    max_files: Optional[int] = None
+
+    @classmethod
+    def from_env(cls, folder: str) -> 'RetentionPolicy':
+        prefix = f'RETENTION_{folder.upper()}_'
+        max_mb = _float_env(prefix + 'MAX_MB')
+        max_files = _float_env(prefix + 'MAX_FILES')
+        return cls(
+            max_age_days=_float_env(prefix + 'MAX_AGE_DAYS'),
+            max_bytes=int(max_mb * 1024 * 1024) if max_mb is not None else None,
+            max_files=int(max_files) if max_files is not None else None,
+        )
+
+    @property
+    def unlimited(self) -> bool:
+        return self.max_age_days is None and self.max_bytes is None and self.max_files is None
+
+
+@dataclass
+class _Entry:
+    primary: Path
+    files: List[Path]
+    mtime: float
+    size: int
+
+
+def _entries(folder: Path, suffixes: set) -> List[_Entry]:
+    entries = []
+    for path in folder.iterdir():
+        if path.suffix.lower() not in suffixes:
+            continue
+        files = [path]
+        for sidecar in (path.with_suffix(SIDECAR_SUFFIX), detections_path(path)):
+            if sidecar.exists():
+                files.append(sidecar)
+        try:
+            st = path.stat()
+            # An image may be a blob link shared with older entries; its sidecars are
+            # its own, so the newest file dates the entry
+            mtime = max(f.stat().st_mtime for f in files)
+        except FileNotFoundError:
+            continue
+        entries.append(_Entry(primary=path, files=files, mtime=mtime, size=st.st_size))
+    entries.sort(key=lambda e: e.mtime)
+    return entries
+
+
+def _unlink(path: Path) -> int:
+    """Remove ``path``; returns bytes freed right away (0 while a blob link keeps it alive)."""
+    try:
+        st = path.stat()
+        path.unlink()
+    except FileNotFoundError:
+        return 0
+    return st.st_size if st.st_nlink <= 1 else 0
+
+
+def sweep_folder(folder: str, policy: RetentionPolicy, suffixes: set = IMAGE_SUFFIXES) -> dict:
+    """Delete the oldest entries in ``folder`` until it is within ``policy``."""
+    path = Path(folder)
+    report = {'removed': [], 'freed_bytes': 0, 'kept': 0, 'kept_bytes': 0}
+    if not path.is_dir():
+        return report
+    entries = _entries(path, suffixes)
+    total_bytes = sum(e.size for e in entries)
+    count = len(entries)
+    cutoff = time.time() - policy.max_age_days * 86400 if policy.max_age_days is not None else None
+    for entry in entries:
+        expired = cutoff is not None and entry.mtime < cutoff
+        over_count = policy.max_files is not None and count > policy.max_files
+        over_size = policy.max_bytes is not None and total_bytes > policy.max_bytes
+        if not (expired or over_count or over_size):
+            # Entries are oldest first: nothing newer can be expired either
+            break
+        for file in entry.files:
+            report['freed_bytes'] += _unlink(file)
+        report['removed'].append(entry.primary.name)
+        total_bytes -= entry.size
+        count -= 1
+    report['kept'] = count
+    report['kept_bytes'] = total_bytes
+    return report
+
+
+class RetentionSweeper:
+    """Background thread that applies per-folder retention, collects orphaned blobs
+    and keeps the gallery index in sync with the gallery folder."""
+
+    def __init__(
+        self,
+        folders: Dict[str, Tuple[str, RetentionPolicy, set]],
+        blobs: BlobStore,
+        gallery_index: Optional[GalleryIndex] = None,
+        gallery_folder: Optional[str] = None,
+        interval: float = 600.0,
+    ):
+        self.folders = folders
+        self.blobs = blobs
+        self.gallery_index = gallery_index
+        self.gallery_folder = gallery_folder
+        self.interval = interval
+        self.last_report: Optional[dict] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def run_once(self) -> dict:
+        with self._lock:
+            started = time.time()
+            report = {'started_at': started, 'folders': {}}
+            freed = 0
+            for name, (folder, policy, suffixes) in self.folders.items():
+                if policy.unlimited:
+                    continue
+                result = sweep_folder(folder, policy, suffixes)
+                freed += result['freed_bytes']
+                report['folders'][name] = {
+                    'removed': len(result['removed']),
+                    'kept': result['kept'],
+                    'kept_bytes': result['kept_bytes'],
+                }
+                if name == 'gallery' and self.gallery_index is not None and result['removed']:
+                    self.gallery_index.remove(result['removed'])
+            blobs_removed, blob_bytes = self.blobs.collect_garbage()
+            report['blobs_removed'] = blobs_removed
+            report['reclaimed_bytes'] = freed + blob_bytes
+            if self.gallery_index is not None and self.gallery_folder:
+                added, stale = self.gallery_index.reconcile(self.gallery_folder)
+                report['index'] = {'added': added, 'removed': stale}
+            report['duration_ms'] = round((time.time() - started) * 1000, 1)
+            self.last_report = report
+        print(
+            f"[retention] reclaimed {report['reclaimed_bytes'] / 1e6:.2f}MB "
+            f"(blobs={blobs_removed}) in {report['duration_ms']}ms"
+        )
+        return report
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:  # noqa: BLE001
+                print(f'[retention] sweep failed: {e}')
+            self._stop.wait(self.interval)
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='retention-sweeper', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
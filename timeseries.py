@@ -0,0 +1,626 @@
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import struct
+import threading
+import time
+from array import array
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+BLOCK_MAGIC = b'RSK1'
+# magic, row count, ts min, ts max, dictionary JSON length
+BLOCK_HEADER = struct.Struct('<4sIddI')
+# Column dtypes in on-disk order; every block stores its columns back to back
+COLUMNS = (
+    ('ts', 'd', '<f8'),
+    ('score', 'f', '<f4'),
+    ('latency_ms', 'f', '<f4'),
+    ('camera', 'H', '<u2'),
+    ('indicators', 'Q', '<u8'),
+    ('flags', 'B', 'u1'),
+)
+ROW_BYTES = sum(np.dtype(dtype).itemsize for _, _, dtype in COLUMNS)
+
+FLAG_SKIPPED = 1
+FLAG_FAILED = 2
+FLAG_CACHED = 4
+FLAG_FLAGGED = 8
+
+# A minute's rollup is written once it is this far in the past; rows recorded just
+# before a flush can carry a timestamp slightly older than the flush itself
+ROLLUP_GRACE_SECONDS = 5.0
+
+MAX_INDICATORS = 63
+OTHER_INDICATOR = 1 << 63  # indicators beyond the first 63 distinct names share this bit
+# Camera names come from clients; names beyond this many are recorded as ``other``
+MAX_CAMERAS = 4096
+OTHER_CAMERA = 'other'
+
+# Each flush appends one small block. Once a segment has this many blocks since its last
+# compaction they are merged, and a day's segment is merged whole when the day rolls over
+COMPACT_BLOCKS = 256
+MAX_BLOCK_ROWS = 1 << 20
+
+
+def _day(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).strftime('%Y-%m-%d')
+
+
+def _scan(f, size: int, offset: int = 0) -> Iterator[tuple]:
+    """``(offset, rows, ts_min, ts_max, meta_len, end_offset)`` for each complete block."""
+    while offset + BLOCK_HEADER.size <= size:
+        f.seek(offset)
+        magic, rows, ts_min, ts_max, meta_len = BLOCK_HEADER.unpack(f.read(BLOCK_HEADER.size))
+        end_offset = offset + BLOCK_HEADER.size + meta_len + rows * ROW_BYTES
+        if magic != BLOCK_MAGIC or end_offset > size:
+            break  # torn write at the tail
+        yield offset, rows, ts_min, ts_max, meta_len, end_offset
+        offset = end_offset
+
+
+def _read_columns(f, rows: int) -> Dict[str, np.ndarray]:
+    data = f.read(rows * ROW_BYTES)
+    columns = {}
+    pos = 0
+    for name, _, dtype in COLUMNS:
+        columns[name] = np.frombuffer(data, dtype=dtype, count=rows, offset=pos)
+        pos += np.dtype(dtype).itemsize * rows
+    return columns
+
+
+def _encode_block(columns: Dict[str, np.ndarray], dictionary: dict) -> bytes:
+    meta = json.dumps(dictionary, separators=(',', ':')).encode('utf-8')
+    ts = columns['ts']
+    header = BLOCK_HEADER.pack(BLOCK_MAGIC, len(ts), float(ts.min()), float(ts.max()), len(meta))
+    return b''.join([header, meta] + [columns[name].astype(dtype, copy=False).tobytes() for name, _, dtype in COLUMNS])
+
+
+def _extends(longer: dict, shorter: dict) -> bool:
+    """Whether ``shorter``'s ids mean the same in ``longer`` (dictionaries only grow)."""
+    return all(longer[key][:len(shorter[key])] == shorter[key] for key in ('cameras', 'indicators'))
+
+
+def compact_segment(path: Path, start: int = 0) -> int:
+    """Merge the blocks of a segment from byte ``start`` on into as few blocks as possible.
+
+    Consecutive blocks are merged while one dictionary covers them all (a process's
+    dictionaries only grow), up to ``MAX_BLOCK_ROWS`` rows. The file is rewritten next to
+    the original and renamed over it, so a reader holding it open keeps a consistent
+    view. The caller must be the segment's only writer. Returns the number of blocks
+    that were merged away.
+    """
+    path = Path(path)
+    tmp = path.with_name(path.name + '.tmp')
+    merged = 0
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        blocks = list(_scan(f, size, start))
+        if len(blocks) < 2:
+            return 0
+        f.seek(0)
+        prefix = f.read(start)
+        with open(tmp, 'wb') as out:
+            out.write(prefix)
+            group: List[Dict[str, np.ndarray]] = []
+            group_dict: Optional[dict] = None
+            group_rows = 0
+            for offset, rows, _, _, meta_len, _ in blocks:
+                f.seek(offset + BLOCK_HEADER.size)
+                dictionary = json.loads(f.read(meta_len))
+                columns = _read_columns(f, rows)
+                if group and (group_rows + rows > MAX_BLOCK_ROWS or not (
+                        _extends(dictionary, group_dict) or _extends(group_dict, dictionary))):
+                    out.write(_encode_block({k: np.concatenate([c[k] for c in group]) for k in group[0]}, group_dict))
+                    merged += len(group) - 1
+                    group, group_rows = [], 0
+                if not group or len(dictionary['cameras']) + len(dictionary['indicators']) > \
+                        len(group_dict['cameras']) + len(group_dict['indicators']):
+                    group_dict = dictionary
+                group.append(columns)
+                group_rows += rows
+            out.write(_encode_block({k: np.concatenate([c[k] for c in group]) for k in group[0]}, group_dict))
+            merged += len(group) - 1
+    os.replace(tmp, path)
+    return merged
+
+
+def _days_between(start: float, end: float) -> List[str]:
+    day = datetime.fromtimestamp(start, timezone.utc).date()
+    last = datetime.fromtimestamp(end, timezone.utc).date()
+    days = []
+    while day <= last:
+        days.append(day.isoformat())
+        day += timedelta(days=1)
+    return days
+
+
+class RiskHistory:
+    """Append-only store of every risk result, in array-backed columnar segments.
+
+    ``record`` only appends to in-memory typed arrays under a lock. A background thread
+    flushes them every ``flush_interval`` seconds as one block appended to
+    ``<folder>/<day>/<pid>.seg``, so each file has a single writer even with several
+    worker processes. Each block carries its own header (row count, time range) and the
+    camera/indicator dictionaries that its integer columns refer to. Per-minute rollups
+    (count, sum, max, flagged per camera) are accumulated in memory and appended to
+    ``<pid>.rollup`` once the minute has closed, so each camera-minute is one line.
+    """
+
+    def __init__(self, folder: str, flush_interval: float = 2.0, retention_days: Optional[float] = None):
+        self.folder = Path(folder)
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.flush_interval = flush_interval
+        self.retention_days = retention_days
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._buffer = self._new_buffer()
+        self._cameras: Dict[str, int] = {}
+        self._indicators: Dict[str, int] = {}
+        # (minute start, camera) -> [count, sum, max, flagged] for minutes not yet written
+        self._open_rollups: Dict[tuple, list] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last_prune = 0.0
+        # This process's segments: blocks appended since the last compaction, and where
+        # that compaction ended
+        self._segment_blocks: Dict[Path, int] = {}
+        self._compacted_to: Dict[Path, int] = {}
+        self.rows_written = 0
+        self.flushes = 0
+        self.compactions = 0
+
+    @staticmethod
+    def _new_buffer() -> Dict[str, array]:
+        return {name: array(code) for name, code, _ in COLUMNS}
+
+    # ---------------------------- Writing ----------------------------
+
+    def _camera_id(self, camera: str) -> int:
+        camera_id = self._cameras.get(camera)
+        if camera_id is None:
+            if len(self._cameras) >= MAX_CAMERAS - 1 and camera != OTHER_CAMERA:
+                camera = OTHER_CAMERA
+                camera_id = self._cameras.get(camera)
+            if camera_id is None:
+                camera_id = self._cameras[camera] = len(self._cameras)
+        return camera_id
+
+    def _indicator_mask(self, indicators: Iterable[str]) -> int:
+        mask = 0
+        for indicator in indicators:
+            key = str(indicator).strip().lower()
+            if not key:
+                continue
+            bit = self._indicators.get(key)
+            if bit is None:
+                if len(self._indicators) >= MAX_INDICATORS:
+                    mask |= OTHER_INDICATOR
+                    continue
+                bit = self._indicators[key] = len(self._indicators)
+            mask |= 1 << bit
+        return mask
+
+    def record(
+        self,
+        camera: str,
+        score: float,
+        indicators: Sequence[str] = (),
+        latency_ms: float = 0.0,
+        flags: int = 0,
+        ts: Optional[float] = None,
+    ) -> None:
+        ts = float(time.time() if ts is None else ts)
+        score = float(score or 0.0)
+        latency_ms = float(latency_ms or 0.0)
+        flags = int(flags) & 0xFF
+        with self._lock:
+            # Every value is worked out before the first append, so a bad row can't
+            # leave the columns with different lengths
+            camera_id = self._camera_id(str(camera))
+            mask = self._indicator_mask(indicators or ())
+            buf = self._buffer
+            buf['ts'].append(ts)
+            buf['score'].append(score)
+            buf['latency_ms'].append(latency_ms)
+            buf['camera'].append(camera_id)
+            buf['indicators'].append(mask)
+            buf['flags'].append(flags)
+
+    def flush(self, final: bool = False) -> int:
+        """Write buffered rows and closed rollup minutes (all open minutes with ``final``);
+        returns the number of rows written."""
+        with self._flush_lock:
+            with self._lock:
+                buf = self._buffer
+                if buf['ts']:
+                    self._buffer = self._new_buffer()
+                    dictionary = {
+                        'cameras': sorted(self._cameras, key=self._cameras.get),
+                        'indicators': sorted(self._indicators, key=self._indicators.get),
+                    }
+            if not buf['ts']:
+                self._write_rollups(final)
+                return 0
+            columns = {name: np.frombuffer(buf[name], dtype=dtype) for name, _, dtype in COLUMNS}
+            first_day = _day(float(columns['ts'].min()))
+            if first_day == _day(float(columns['ts'].max())):
+                self._write_block(first_day, columns, dictionary)
+            else:
+                # A flush spanning midnight is split so each day directory is self-contained
+                for day in _days_between(float(columns['ts'].min()), float(columns['ts'].max())):
+                    start = datetime.fromisoformat(day).replace(tzinfo=timezone.utc).timestamp()
+                    mask = (columns['ts'] >= start) & (columns['ts'] < start + 86400)
+                    if mask.any():
+                        self._write_block(day, {k: v[mask] for k, v in columns.items()}, dictionary)
+            self._add_rollups(columns, dictionary['cameras'])
+            # Close minutes against the data's own clock, so backfilled rows roll up the same way
+            self._write_rollups(final, now=float(columns['ts'].max()))
+            rows = len(columns['ts'])
+            self.rows_written += rows
+            self.flushes += 1
+        return rows
+
+    def _write_block(self, day: str, columns: Dict[str, np.ndarray], dictionary: dict) -> None:
+        folder = self.folder / day
+        folder.mkdir(parents=True, exist_ok=True)
+        path = folder / f'{os.getpid()}.seg'
+        if path not in self._segment_blocks:
+            # A new day: the earlier days' segments are complete, merge them whole
+            for done in list(self._segment_blocks):
+                self._compact(done, 0)
+                del self._segment_blocks[done]
+                self._compacted_to.pop(done, None)
+            self._segment_blocks[path] = 0
+        with open(path, 'ab') as f:
+            f.write(_encode_block(columns, dictionary))
+        self._segment_blocks[path] += 1
+        if self._segment_blocks[path] >= COMPACT_BLOCKS:
+            self._compact(path, self._compacted_to.get(path, 0))
+            self._segment_blocks[path] = 0
+            self._compacted_to[path] = path.stat().st_size
+
+    def _compact(self, path: Path, start: int) -> None:
+        try:
+            if compact_segment(path, start):
+                self.compactions += 1
+        except (OSError, ValueError) as e:
+            print(f'[history] compacting {path} failed: {e}')
+
+    def compact_old(self) -> int:
+        """Merge the blocks of segments from before yesterday (any process) that were
+        never compacted, e.g. left by a worker that has exited."""
+        cutoff = _day(time.time() - 86400)
+        compacted = 0
+        for folder in self.folder.iterdir():
+            if not (folder.is_dir() and len(folder.name) == 10 and folder.name < cutoff):
+                continue
+            for seg in folder.glob('*.seg'):
+                with open(seg, 'rb') as f:
+                    blocks = sum(1 for _ in _scan(f, os.fstat(f.fileno()).st_size))
+                if blocks >= COMPACT_BLOCKS:
+                    self._compact(seg, 0)
+                    compacted += 1
+        return compacted
+
+    def _add_rollups(self, columns: Dict[str, np.ndarray], cameras: List[str]) -> None:
+        minutes = (columns['ts'] // 60).astype(np.int64)
+        keys = minutes * 65536 + columns['camera'].astype(np.int64)
+        unique, inverse = np.unique(keys, return_inverse=True)
+        scores = columns['score'].astype(np.float64)
+        counts = np.bincount(inverse)
+        sums = np.bincount(inverse, weights=scores)
+        maxes = np.full(len(unique), -np.inf)
+        np.maximum.at(maxes, inverse, scores)
+        flagged = np.bincount(inverse, weights=(columns['flags'] & FLAG_FLAGGED) > 0)
+        with self._lock:
+            for key, count, total, peak, hits in zip(unique, counts, sums, maxes, flagged):
+                rollup_key = (int(key // 65536) * 60, cameras[int(key % 65536)])
+                agg = self._open_rollups.get(rollup_key)
+                if agg is None:
+                    self._open_rollups[rollup_key] = [int(count), float(total), float(peak), int(hits)]
+                else:
+                    agg[0] += int(count)
+                    agg[1] += float(total)
+                    agg[2] = max(agg[2], float(peak))
+                    agg[3] += int(hits)
+
+    def _write_rollups(self, final: bool = False, now: Optional[float] = None) -> None:
+        """Append closed minutes (every open minute with ``final``) to the day's rollup file."""
+        cutoff = (time.time() if now is None else now) - 60 - ROLLUP_GRACE_SECONDS
+        with self._lock:
+            closed = [key for key in self._open_rollups if final or key[0] <= cutoff]
+            items = [(key, self._open_rollups.pop(key)) for key in sorted(closed)]
+        by_day: Dict[str, List[str]] = {}
+        for (minute, cam), (count, total, peak, hits) in items:
+            by_day.setdefault(_day(minute), []).append(
+                json.dumps([minute, cam, count, round(total, 6), round(peak, 6), hits])
+            )
+        for day, lines in by_day.items():
+            folder = self.folder / day
+            folder.mkdir(parents=True, exist_ok=True)
+            with open(folder / f'{os.getpid()}.rollup', 'a') as f:
+                f.write('\n'.join(lines) + '\n')
+
+    def prune(self) -> List[str]:
+        """Delete day directories older than ``retention_days``."""
+        if not self.retention_days:
+            return []
+        cutoff = _day(time.time() - self.retention_days * 86400)
+        removed = []
+        for path in self.folder.iterdir():
+            if path.is_dir() and len(path.name) == 10 and path.name < cutoff:
+                shutil.rmtree(path, ignore_errors=True)
+                removed.append(path.name)
+        return removed
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+                if time.time() - self._last_prune > 3600:
+                    self._last_prune = time.time()
+                    self.prune()
+                    with self._flush_lock:
+                        self.compact_old()
+            except Exception as e:  # noqa: BLE001
+                print(f'[history] flush failed: {e}')
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='risk-history', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the flush thread and write everything still buffered, open minutes included."""
+        self._stop.set()
+        self.flush(final=True)
+
+    # ---------------------------- Reading ----------------------------
+
+    def _block_headers(self, day: str, start: float, end: float, handles: Dict[Path, object]) -> List[tuple]:
+        """``(ts_min, ts_max, segment, offset, rows, meta_len)`` for the day's blocks overlapping
+        [start, end]. Only headers are read; bodies are skipped with a seek. Each segment is
+        opened once into ``handles`` and its blocks must be read through that handle: a
+        compaction may replace the file, and the open handle keeps the version scanned."""
+        folder = self.folder / day
+        headers = []
+        if not folder.is_dir():
+            return headers
+        for seg in sorted(folder.glob('*.seg')):
+            try:
+                f = handles[seg] = open(seg, 'rb')
+            except FileNotFoundError:
+                continue
+            for offset, rows, ts_min, ts_max, meta_len, _ in _scan(f, os.fstat(f.fileno()).st_size):
+                if ts_max >= start and ts_min <= end:
+                    headers.append((ts_min, ts_max, seg, offset, rows, meta_len))
+        return headers
+
+    def _blocks(self, start: float, end: float, newest_first: bool = False) -> Iterator[tuple]:
+        """Yield ``(columns, dictionary, ts_max)`` for blocks overlapping [start, end].
+
+        Blocks are read one at a time, so memory is bounded by a block rather than a
+        segment file. ``newest_first`` walks days and blocks by descending ``ts_max``.
+        """
+        days = _days_between(start, end)
+        dictionaries: Dict[bytes, dict] = {}
+        for day in reversed(days) if newest_first else days:
+            handles: Dict[Path, object] = {}
+            try:
+                headers = self._block_headers(day, start, end, handles)
+                if newest_first:
+                    headers.sort(key=lambda h: h[1], reverse=True)
+                for _, ts_max, seg, offset, rows, meta_len in headers:
+                    f = handles[seg]
+                    f.seek(offset + BLOCK_HEADER.size)
+                    meta = f.read(meta_len)
+                    # Consecutive blocks of a process usually share their dictionary
+                    dictionary = dictionaries.get(meta)
+                    if dictionary is None:
+                        dictionary = dictionaries[meta] = json.loads(meta)
+                    yield _read_columns(f, rows), dictionary, ts_max
+            finally:
+                for f in handles.values():
+                    f.close()
+
+    def query(self, start: float, end: float, camera: Optional[str] = None, min_score: float = 0.0,
+              limit: Optional[int] = 1000) -> List[dict]:
+        """Raw rows in [start, end], newest first.
+
+        Matching rows stay in numpy columns and are cut down to the newest ``limit`` as
+        blocks are read; dicts are only built for the rows returned.
+        """
+        self.flush()
+        camera_ids: Dict[str, int] = {}
+        indicator_sets: Dict[tuple, int] = {}
+        parts: List[Dict[str, np.ndarray]] = []
+        pending = 0
+        oldest_kept = None
+        for columns, dictionary, ts_max in self._blocks(start, end, newest_first=bool(limit)):
+            if oldest_kept is not None and ts_max < oldest_kept:
+                break  # Every remaining block is older than the newest ``limit`` rows already found
+            mask = (columns['ts'] >= start) & (columns['ts'] <= end) & (columns['score'] >= min_score)
+            cameras = dictionary['cameras']
+            if camera is not None:
+                if camera not in cameras:
+                    continue
+                mask &= columns['camera'] == cameras.index(camera)
+            idx = np.nonzero(mask)[0]
+            if not len(idx):
+                continue
+            # Block dictionaries differ between processes: map cameras to query-wide ids and
+            # remember which indicator list each row's bitmask refers to
+            remap = np.array([camera_ids.setdefault(name, len(camera_ids)) for name in cameras], dtype=np.int32)
+            indicator_set = indicator_sets.setdefault(tuple(dictionary['indicators']), len(indicator_sets))
+            parts.append({
+                'ts': columns['ts'][idx],
+                'score': columns['score'][idx],
+                'latency_ms': columns['latency_ms'][idx],
+                'camera': remap[columns['camera'][idx]],
+                'indicators': columns['indicators'][idx],
+                'flags': columns['flags'][idx],
+                'indicator_set': np.full(len(idx), indicator_set, dtype=np.int32),
+            })
+            pending += len(idx)
+            if limit and pending >= limit:
+                parts = [self._newest(parts, limit)]
+                pending = len(parts[0]['ts'])
+                oldest_kept = float(parts[0]['ts'].min())
+        if not parts:
+            return []
+        selected = self._newest(parts, limit)
+        order = np.argsort(-selected['ts'], kind='stable')
+        camera_names = sorted(camera_ids, key=camera_ids.get)
+        indicator_names = sorted(indicator_sets, key=indicator_sets.get)
+        rows = []
+        for i in order:
+            bits = int(selected['indicators'][i])
+            names = [name for bit, name in enumerate(indicator_names[int(selected['indicator_set'][i])]) if bits >> bit & 1]
+            if bits & OTHER_INDICATOR:
+                names.append('other')
+            flags = int(selected['flags'][i])
+            rows.append({
+                'ts': float(selected['ts'][i]),
+                'camera': camera_names[int(selected['camera'][i])],
+                'score': round(float(selected['score'][i]), 4),
+                'indicators': names,
+                'latency_ms': round(float(selected['latency_ms'][i]), 1),
+                'skipped': bool(flags & FLAG_SKIPPED),
+                'failed': bool(flags & FLAG_FAILED),
+                'cached': bool(flags & FLAG_CACHED),
+                'flagged': bool(flags & FLAG_FLAGGED),
+            })
+        return rows
+
+    @staticmethod
+    def _newest(parts: List[Dict[str, np.ndarray]], limit: Optional[int]) -> Dict[str, np.ndarray]:
+        merged = parts[0] if len(parts) == 1 else {k: np.concatenate([p[k] for p in parts]) for k in parts[0]}
+        if limit and len(merged['ts']) > limit:
+            keep = np.argpartition(-merged['ts'], limit - 1)[:limit]
+            merged = {k: v[keep] for k, v in merged.items()}
+        return merged
+
+    def rollup(self, start: float, end: float, camera: Optional[str] = None, bucket: int = 60) -> List[dict]:
+        """Per-camera aggregates in ``bucket``-second steps (a multiple of 60), from the rollup files."""
+        self.flush()
+        bucket = max(60, int(bucket) // 60 * 60)
+        merged: Dict[tuple, list] = {}
+
+        def add(minute, cam, count, total, peak, hits) -> None:
+            if not start <= minute <= end or (camera is not None and cam != camera):
+                return
+            key = (minute // bucket * bucket, cam)
+            agg = merged.get(key)
+            if agg is None:
+                merged[key] = [count, total, peak, hits]
+            else:
+                agg[0] += count
+                agg[1] += total
+                agg[2] = max(agg[2], peak)
+                agg[3] += hits
+
+        # Minutes still open in this process; other workers' open minutes show up once closed
+        with self._lock:
+            for (minute, cam), values in self._open_rollups.items():
+                add(minute, cam, *values)
+        for day in _days_between(start, end):
+            for path in (self.folder / day).glob('*.rollup'):
+                with open(path, 'r') as f:
+                    for line in f:
+                        try:
+                            values = json.loads(line)
+                        except ValueError:
+                            continue
+                        add(*values)
+        return [
+            {'ts': ts, 'camera': cam, 'count': c, 'mean': round(t / c, 4) if c else 0.0, 'max': round(p, 4), 'flagged': h}
+            for (ts, cam), (c, t, p, h) in sorted(merged.items())
+        ]
+
+    def threshold_counts(self, start: float, end: float, thresholds: Sequence[float], camera: Optional[str] = None) -> dict:
+        """How many checks would have crossed each candidate alert threshold."""
+        self.flush()
+        counts = {t: 0 for t in thresholds}
+        total = 0
+        for columns, dictionary, _ in self._blocks(start, end):
+            mask = (columns['ts'] >= start) & (columns['ts'] <= end) & ((columns['flags'] & (FLAG_SKIPPED | FLAG_FAILED)) == 0)
+            if camera is not None:
+                if camera not in dictionary['cameras']:
+                    continue
+                mask &= columns['camera'] == dictionary['cameras'].index(camera)
+            scores = columns['score'][mask]
+            total += len(scores)
+            for t in thresholds:
+                counts[t] += int((scores >= t).sum())
+        return {'checks': total, 'above': {str(t): n for t, n in counts.items()}}
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = len(self._buffer['ts'])
+        return {'pending': pending, 'open_rollup_minutes': len(self._open_rollups), 'rows_written': self.rows_written, 'flushes': self.flushes, 'compactions': self.compactions, 'bytes_per_row': ROW_BYTES}
+
+
+if __name__ == '__main__':
+    import argparse
+    import random
+    import tempfile
+
+    parser = argparse.ArgumentParser(description='Benchmark the risk history store')
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--cameras', type=int, default=8)
+    parser.add_argument('--flush-seconds', type=float, default=2.0, help='Simulated flush interval (as in the app)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        history = RiskHistory(tmp, flush_interval=args.flush_seconds)
+        names = [f'cam{i}' for i in range(args.cameras)]
+        labels = ['rope', 'knife', 'pills', 'distress']
+        now = time.time()
+        step = 86400 / args.rows
+        record_time = 0.0
+        flush_time = 0.0
+        next_flush = now - 86400 + args.flush_seconds
+        for i in range(args.rows):
+            ts = now - 86400 + i * step
+            if ts >= next_flush:
+                # Flush on the simulated clock, the way the background thread would
+                started = time.perf_counter()
+                history.flush()
+                flush_time += time.perf_counter() - started
+                next_flush = ts + args.flush_seconds
+            indicators = [random.choice(labels)] if i % 50 == 0 else ()
+            started = time.perf_counter()
+            history.record(names[i % args.cameras], random.random() * 0.3, indicators, 800.0, ts=ts)
+            record_time += time.perf_counter() - started
+        started = time.perf_counter()
+        history.stop()
+        flush_time += time.perf_counter() - started
+        size = sum(p.stat().st_size for p in Path(tmp).rglob('*') if p.is_file())
+        rollup_lines = sum(sum(1 for _ in open(p)) for p in Path(tmp).rglob('*.rollup'))
+        print(f'record   {record_time / args.rows * 1e6:.2f} us/row')
+        print(f'flush    {flush_time / args.rows * 1e6:.2f} us/row (background thread)')
+        blocks = 0
+        for seg in Path(tmp).rglob('*.seg'):
+            with open(seg, 'rb') as f:
+                blocks += sum(1 for _ in _scan(f, os.fstat(f.fileno()).st_size))
+        print(f'disk     {size / args.rows:.1f} bytes/row ({size / 1e6:.1f}MB), {history.flushes} flushes -> {blocks} blocks')
+        print(f'rollups  {rollup_lines} lines ({args.cameras} cameras x 1440 minutes = {args.cameras * 1440})')
+        started = time.perf_counter()
+        rows = history.query(now - 3600, now, camera='cam0', limit=None)
+        print(f'query    1h of cam0: {len(rows)} rows in {(time.perf_counter() - started) * 1000:.1f}ms')
+        started = time.perf_counter()
+        rows = history.query(now - 86400, now, limit=1000)
+        print(f'query    24h newest 1000: {len(rows)} rows in {(time.perf_counter() - started) * 1000:.1f}ms')
+        started = time.perf_counter()
+        buckets = history.rollup(now - 86400, now, bucket=3600)
+        print(f'rollup   24h hourly: {len(buckets)} buckets in {(time.perf_counter() - started) * 1000:.1f}ms')
+        started = time.perf_counter()
+        report = history.threshold_counts(now - 86400, now, [0.1, 0.2, 0.25])
+        print(f'threshold scan 24h: {report["checks"]} checks in {(time.perf_counter() - started) * 1000:.1f}ms')
@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import BinaryIO, Callable, Dict, Iterator, Optional, Tuple
+
+from werkzeug.exceptions import ClientDisconnected
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+
+CHUNK_SIZE = 64 * 1024
+# Parts larger than this spill from memory to a temporary file
+SPOOL_MAX_BYTES = 1024 * 1024
+# Form field values past this are ignored
+MAX_FIELD_BYTES = 64 * 1024
+
+
+def _read(stream: BinaryIO) -> bytes:
+    try:
+        return stream.read(CHUNK_SIZE)
+    except ClientDisconnected:
+        return b''
+
+
+def iter_multipart(stream: BinaryIO, content_type: str) -> Iterator[Tuple[str, Optional[str], BinaryIO, bool]]:
+    """Yield ``(name, filename, body, complete)`` for each multipart part as soon as it has arrived.
+
+    ``filename`` is None for plain form fields. ``body`` is a temporary file, written as
+    the part's data arrives and rewound for reading; it is closed once the caller moves
+    on to the next part. ``complete`` is False for a part cut short by the end of the
+    stream (client gone). Unlike ``request.files`` this doesn't wait for the whole
+    request body, so the caller can act on the first file while later ones are still
+    uploading.
+    """
+    mimetype, options = parse_options_header(content_type or '')
+    boundary = options.get('boundary')
+    if mimetype != 'multipart/form-data' or not boundary:
+        raise ValueError('expected multipart/form-data with a boundary')
+    decoder = MultipartDecoder(boundary.encode('latin-1'))
+    part = None
+    body = None
+    finished = False
+    try:
+        while not finished:
+            data = _read(stream)
+            if not data:
+                break
+            decoder.receive_data(data)
+            event = decoder.next_event()
+            while not isinstance(event, NeedData):
+                if isinstance(event, (Field, File)):
+                    part = event
+                    body = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+                elif isinstance(event, Data):
+                    if body is not None:
+                        body.write(event.data)
+                    if not event.more_data and part is not None:
+                        body.seek(0)
+                        yield part.name, getattr(part, 'filename', None), body, True
+                        body.close()
+                        part = body = None
+                elif isinstance(event, Epilogue):
+                    finished = True
+                    break
+                event = decoder.next_event()
+        if part is not None and not finished:
+            body.seek(0)
+            yield part.name, getattr(part, 'filename', None), body, False
+    finally:
+        if body is not None:
+            body.close()
+
+
+class UploadTracker:
+    """Per-file status of upload batches, reported through ``emit`` as it changes."""
+
+    def __init__(self, emit: Optional[Callable[[dict], None]] = None, max_batches: int = 100):
+        self.emit = emit
+        self.max_batches = max_batches
+        self._batches: 'OrderedDict[str, dict]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def new_batch(self) -> str:
+        batch_id = uuid.uuid4().hex[:12]
+        with self._lock:
+            self._batches[batch_id] = {'batch': batch_id, 'created': time.time(), 'complete': False, 'files': OrderedDict()}
+            while len(self._batches) > self.max_batches:
+                self._batches.popitem(last=False)
+        return batch_id
+
+    def update(self, batch_id: str, filename: str, status: str, **details) -> None:
+        with self._lock:
+            batch = self._batches.get(batch_id)
+            if batch is None:
+                return
+            entry = batch['files'].setdefault(filename, {'file': filename})
+            entry.update(details, status=status, updated=time.time())
+            event = dict(entry, batch=batch_id, **self._progress(batch))
+        if self.emit is not None:
+            self.emit(event)
+
+    def close(self, batch_id: str) -> None:
+        """Mark that no more files will be added to the batch."""
+        with self._lock:
+            batch = self._batches.get(batch_id)
+            if batch is not None:
+                batch['complete'] = True
+
+    def get(self, batch_id: str) -> Optional[dict]:
+        with self._lock:
+            batch = self._batches.get(batch_id)
+            if batch is None:
+                return None
+            return {
+                'batch': batch_id,
+                'created': batch['created'],
+                'complete': batch['complete'],
+                'files': [dict(entry) for entry in batch['files'].values()],
+                **self._progress(batch),
+            }
+
+    @staticmethod
+    def _progress(batch: dict) -> Dict[str, int]:
+        files = batch['files'].values()
+        done = sum(1 for entry in files if entry['status'] in ('done', 'failed', 'skipped', 'saved'))
+        return {'done': done, 'total': len(batch['files'])}
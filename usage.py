@@ -0,0 +1,241 @@
+"""Model usage accounting: tokens, image bytes, attempts and latency per (task, source).
+
+Every model request made through ``detector`` is recorded here, along with results
+that were served without one (cache hits, pre-screen skips, budget/breaker rejections).
+Totals are kept in memory for ``/api/usage``. A background thread appends the
+per-interval deltas to ``USAGE_LOG`` as JSON lines, so spend can be compared across
+settings (resize width, JPEG quality, caching, ...) after the fact.
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Deque, Dict, Optional, Tuple
+
+# Outcomes besides a model request: served from cache, skipped by the pre-screen,
+# refused by the budget or breaker
+OUTCOMES = ('ok', 'failed', 'cached', 'skipped', 'rejected')
+MAX_SOURCES = 256
+OTHER_SOURCE = 'other'
+LATENCY_SAMPLES = 512
+
+
+def _float_env(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, '') or default)
+    except ValueError:
+        return default
+
+
+@dataclass
+class _Counters:
+    requests: int = 0
+    attempts: int = 0
+    ok: int = 0
+    failed: int = 0
+    cached: int = 0
+    skipped: int = 0
+    rejected: int = 0
+    prompt_tokens: int = 0
+    output_tokens: int = 0
+    total_tokens: int = 0
+    image_bytes: int = 0
+    latency_ms: float = 0.0
+
+    def add(self, other: '_Counters') -> None:
+        for name, value in asdict(other).items():
+            setattr(self, name, getattr(self, name) + value)
+
+    def delta(self, since: '_Counters') -> '_Counters':
+        return _Counters(**{name: value - getattr(since, name) for name, value in asdict(self).items()})
+
+
+@dataclass
+class _Key:
+    totals: _Counters = field(default_factory=_Counters)
+    flushed: _Counters = field(default_factory=_Counters)
+    latencies: Deque[float] = field(default_factory=lambda: deque(maxlen=LATENCY_SAMPLES))
+    latency_max: float = 0.0
+
+
+def _percentile(values, q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 1)
+
+
+class UsageTracker:
+    """In-memory usage totals keyed by (task, source), with optional periodic JSONL flush.
+
+    ``price_input``/``price_output`` (USD per million tokens) turn token counts into an
+    estimated cost. Sources beyond ``MAX_SOURCES`` are folded into ``other``.
+    """
+
+    def __init__(
+        self,
+        log_path: Optional[str] = None,
+        flush_interval: float = 60.0,
+        price_input: float = 0.0,
+        price_output: float = 0.0,
+    ):
+        self.log_path = Path(log_path) if log_path else None
+        self.flush_interval = flush_interval
+        self.price_input = price_input
+        self.price_output = price_output
+        self.started = time.time()
+        self._keys: Dict[Tuple[str, str], _Key] = {}
+        self._sources: set = set()
+        self._lock = threading.Lock()
+        self._last_flush = time.time()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_env(cls) -> 'UsageTracker':
+        return cls(
+            log_path=os.getenv('USAGE_LOG', str(Path('state') / 'usage.jsonl')) or None,
+            flush_interval=_float_env('USAGE_FLUSH_SECONDS', 60.0),
+            price_input=_float_env('MODEL_PRICE_INPUT_PER_MTOK', 0.0),
+            price_output=_float_env('MODEL_PRICE_OUTPUT_PER_MTOK', 0.0),
+        )
+
+    def _key(self, task: str, source: Optional[str]) -> _Key:
+        source = source or 'unknown'
+        if source not in self._sources:
+            if len(self._sources) >= MAX_SOURCES:
+                source = OTHER_SOURCE
+            else:
+                self._sources.add(source)
+        return self._keys.setdefault((task, source), _Key())
+
+    def record(
+        self,
+        task: str,
+        source: Optional[str],
+        outcome: str,
+        *,
+        attempts: int = 0,
+        latency_ms: float = 0.0,
+        image_bytes: int = 0,
+        prompt_tokens: int = 0,
+        output_tokens: int = 0,
+        total_tokens: int = 0,
+    ) -> None:
+        """Record one model request (``ok``/``failed``) or a result served without one."""
+        counters = _Counters(
+            requests=1 if outcome in ('ok', 'failed') else 0,
+            attempts=attempts,
+            prompt_tokens=prompt_tokens,
+            output_tokens=output_tokens,
+            total_tokens=total_tokens or prompt_tokens + output_tokens,
+            image_bytes=image_bytes,
+            latency_ms=latency_ms,
+        )
+        setattr(counters, outcome, 1)
+        with self._lock:
+            key = self._key(task, source)
+            key.totals.add(counters)
+            if counters.requests:
+                key.latencies.append(latency_ms)
+                key.latency_max = max(key.latency_max, latency_ms)
+
+    def _cost(self, counters: _Counters) -> float:
+        return (counters.prompt_tokens * self.price_input + counters.output_tokens * self.price_output) / 1e6
+
+    def _describe(self, counters: _Counters, latencies=(), latency_max: float = 0.0) -> dict:
+        out = asdict(counters)
+        out['latency_ms'] = round(counters.latency_ms, 1)
+        served = counters.requests + counters.cached + counters.skipped
+        out['requests_avoided_rate'] = round((counters.cached + counters.skipped) / served, 4) if served else 0.0
+        if counters.requests:
+            out['tokens_per_request'] = round(counters.total_tokens / counters.requests, 1)
+            out['image_kb_per_request'] = round(counters.image_bytes / counters.requests / 1024, 1)
+            out['latency_ms_avg'] = round(counters.latency_ms / counters.requests, 1)
+            out['retries'] = counters.attempts - counters.requests
+        if latencies:
+            out['latency_ms_p50'] = _percentile(latencies, 0.5)
+            out['latency_ms_p95'] = _percentile(latencies, 0.95)
+            out['latency_ms_max'] = round(latency_max, 1)
+        if self.price_input or self.price_output:
+            out['cost_usd'] = round(self._cost(counters), 6)
+        return out
+
+    def summary(self, group_by: str = 'task') -> dict:
+        """Totals since start, grouped by ``task``, ``source`` or ``task,source``."""
+        fields = [f.strip() for f in group_by.split(',') if f.strip()]
+        if not fields or any(f not in ('task', 'source') for f in fields):
+            raise ValueError("group_by must be 'task', 'source' or 'task,source'")
+        groups: Dict[str, Tuple[_Counters, list, float]] = {}
+        total = _Counters()
+        with self._lock:
+            for (task, source), key in self._keys.items():
+                label = '/'.join(task if f == 'task' else source for f in fields)
+                counters, latencies, latency_max = groups.get(label, (_Counters(), [], 0.0))
+                counters.add(key.totals)
+                latencies.extend(key.latencies)
+                groups[label] = (counters, latencies, max(latency_max, key.latency_max))
+                total.add(key.totals)
+        return {
+            'since': self.started,
+            'group_by': ','.join(fields),
+            'total': self._describe(total),
+            'groups': {label: self._describe(*value) for label, value in sorted(groups.items())},
+        }
+
+    def flush(self) -> int:
+        """Append one JSON line per (task, source) that changed since the last flush."""
+        now = time.time()
+        with self._lock:
+            window = now - self._last_flush
+            self._last_flush = now
+            rows = []
+            for (task, source), key in self._keys.items():
+                delta = key.totals.delta(key.flushed)
+                if not any(asdict(delta).values()):
+                    continue
+                key.flushed = _Counters(**asdict(key.totals))
+                rows.append(dict(self._describe(delta), ts=round(now, 3), window_s=round(window, 1), task=task, source=source, pid=os.getpid()))
+        if rows and self.log_path is not None:
+            self.log_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.log_path, 'a', encoding='utf-8') as fh:
+                fh.write(''.join(json.dumps(row, separators=(',', ':')) + '\n' for row in rows))
+        return len(rows)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:  # noqa
+                print('[usage] flush failed:', e)
+
+    def start(self) -> None:
+        if self._thread is None and self.log_path is not None and self.flush_interval > 0:
+            self._thread = threading.Thread(target=self._run, name='usage-flush', daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
+
+
+_TRACKER: Optional[UsageTracker] = None
+_TRACKER_LOCK = threading.Lock()
+
+
+def get_usage_tracker() -> UsageTracker:
+    """Process-wide tracker configured from ``USAGE_LOG``/``USAGE_FLUSH_SECONDS``."""
+    global _TRACKER
+    if _TRACKER is None:
+        with _TRACKER_LOCK:
+            if _TRACKER is None:
+                _TRACKER = UsageTracker.from_env()
+    return _TRACKER